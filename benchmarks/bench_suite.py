@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: data loading, expand_prompt and before_process_batch on synthetic libraries
+
+    python benchmarks/bench_suite.py [--sizes 1000 10000 100000] [--output results.json]
+                                     [--compare previous.json] [--quick]
+
+合成データ（キャラクター数ごと、サブディレクトリを含む）を生成し、各処理の ops/sec・
+p50/p99 レイテンシ・ピークメモリを計測する。結果はJSONに保存でき、--compareで
+別のコミットの結果と比較できる。
+
+展開のベンチマークは展開結果キャッシュを無効にして実行する（有効だと2回目以降はキャッシュの
+ヒットを計測することになる）。キャッシュのヒット時の速さは expand_prompt/result_cache_hit で計測する。
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, project_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+
+# before_process_batchを呼ぶためにWebUIのmodules.scriptsを用意する
+class MockScript:
+    pass
+
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+
+sys.modules.setdefault('modules', type(sys)('modules'))
+sys.modules.setdefault('modules.scripts', MockScripts())
+
+from synthetic import write_library
+
+# 展開結果キャッシュのヒットを計測するときのキャッシュの件数（既定値と同じ）
+RESULT_CACHE_SIZE = 4096
+
+# 展開ケース: 名前 -> テンプレート（キーは合成データの命名規則に合わせる）
+EXPAND_CASES = {
+    "single": "masterpiece, @characters:chara_000001, @situations:situation_00001",
+    "multi_character": "2girls, @characters:chara_000001, @characters/part_0:chara_000002, @situations:situation_00002",
+    "random": "@characters:random, @situations:random, @effects:random",
+    "random_filtered": "@characters:random[tag=group_3], @situations:random",
+    "include": "@characters:chara_000010, @situations/nested/include:situation_00000",
+    "exclude": "@characters:chara_000010, @situations:situation_00003",
+}
+
+
+class MockProcessing:
+    """before_process_batchに渡すStableDiffusionProcessingの代わり"""
+
+    def __init__(self, prompts, seeds):
+        self.prompts = list(prompts)
+        self.all_prompts = list(prompts)
+        self.all_seeds = list(seeds)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(name, size, func, iterations, memory_iterations, setup=None):
+    """funcをiterations回計測し、別に memory_iterations 回の実行でピークメモリを計測する
+
+    setupは各回の直前に呼ばれ（計測外）、その戻り値がfuncに渡される。
+    """
+    latencies = []
+    gc.collect()
+    for i in range(iterations):
+        arg = setup(i) if setup is not None else i
+        started = time.perf_counter_ns()
+        func(arg)
+        latencies.append(time.perf_counter_ns() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for i in range(memory_iterations):
+            arg = setup(i) if setup is not None else i
+            tracemalloc.reset_peak()
+            func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    total = sum(latencies)
+    result = {
+        "name": name,
+        "size": size,
+        "iterations": iterations,
+        "ops_per_sec": iterations / (total / 1e9) if total else 0.0,
+        "mean_us": total / iterations / 1000,
+        "p50_us": percentile(latencies, 0.50) / 1000,
+        "p99_us": percentile(latencies, 0.99) / 1000,
+        "peak_memory_bytes": peak,
+    }
+    print(f"{name:<36} {size:>7} {result['ops_per_sec']:>12.1f} {result['p50_us']:>12.1f} "
+          f"{result['p99_us']:>12.1f} {peak / 1024:>10.0f}")
+    return result
+
+
+def run_size(size, args, chara_situation, yaml_cache, result_cache):
+    """1つのライブラリサイズについてすべてのベンチマークを実行する"""
+    results = []
+    data_dir = tempfile.mkdtemp(prefix=f"chara_bench_{size}_")
+    try:
+        started = time.perf_counter()
+        write_library(data_dir, size, situations=args.situations, nested_files=4)
+        print(f"-- {size} characters (generated in {time.perf_counter() - started:.1f}s)")
+
+        script = chara_situation.CharaSituationScript()
+        script.data_dir = data_dir
+        script.pack_mode = "off"
+        script.log_expansions = False
+        if args.watch:
+            script.start_watching()
+
+        # ファイルが大きいほど1回が重いので回数を減らす
+        load_iterations = max(3, min(args.iterations // 10, 200_000 // size))
+
+        # load_yamlはキャッシュを使わずに毎回パースする（YAMLのパース自体の速さ）
+        results.append(measure("load_yaml/uncached_parse", size, lambda _: script.load_yaml("characters"),
+                               load_iterations, 1))
+
+        def invalidate(_):
+            yaml_cache.invalidate()
+
+        results.append(measure("load_data_file/cold", size, lambda _: script.load_data_file("characters"),
+                               load_iterations, 1, setup=invalidate))
+
+        for filename in ("characters", "characters/part_0", "characters/part_1", "situations",
+                         "situations/nested/include", "effects"):
+            script.load_data_file(filename)
+        results.append(measure("load_data_file/warm", size, lambda _: script.load_data_file("characters"),
+                               args.iterations, 100))
+
+        for case, template in EXPAND_CASES.items():
+            results.append(measure(f"expand_prompt/{case}", size, lambda seed: script.expand_prompt(template, seed),
+                                   args.iterations, 100))
+
+        # 展開結果キャッシュのヒット（同じ固定キーのプロンプトを繰り返す）
+        result_cache.resize(RESULT_CACHE_SIZE)
+        try:
+            template = EXPAND_CASES["single"]
+            results.append(measure("expand_prompt/result_cache_hit", size,
+                                   lambda seed: script.expand_prompt(template, seed), args.iterations, 100))
+        finally:
+            result_cache.clear()
+            result_cache.resize(0)
+
+        batch_template = EXPAND_CASES["random"]
+
+        def make_batch(i):
+            seeds = range(i * args.batch_size, (i + 1) * args.batch_size)
+            return MockProcessing([batch_template] * args.batch_size, seeds)
+
+        results.append(measure(f"before_process_batch/{args.batch_size}", size,
+                               lambda p: script.before_process_batch(p),
+                               max(3, args.iterations // args.batch_size), 3, setup=make_batch))
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(data_dir)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """baselineと比較してops/secの変化を表示し、threshold以上遅くなったベンチマーク数を返す"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+
+    print(f"\nComparison with {baseline_path} ({baseline['meta'].get('revision')})")
+    print(f"{'benchmark':<36} {'size':>7} {'before':>12} {'after':>12} {'change':>8}")
+    regressions = 0
+    for result in results:
+        before = previous.get((result["name"], result["size"]))
+        if before is None or not before["ops_per_sec"]:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1.0
+        mark = ""
+        if change < -threshold:
+            mark = "  REGRESSION"
+            regressions += 1
+        print(f"{result['name']:<36} {result['size']:>7} {before['ops_per_sec']:>12.1f} "
+              f"{result['ops_per_sec']:>12.1f} {change:>+7.1%}{mark}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="キャラクター数（ライブラリごと）")
+    parser.add_argument("--situations", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=2000, help="展開ベンチマークの実行回数")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--watch", action="store_true", help="ファイル監視を有効にして計測する")
+    parser.add_argument("--quick", action="store_true", help="小さいライブラリで短時間だけ実行する")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回帰とみなすops/secの低下率")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes = [1000]
+        args.situations = 100
+        args.iterations = 200
+
+    # 計測に関係しない監視・プリウォームは無効にする（--watchで監視だけ有効にできる）
+    os.environ["CHARA_SITUATION_WATCH"] = "off"
+    os.environ["CHARA_SITUATION_PREWARM"] = "off"
+    # 展開のベンチマークが毎回展開するよう、展開結果キャッシュは無効にする
+    os.environ["CHARA_SITUATION_RESULT_CACHE_SIZE"] = "0"
+    import chara_situation
+    from lib_chara_situation import yamlio
+    from lib_chara_situation.datafile import yaml_cache
+    from lib_chara_situation.results import result_cache
+
+    meta = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "yaml_backend": yamlio.BACKEND,
+        "watch": args.watch,
+        "iterations": args.iterations,
+        "batch_size": args.batch_size,
+        "result_cache": False,
+    }
+    print(f"revision {meta['revision']}, Python {meta['python']}, YAML {meta['yaml_backend']}")
+    print(f"{'benchmark':<36} {'size':>7} {'ops/sec':>12} {'p50 (us)':>12} {'p99 (us)':>12} {'peak (KiB)':>10}")
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, args, chara_situation, yaml_cache, result_cache))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{regressions} benchmark(s) slower than the threshold ({args.threshold:.0%})")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
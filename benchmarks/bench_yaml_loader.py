@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark: libyaml (CSafeLoader) vs pure-Python (SafeLoader) parsing of large character files
+
+    python benchmarks/bench_yaml_loader.py [--characters 1000 10000 50000] [--repeat 3]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+
+import yaml
+
+from lib_chara_situation import yamlio
+from synthetic import character_yaml
+
+
+def best_of(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--characters", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    c_loader = getattr(yaml, "CSafeLoader", None)
+    print(f"Active backend: {yamlio.BACKEND}")
+    if c_loader is None:
+        print("PyYAML was built without libyaml; only the pure-Python loader is available.")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'characters':>10} {'size':>10} {'SafeLoader':>12} {'CSafeLoader':>12} {'speedup':>8} {'identical':>9}")
+        for count in args.characters:
+            path = os.path.join(temp_dir, f"characters_{count}.yaml")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(character_yaml(count))
+
+            py_time, py_data = best_of(lambda: yamlio.parse_file(path, yaml.SafeLoader), args.repeat)
+            if c_loader is not None:
+                c_time, c_data = best_of(lambda: yamlio.parse_file(path, c_loader), args.repeat)
+                identical = "yes" if c_data == py_data else "NO"
+                print(f"{count:>10} {os.path.getsize(path):>10} {py_time:>11.3f}s {c_time:>11.3f}s "
+                      f"{py_time / c_time:>7.1f}x {identical:>9}")
+            else:
+                print(f"{count:>10} {os.path.getsize(path):>10} {py_time:>11.3f}s {'-':>12} {'-':>8} {'-':>9}")
+    finally:
+        shutil.rmtree(temp_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
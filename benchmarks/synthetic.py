@@ -0,0 +1,83 @@
+"""
+ベンチマーク用の合成データを生成する
+"""
+
+import os
+import random
+
+HAIR = ["black hair", "blonde hair", "silver hair", "red hair", "blue hair", "long hair", "short hair",
+        "twintails", "ponytail", "hair ribbon", "ahoge", "braid"]
+EYES = ["red eyes", "blue eyes", "green eyes", "yellow eyes", "purple eyes", "heterochromia"]
+TOPS = ["white shirt", "black vest", "sailor collar", "hoodie", "blouse", "jacket", "sweater"]
+BOTTOMS = ["skirt", "pleated skirt", "shorts", "jeans", "hakama", "pantyhose"]
+SHOES = ["boots", "loafers", "sneakers", "sandals", "high heels"]
+ACCESSORIES = ["hat", "glasses", "necklace", "earrings", "gloves", "scarf", "wings", "tail"]
+BODIES = ["small breasts", "medium breasts", "large breasts", "petite", "tall"]
+FIELDS = ["top", "bottom", "shoes", "accessory", "eye", "hair"]
+SCENES = ["beach", "classroom", "bedroom", "forest", "city", "library", "shrine", "castle", "space"]
+
+
+def _pick(rng, values, n):
+    return rng.sample(values, n)
+
+
+def character_yaml(count, seed=0, array_ratio=0.5, weights=False):
+    """count人分のキャラクター定義のYAML文字列"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(f"chara_{i:06d}:")
+        if weights:
+            lines.append(f"  weight: {rng.randint(1, 5)}")
+        lines.append(f"  tag: group_{i % 20}")
+        lines.append(f"  base: 1girl, <lora:chara_{i}:0.8>")
+        for field, values, n in (("hair", HAIR, 3), ("eye", EYES, 1), ("top", TOPS, 2),
+                                 ("bottom", BOTTOMS, 1), ("shoes", SHOES, 1),
+                                 ("accessory", ACCESSORIES, 2), ("body", BODIES, 1)):
+            picked = _pick(rng, values, n)
+            if n > 1 and rng.random() < array_ratio:
+                lines.append(f"  {field}:")
+                lines.extend(f"    - {value}" for value in picked)
+            else:
+                lines.append(f"  {field}: {', '.join(picked)}")
+    return "\n".join(lines) + "\n"
+
+
+def situation_yaml(count, seed=0, include_ratio=0.0):
+    """count件のシチュエーション定義のYAML文字列"""
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append(f"situation_{i:05d}:")
+        lines.append("  prompt:")
+        lines.append(f"    - {', '.join(_pick(rng, TOPS + BOTTOMS, 3))}, standing")
+        lines.append(f"    - {rng.choice(SCENES)}, {rng.choice(['day', 'night', 'sunset'])}")
+        mode = "include" if rng.random() < include_ratio else "exclude"
+        lines.append(f"  {mode}:")
+        lines.extend(f"    - {field}" for field in _pick(rng, FIELDS, rng.randint(1, 4)))
+    return "\n".join(lines) + "\n"
+
+
+def write_library(data_dir, characters, situations=100, effects=20, nested_files=4, seed=0):
+    """合成データライブラリをdata_dirに書き出し、ファイル名の一覧を返す
+
+    characters人のキャラクターを characters.yaml と characters/part_N.yaml に分けて書き出す。
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    written = []
+
+    def write(name, text):
+        path = os.path.join(data_dir, f"{name}.yaml")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        written.append(name)
+
+    write("characters", character_yaml(characters, seed))
+    per_file = max(characters // max(nested_files, 1), 1)
+    for i in range(nested_files):
+        write(f"characters/part_{i}", character_yaml(per_file, seed + i + 1, weights=(i % 2 == 1)))
+    write("situations", situation_yaml(situations, seed))
+    write("situations/nested/include", situation_yaml(max(situations // 10, 1), seed, include_ratio=1.0))
+    write("effects", "".join(f"effect_{i}:\n  prompt: sparkles, glow_{i}\n" for i in range(effects)))
+    return written
@@ -0,0 +1 @@
+# sd-chara-situation library (WebUIに依存しない処理)
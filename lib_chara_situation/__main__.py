@@ -0,0 +1,172 @@
+"""
+sd-chara-situation のコマンドラインツール
+
+    python -m lib_chara_situation compile [--data-dir DIR] [--output PATH]
+    python -m lib_chara_situation expand (--template TEXT ... | --templates-file PATH)
+                                         [--seed-start N] [--count N] [--jobs N] [--mode compat|hash]
+                                         [--format jsonl|csv|text] [--output PATH]
+    python -m lib_chara_situation enumerate --template TEXT ... [--shard I/N] [--no-dedupe]
+                                            [--format jsonl|csv|text] [--output PATH]
+    python -m lib_chara_situation serve [--host HOST] [--port N | --socket PATH] [--batch-delay SEC]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from . import datapack
+
+EXTENSION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA_DIR = os.path.join(EXTENSION_DIR, "data")
+
+
+def cmd_compile(args):
+    if not os.path.isdir(args.data_dir):
+        print(f"Data directory not found: {args.data_dir}", file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    count = datapack.compile_pack(args.data_dir, args.output)
+    elapsed = time.perf_counter() - started
+    output = args.output or datapack.pack_path_for(args.data_dir)
+    print(f"Compiled {count} files into {output} ({os.path.getsize(output)} bytes, {elapsed:.2f}s)")
+    return 0
+
+
+def cmd_expand(args):
+    from . import bulk
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Data directory not found: {args.data_dir}", file=sys.stderr)
+        return 2
+    templates = list(args.template or [])
+    if args.templates_file:
+        templates.extend(bulk.read_templates(args.templates_file))
+    if not templates:
+        print("No templates given (use --template or --templates-file)", file=sys.stderr)
+        return 2
+
+    def progress(done, total, elapsed):
+        if args.progress:
+            print(f"\r{done}/{total} prompts ({done / elapsed if elapsed else 0:.0f}/s)", end="", file=sys.stderr)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="\n")
+    try:
+        started = time.perf_counter()
+        count = bulk.expand_to_file(templates, output, args.data_dir, seed_start=args.seed_start,
+                                    count=args.count, jobs=args.jobs, chunk_size=args.chunk_size,
+                                    pack_mode=args.pack, progress=progress, mode=args.mode, fmt=args.format)
+        elapsed = time.perf_counter() - started
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if args.progress:
+        print(file=sys.stderr)
+    print(f"Expanded {count} prompts in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)", file=sys.stderr)
+    return 0
+
+
+def cmd_enumerate(args):
+    from . import bulk, combinations
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Data directory not found: {args.data_dir}", file=sys.stderr)
+        return 2
+    try:
+        shard = combinations.parse_shard(args.shard)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    def progress(done, total, elapsed):
+        if args.progress:
+            print(f"\r{done}/{total} combinations ({done / elapsed if elapsed else 0:.0f}/s)", end="", file=sys.stderr)
+
+    engine = bulk.create_engine(args.data_dir, args.pack)
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="\n")
+    try:
+        stats = combinations.enumerate_to_file(engine, args.template, output, fmt=args.format, shard=shard,
+                                               dedupe=not args.no_dedupe, progress=progress)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if args.progress:
+        print(file=sys.stderr)
+    print(f"Enumerated {stats['combinations']} combinations in {stats['elapsed']:.2f}s "
+          f"({stats['per_second']:.0f}/s), wrote {stats['written']}, skipped {stats['duplicates']} duplicates",
+          file=sys.stderr)
+    return 0
+
+
+def cmd_serve(args):
+    from . import service
+    from .engine import ExpansionEngine
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Data directory not found: {args.data_dir}", file=sys.stderr)
+        return 2
+    # 常駐するため、ファイル監視とプリウォームは環境変数の設定（既定はon）に従う
+    engine = ExpansionEngine(os.path.abspath(args.data_dir), pack_mode=args.pack)
+    engine.log_expansions = False
+
+    def ready(address):
+        print(f"Serving on {address if args.socket else 'http://%s:%d' % address[:2]}", file=sys.stderr)
+
+    service.run(engine, args.host, args.port, args.socket, batch_delay=args.batch_delay,
+                max_batch=args.max_batch, ready=ready)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m lib_chara_situation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_compile = subparsers.add_parser("compile", help="data/ のYAMLファイルをバイナリパックに変換する")
+    p_compile.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p_compile.add_argument("--output", default=None)
+    p_compile.set_defaults(func=cmd_compile)
+
+    p_expand = subparsers.add_parser("expand", help="テンプレートをseedの範囲で展開してJSONL・CSV・テキストに書き出す")
+    p_expand.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p_expand.add_argument("--template", action="append", help="展開するプロンプト（複数指定可）")
+    p_expand.add_argument("--templates-file", help="1行1テンプレートのファイル")
+    p_expand.add_argument("--seed-start", type=int, default=0)
+    p_expand.add_argument("--count", type=int, default=1, help="テンプレートごとのseed数")
+    p_expand.add_argument("--jobs", type=int, default=None, help="ワーカープロセス数（既定はCPU数）")
+    p_expand.add_argument("--chunk-size", type=int, default=1000, help="ワーカーに渡す1回あたりのseed数")
+    p_expand.add_argument("--pack", choices=("on", "off"), default=None, help="データパックを使うか")
+    p_expand.add_argument("--mode", choices=("compat", "hash"), default="compat",
+                          help="randomの選択方法（compat: WebUIと同じ結果 / hash: 高速、NumPyがあれば配列演算）")
+    p_expand.add_argument("--format", choices=("jsonl", "csv", "text"), default="jsonl",
+                          help="出力形式（textは1行1プロンプト）")
+    p_expand.add_argument("--output", default="-", help="出力先（既定は標準出力）")
+    p_expand.add_argument("--progress", action="store_true", help="進捗を標準エラー出力に表示する")
+    p_expand.set_defaults(func=cmd_expand)
+
+    p_enumerate = subparsers.add_parser("enumerate", help="randomタグのキーのすべての組み合わせを展開する")
+    p_enumerate.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p_enumerate.add_argument("--template", action="append", required=True, help="展開するプロンプト（複数指定可）")
+    p_enumerate.add_argument("--shard", default="0/1", help="i/n: 組み合わせの番号をnで割った余りがiのものだけ展開する")
+    p_enumerate.add_argument("--no-dedupe", action="store_true", help="展開結果が同じ組み合わせも出力する")
+    p_enumerate.add_argument("--pack", choices=("on", "off"), default=None, help="データパックを使うか")
+    p_enumerate.add_argument("--format", choices=("jsonl", "csv", "text"), default="jsonl", help="出力形式")
+    p_enumerate.add_argument("--output", default="-", help="出力先（既定は標準出力）")
+    p_enumerate.add_argument("--progress", action="store_true", help="進捗を標準エラー出力に表示する")
+    p_enumerate.set_defaults(func=cmd_enumerate)
+
+    p_serve = subparsers.add_parser("serve", help="展開サービスをlocalhostのHTTPまたはUnixソケットで起動する")
+    p_serve.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_serve.add_argument("--socket", default=None, help="Unixソケットのパス（指定するとTCPでは待ち受けない）")
+    p_serve.add_argument("--batch-delay", type=float, default=0.002, help="同時に届いた要求をまとめるために待つ秒数")
+    p_serve.add_argument("--max-batch", type=int, default=1024, help="1回にまとめて展開する最大数")
+    p_serve.add_argument("--pack", choices=("on", "off"), default=None, help="データパックを使うか")
+    p_serve.set_defaults(func=cmd_serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
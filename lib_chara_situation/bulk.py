@@ -0,0 +1,117 @@
+"""
+WebUIの外でプロンプトを大量に展開する（データセットのキャプション生成など）
+
+テンプレートとseedの範囲をチャンクに分けてプロセスプールで展開し、JSONL・CSV・テキストとして書き出す。
+各ワーカープロセスは自分のYAMLキャッシュを持ち、チャンクごとに vectorized.expand_seeds で展開する
+（compatモードでは展開結果は同じseedの expand_prompt と一致する）。
+出力の順序はテンプレート順・seed順で、ワーカー数によらず同じになる。
+ワーカーに渡すチャンクはワーカー数の2倍までに抑え、書き込みが詰まれば展開も待つ（メモリ使用量は一定）。
+"""
+
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+from . import log, stream, vectorized
+
+# ワーカープロセスごとのエンジン、randomの選択方法（vectorized.MODES）と出力形式（stream.FORMATS）
+_engine = None
+_mode = "compat"
+_format = "jsonl"
+
+
+def create_engine(data_dir, pack_mode=None):
+    """オフライン展開用のExpansionEngineを作る（ファイル監視・プリウォームなし）"""
+    from .engine import ExpansionEngine
+
+    engine = ExpansionEngine(os.path.abspath(data_dir), pack_mode=pack_mode, watch_mode="off", prewarm="off")
+    engine.log_expansions = False
+    return engine
+
+
+def _setup(data_dir, pack_mode, mode="compat", fmt="jsonl"):
+    global _engine, _mode, _format
+    _engine = create_engine(data_dir, pack_mode)
+    _mode = mode
+    _format = fmt
+
+
+def _init_worker(data_dir, pack_mode, mode="compat", fmt="jsonl"):
+    # ワーカープロセスでは、警告などのログがJSONLの出力に混ざらないよう
+    # 書き込みスレッドを介さず直接stderrに書く
+    sys.stdout = sys.stderr
+    log.configure(level=log.logger.level, async_output=False)
+    _setup(data_dir, pack_mode, mode, fmt)
+
+
+def _expand_chunk(task):
+    """(テンプレート番号, テンプレート, 開始seed, 終了seed) を展開して出力形式の行を返す"""
+    index, template, start, stop = task
+    seeds = range(start, stop)
+    prompts = vectorized.expand_seeds(_engine, template, seeds, _mode)
+    return stop - start, stream.format_records(zip(seeds, prompts), _format, index)
+
+
+def make_tasks(templates, seed_start, count, chunk_size):
+    """テンプレートごとにseedの範囲をchunk_size件ずつに分ける"""
+    for index, template in enumerate(templates):
+        for start in range(seed_start, seed_start + count, chunk_size):
+            yield index, template, start, min(start + chunk_size, seed_start + count)
+
+
+def expand_to_file(templates, output, data_dir, seed_start=0, count=1, jobs=None,
+                   chunk_size=1000, pack_mode=None, progress=None, mode="compat", fmt="jsonl"):
+    """templatesをseed_startから count 個のseedで展開し、fmt形式でoutputに書き込む
+
+    outputはテキストのファイルオブジェクト。jobsが1の場合はこのプロセスで展開する。
+    modeはrandomの選択方法（compat: expand_promptと同じ / hash: 高速だが選択は異なる）。
+    展開したプロンプト数を返す。
+    """
+    if fmt not in stream.FORMATS:
+        raise ValueError(f"unknown format: {fmt!r} (expected one of {', '.join(stream.FORMATS)})")
+    jobs = jobs or os.cpu_count() or 1
+    tasks = make_tasks(templates, seed_start, count, chunk_size)
+    total = len(templates) * count
+    done = 0
+    started = time.perf_counter()
+
+    def report(chunk):
+        nonlocal done
+        expanded, lines = chunk
+        output.write(lines)
+        done += expanded
+        if progress is not None:
+            progress(done, total, time.perf_counter() - started)
+
+    output.write(stream.format_header(fmt))
+
+    if jobs == 1:
+        # 呼び出し元のプロセスのsys.stdoutとログの設定は変えず、この間のログだけstderrに書く
+        with log.redirect_to_stderr():
+            _setup(data_dir, pack_mode, mode, fmt)
+            for task in tasks:
+                report(_expand_chunk(task))
+    else:
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(data_dir, pack_mode, mode, fmt)) as pool:
+            # imapはタスクを先にすべて投入し、結果も書き込みを待たずに溜まるため、投入数を制限する
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.apply_async(_expand_chunk, (task,)))
+                if len(pending) >= jobs * 2:
+                    report(pending.popleft().get())
+            while pending:
+                report(pending.popleft().get())
+    return done
+
+
+def expand_to_jsonl(templates, output, data_dir, **kwargs):
+    """templatesを展開してJSONLをoutputに書き込む（expand_to_fileのfmt="jsonl"）"""
+    return expand_to_file(templates, output, data_dir, fmt="jsonl", **kwargs)
+
+
+def read_templates(path):
+    """1行1テンプレートのファイルを読み込む（空行は無視する）"""
+    with open(path, encoding='utf-8') as f:
+        return [line.rstrip("\r\n") for line in f if line.strip()]
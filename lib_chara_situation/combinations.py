@@ -0,0 +1,132 @@
+"""
+randomタグのキーのすべての組み合わせを列挙して展開する（ランダムに選ぶ代わりに直積を順に展開する）
+
+組み合わせはタグの出現順の混合基数で番号を付け、番号から直接キーを求めるため、直積を作らずに
+任意の位置から列挙できる。--shard i/n では番号を n で割った余りが i のものだけを展開するため、
+複数のプロセス・マシンで重複なく分担できる（重複を除かない場合、shardの結果を番号順に並べ直せば
+1回で列挙した結果と同じになる）。
+
+展開結果が同じになった組み合わせ（excludeで違いが消えるなど）は、ハッシュで検出して2回目以降を出力しない
+（重複の判定はshardごと）。include/excludeの扱いは expand_prompt と同じ。
+"""
+
+import hashlib
+import itertools
+import time
+
+from . import stream
+from .template import template_cache
+
+
+def parse_shard(text):
+    """'i/n' を (i, n) に変換する（0 <= i < n）"""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"invalid shard: {text!r} (expected i/n)") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard: {text!r} (expected 0 <= i < n)")
+    return index, count
+
+
+def _candidate_keys(item):
+    """randomタグが選ぶ可能性のあるキー（ファイルの順序、重みが0のキーは選ばれないので除く）"""
+    sampler = item.sampler
+    if sampler.prob is None:
+        return sampler.keys
+    entries = item.source.entries
+    return tuple(key for key in sampler.keys if entries[key].weight != 0)
+
+
+class Enumeration:
+    """1つのテンプレートについて、randomタグのキーの組み合わせを順に展開する
+
+    イテレートすると (組み合わせの番号, 展開後のプロンプト) を返す。
+    total（全組み合わせ数）・visited（展開した数）・duplicates（重複として除いた数）を参照できる。
+    seenに他のEnumerationと同じsetを渡すと、テンプレートをまたいで重複を除く。
+    """
+
+    def __init__(self, engine, prompt, shard=(0, 1), dedupe=True, seen=None):
+        self.engine = engine
+        self.prompt = prompt
+        self.shard = shard
+        self.dedupe = dedupe
+        self.visited = 0
+        self.duplicates = 0
+        self._seen = set() if seen is None else seen
+
+        self._plan = engine._prepare_expansion(template_cache.get(prompt), {})
+        if self._plan is None:
+            self._keys = []
+        else:
+            self._keys = [_candidate_keys(item) for item in self._plan.random_items]
+        self.total = 1
+        for keys in self._keys:
+            self.total *= len(keys)
+
+    def __len__(self):
+        """このshardが展開する組み合わせ数"""
+        index, count = self.shard
+        return len(range(index, self.total, count))
+
+    def combination(self, number):
+        """番号の組み合わせのキー（タグの出現順、最後のタグが最も速く変わる）"""
+        chosen = []
+        for keys in reversed(self._keys):
+            number, index = divmod(number, len(keys))
+            chosen.append(keys[index])
+        return tuple(reversed(chosen))
+
+    def __iter__(self):
+        index, count = self.shard
+        plan = self._plan
+        merged_rules = {}
+        seen = self._seen
+        for number in range(index, self.total, count):
+            self.visited += 1
+            if plan is None:
+                result = self.prompt
+            else:
+                result = self.engine._expand_chosen(plan, self.combination(number), merged_rules)
+            if self.dedupe:
+                digest = hashlib.blake2b(result.encode('utf-8'), digest_size=16).digest()
+                if digest in seen:
+                    self.duplicates += 1
+                    continue
+                seen.add(digest)
+            yield number, result
+
+
+def enumerate_to_file(engine, templates, output, fmt="jsonl", shard=(0, 1), dedupe=True, progress=None):
+    """templatesのすべての組み合わせを展開してoutputに書き込み、統計を返す
+
+    重複の判定はテンプレートをまたいで行う。progressは (展開した数, 全体の数, 経過秒) で呼ばれる。
+    """
+    started = time.perf_counter()
+    seen = set()
+    enumerations = [Enumeration(engine, prompt, shard, dedupe, seen) for prompt in templates]
+    planned = sum(len(enumeration) for enumeration in enumerations)
+
+    output.write(stream.format_header(fmt, id_field="combination"))
+    written = 0
+    visited = 0
+    for template_index, enumeration in enumerate(enumerations):
+        records = iter(enumeration)
+        while True:
+            batch = list(itertools.islice(records, 1024))
+            if not batch:
+                break
+            output.write(stream.format_records(batch, fmt, template_index, id_field="combination"))
+            written += len(batch)
+            if progress is not None:
+                progress(visited + enumeration.visited, planned, time.perf_counter() - started)
+        visited += enumeration.visited
+
+    elapsed = time.perf_counter() - started
+    return {
+        'combinations': visited,
+        'written': written,
+        'duplicates': sum(enumeration.duplicates for enumeration in enumerations),
+        'elapsed': elapsed,
+        'per_second': visited / elapsed if elapsed else 0.0,
+    }
@@ -0,0 +1,575 @@
+"""
+YAMLファイルの読み込み結果（エントリ・ルール・ランダム選択の索引）とそのキャッシュ
+"""
+
+import math
+import os
+import struct
+import threading
+
+from . import lazyyaml, yamlio
+from .log import logger, warn_once
+
+
+def parse_yaml_file(path):
+    """YAMLファイルをパースする（libyamlが使える場合はCローダー）"""
+    return yamlio.parse_file(path)
+
+
+# エントリの属性のうちプロンプトに出力しないもの（重み付け・絞り込み用）
+METADATA_FIELDS = frozenset(('weight', 'tag'))
+
+
+class KeySampler:
+    """キー一覧からの定数時間のランダム選択
+
+    重みがない場合は random.Random.choice と同じ選択を行い、
+    重みがある場合はWalkerのエイリアス法で選択する。
+    """
+    __slots__ = ('keys', 'prob', 'alias')
+
+    def __init__(self, keys, weights=None):
+        self.keys = keys
+        self.prob = None
+        self.alias = None
+        if weights is not None:
+            self._build_alias(weights)
+
+    def _build_alias(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        self.prob = tuple(prob)
+        self.alias = tuple(alias)
+
+    def draw(self, rng):
+        """キーを1つ選ぶ"""
+        if self.prob is None:
+            return rng.choice(self.keys)
+        n = len(self.keys)
+        u = rng.random() * n
+        i = min(int(u), n - 1)
+        if u - i < self.prob[i]:
+            return self.keys[i]
+        return self.keys[self.alias[i]]
+
+
+def _entry_weight(entry):
+    """エントリのweightフィールドを返す（未指定・数値でない・有限でない場合はNoneで、重み1として扱う）"""
+    if not isinstance(entry, dict) or 'weight' not in entry:
+        return None
+    try:
+        weight = float(entry['weight'])
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(weight):
+        return None
+    return max(weight, 0.0)
+
+
+def _attribute_values(value):
+    """絞り込み用に属性値をタグ単位の文字列に分解する"""
+    values = value if isinstance(value, list) else [value]
+    tags = set()
+    for v in values:
+        if v is None:
+            continue
+        for tag in str(v).split(','):
+            tag = tag.strip()
+            if tag:
+                tags.add(tag)
+    return tags
+
+
+def render_fields(chara):
+    """キャラクター定義を (要素名, 出力文字列) のタプルに変換する（空の要素とメタデータは除く）"""
+    parts = []
+    for key, value in chara.items():
+        if key in METADATA_FIELDS or not value:
+            continue
+        # valueが配列の場合は結合、文字列の場合はそのまま
+        if isinstance(value, list):
+            parts.append((key, ", ".join(str(v) for v in value)))
+        else:
+            parts.append((key, str(value)))
+    return tuple(parts)
+
+
+def situation_text(situation):
+    """シチュエーション定義のpromptを展開する"""
+    prompt_value = situation.get("prompt")
+    if not prompt_value:
+        return ""
+    # promptが配列の場合は結合、文字列の場合はそのまま
+    if isinstance(prompt_value, list):
+        return ", ".join(str(v) for v in prompt_value)
+    return str(prompt_value)
+
+
+def _field_set(values):
+    """exclude/includeの値を要素名のfrozensetにする（ハッシュできない値は無視する）"""
+    fields = set()
+    try:
+        values = iter(values or ())
+    except TypeError:
+        return frozenset()
+    for value in values:
+        try:
+            fields.add(value)
+        except TypeError:
+            pass
+    return frozenset(fields)
+
+
+class SituationRule:
+    """1つのシチュエーション定義のルール（modeは 'exclude' / 'include' / None）"""
+    __slots__ = ('mode', 'fields')
+
+    def __init__(self, mode, fields):
+        self.mode = mode
+        self.fields = fields
+
+
+# シチュエーション定義でないエントリ（キャラクター定義など）のルール
+NO_RULE = SituationRule(None, frozenset())
+
+
+def compile_rule(entry, label):
+    """エントリのexclude/includeをSituationRuleに変換する"""
+    if not isinstance(entry, dict):
+        return NO_RULE
+
+    # excludeとincludeの同時指定をチェック（同一エントリ内）
+    if 'exclude' in entry and 'include' in entry:
+        logger.error("Cannot specify both 'exclude' and 'include' in %s", label)
+        return NO_RULE
+
+    if 'exclude' in entry:
+        return SituationRule('exclude', _field_set(entry.get('exclude')))
+    if 'include' in entry:
+        return SituationRule('include', _field_set(entry.get('include')))
+    return NO_RULE
+
+
+class MergedRules:
+    """プロンプト中のすべてのシチュエーション定義のルールをまとめたもの
+
+    duplicatesには複数のシチュエーションで重複して指定された要素名が入る。
+    """
+    __slots__ = ('has_include', 'has_exclude', 'includes', 'excludes', 'duplicates')
+
+    def __init__(self, rules):
+        includes = set()
+        excludes = set()
+        duplicates = set()
+        self.has_include = False
+        self.has_exclude = False
+        seen = set()
+        for rule in rules:
+            # 同じシチュエーションが複数回指定されても1回分として扱う
+            if rule.mode is None or id(rule) in seen:
+                continue
+            seen.add(id(rule))
+            target = includes if rule.mode == 'include' else excludes
+            duplicates |= target & rule.fields
+            target |= rule.fields
+            if rule.mode == 'include':
+                self.has_include = True
+            else:
+                self.has_exclude = True
+        self.includes = frozenset(includes)
+        self.excludes = frozenset(excludes)
+        self.duplicates = frozenset(duplicates)
+
+    @property
+    def conflict(self):
+        """includeとexcludeが混在しているか"""
+        return self.has_include and self.has_exclude
+
+    def apply(self, entry):
+        """キャラクター定義のEntryのうちルールで残る要素を結合する"""
+        if self.has_include:
+            includes = self.includes
+            return ", ".join([text for key, text in zip(entry.fields, entry.texts) if key in includes])
+        if not self.excludes:
+            return ", ".join(entry.texts)
+        excludes = self.excludes
+        return ", ".join([text for key, text in zip(entry.fields, entry.texts) if key not in excludes])
+
+
+class Entry:
+    """1つのエントリをプロンプト出力用に変換したもの（読み込み時に1回だけ作る）
+
+    fields/textsは出力対象の要素名と結合済みの文字列（空の要素とメタデータは除く）。
+    シチュエーション定義と辞書でないエントリは、textに展開後の文字列が入る。
+    """
+    __slots__ = ('fields', 'texts', 'text', 'rule', 'weight', 'tags')
+
+    def __init__(self, value, label, names):
+        self.fields = ()
+        self.texts = ()
+        self.text = None
+        self.rule = NO_RULE
+        self.weight = None
+        self.tags = frozenset()
+
+        if not isinstance(value, dict):
+            self.text = str(value)
+            return
+
+        parts = render_fields(value)
+        # 要素名の文字列はファイル内で共有する
+        self.fields = tuple(names.setdefault(key, key) for key, _ in parts)
+        self.texts = tuple(text for _, text in parts)
+        if 'weight' in value:
+            # 数値として使えないweightは指定なしと同じ扱い（ファイルを重み付きにしない）
+            self.weight = _entry_weight(value)
+            if self.weight is None:
+                warn_once(('weight', label, repr(value['weight'])),
+                          "Ignoring invalid weight %r in %s (expected a finite number)", value['weight'], label)
+        if 'tag' in value:
+            self.tags = frozenset(_attribute_values(value['tag']))
+
+        # エントリがシチュエーション定義かキャラクター定義かを判定
+        if 'exclude' in value or 'include' in value:
+            self.rule = compile_rule(value, label)
+            self.text = situation_text(value)
+
+    def attribute_values(self, field):
+        """絞り込み用の属性値を返す"""
+        if field == 'tag':
+            return self.tags
+        for name, text in zip(self.fields, self.texts):
+            if name == field:
+                return _attribute_values(text)
+        return ()
+
+
+class _LazyEntries:
+    """エントリを、アクセスされたときにだけ読み込んでEntryへ変換するマッピング
+
+    load_valueはキーを受け取り、そのエントリの値だけを読み込む関数（読み込み時の内容から読むこと）。
+    複数のスレッドが同時に同じキーを読み込んだ場合も、最初に登録されたEntryを全員が使う。
+    """
+    __slots__ = ('_order', '_keys', '_load_value', '_label', '_names', '_entries')
+
+    def __init__(self, keys, load_value, label):
+        self._order = tuple(keys)
+        self._keys = frozenset(keys)
+        self._load_value = load_value
+        self._label = label
+        self._names = {}
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            if key not in self._keys:
+                raise KeyError(key)
+            entry = self._entries.setdefault(key, Entry(self._load_value(key), f"{self._label}:{key}", self._names))
+        return entry
+
+    def values(self):
+        return [self[key] for key in self._order]
+
+
+class DataFile:
+    """パース済みのYAMLファイルを、キー -> Entry に変換して索引を付けたもの
+
+    ファイルの1つの版のスナップショットで、作成後は変更しない（ファイルが変わればYamlCacheが新しい
+    DataFileに差し替える）。遅延して作る索引も、同時に作られた場合は最初に登録されたものを全員が使う。
+    """
+    __slots__ = ('path', 'stamp', 'entries', 'keys', 'weighted', 'source',
+                 '_sampler', '_attributes', '_samplers')
+
+    def __init__(self, path, stamp, entries, weighted, source='yaml', keys=None):
+        self.path = path
+        self.stamp = stamp
+        self.entries = entries
+        # randomキー選択用のキー一覧（選択のたびにlistを作らないよう事前に作っておく）
+        self.keys = tuple(entries) if keys is None else keys
+        # weightフィールドを持つエントリが1つでもあれば重み付きで選択する
+        self.weighted = weighted
+        self.source = source  # 読み込み元 ('yaml' / 'pack' / 'lazy')
+        self._sampler = None
+        self._attributes = {}  # field -> {value: keys}（絞り込みで初めて使う属性のみ作る）
+        self._samplers = {}  # conditions -> KeySampler
+
+    @classmethod
+    def from_yaml(cls, path, stamp, data):
+        """パース済みのYAMLから作る（元のYAMLの辞書やリストは保持せず、Entryだけを持つ）"""
+        entries = {}
+        if isinstance(data, dict):
+            label = os.path.splitext(os.path.basename(path))[0]
+            names = {}
+            for key, value in data.items():
+                entries[key] = Entry(value, f"{label}:{key}", names)
+        weighted = any(entry.weight is not None for entry in entries.values())
+        return cls(path, stamp, entries, weighted)
+
+    @classmethod
+    def from_pack(cls, path, stamp, pack, record):
+        """データパックから作る（エントリはアクセスされたときにデコードする）"""
+        keys, offsets = pack.read_keys(record)
+        label = os.path.splitext(os.path.basename(path))[0]
+        offsets = dict(zip(keys, offsets))
+        # このエントリのバイト列だけをデコードする
+        entries = _LazyEntries(keys, lambda key: pack.read_value(offsets[key]), label)
+        return cls(path, stamp, entries, record.has_weight, source='pack', keys=keys)
+
+    @classmethod
+    def from_lazy_index(cls, path, stamp, index):
+        """トップレベルキーの索引から作る（エントリはアクセスされたときにそのブロックだけをパースする）"""
+        label = os.path.splitext(os.path.basename(path))[0]
+        entries = _LazyEntries(index.keys, index.load, label)
+        return cls(path, stamp, entries, False, source='lazy', keys=index.keys)
+
+    @property
+    def packed(self):
+        """データパックから読み込んだか"""
+        return self.source == 'pack'
+
+    @property
+    def sampler(self):
+        """条件なしのrandom選択に使うKeySampler"""
+        if self._sampler is None:
+            self._sampler = self._make_sampler(self.keys)
+        return self._sampler
+
+    def _make_sampler(self, keys):
+        if not self.weighted:
+            return KeySampler(keys)
+        weights = [1.0 if self.entries[key].weight is None else self.entries[key].weight for key in keys]
+        if sum(weights) <= 0:
+            return KeySampler(())
+        return KeySampler(keys, weights)
+
+    def _attribute_index(self, field):
+        """属性値 -> キー一覧の索引（ファイルの版ごとに1回だけ作る）"""
+        index = self._attributes.get(field)
+        if index is None:
+            index = {}
+            for key in self.keys:
+                for value in self.entries[key].attribute_values(field):
+                    index.setdefault(value, []).append(key)
+            index = {value: frozenset(keys) for value, keys in index.items()}
+            index = self._attributes.setdefault(field, index)
+        return index
+
+    def filtered_sampler(self, conditions):
+        """(field, value) の条件をすべて満たすキーから選ぶKeySamplerを返す"""
+        if not conditions:
+            return self.sampler
+
+        sampler = self._samplers.get(conditions)
+        if sampler is None:
+            matched = None
+            for field, value in conditions:
+                keys = self._attribute_index(field).get(value, frozenset())
+                matched = keys if matched is None else matched & keys
+            # 元のファイルの順序を保つ
+            sampler = self._make_sampler(tuple(key for key in self.keys if key in matched))
+            sampler = self._samplers.setdefault(conditions, sampler)
+        return sampler
+
+
+class YamlCache:
+    """プロセス全体で共有するYAMLパース結果のキャッシュ
+
+    解決済みパスをキーに保持し、os.statの (mtime_ns, size, inode) で毎回検証する。
+    ファイルが編集されていれば再パースするため、編集は即座に反映される。
+    ファイル監視が有効な場合はtrustedを指定して検証を省略し、変更は監視側からの
+    invalidate_treeで反映する。同じファイルを複数のスレッドが同時に要求した場合、
+    パースは1回だけ行い、他のスレッドはその完了を待つ（ファイルごとのロード待ち）。
+
+    保持するDataFileは読み込み後に変更しないスナップショットで、ファイルが変われば新しいDataFileを
+    作ってから差し替える。そのため、展開中のスレッドは古い版を最後まで一貫して使える。
+    読み込みの前後でstampが変わった場合（読み込み中に置き換えられた場合）は読み直し、
+    内容とstampが一致しないDataFileはキャッシュしない。
+    """
+
+    # 読み込み中にファイルが変わった場合に読み直す回数の上限
+    MAX_LOAD_ATTEMPTS = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # path -> DataFile
+        self._missing = set()  # trustedで読み込んで存在しなかったパス
+        self._loading = {}  # 読み込み中のパス -> 完了時にsetされるEvent
+        self._generation = 0  # 破棄のたびに増やし、読み込み中に破棄された結果を保存しない
+        self.hits = 0
+        self.misses = 0
+        self.reparses = 0
+        self.pack_loads = 0
+        self.lazy_loads = 0
+        self.invalidations = 0
+        self.retries = 0  # 読み込み中の変更を検出した回数
+
+    @staticmethod
+    def _stamp(st):
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self, path, pack=None, name=None, lazy=False, trusted=False):
+        """DataFileを返す。ファイルが存在しない場合はNone
+
+        packにデータパック、nameにパック内の名前を渡すと、YAMLファイルがパック作成時から
+        変更されていない場合はパックから読み込む（変更されていればYAMLをパースする）。
+        lazyを指定すると、トップレベルキーの索引だけを作り、エントリは必要になったときに
+        そのブロックだけをパースする（索引できないファイルは全体をパースする）。
+        trustedを指定すると、キャッシュ済みのファイルはstatせずにそのまま返す。
+        """
+        path = os.path.abspath(path)
+        while True:
+            with self._lock:
+                generation = self._generation
+                if trusted:
+                    cached = self._entries.get(path)
+                    if cached is not None:
+                        self.hits += 1
+                        return cached
+                    if path in self._missing:
+                        return None
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._entries.pop(path, None)
+                    if trusted and self._generation == generation:
+                        self._missing.add(path)
+                return None
+
+            stamp = self._stamp(st)
+            with self._lock:
+                cached = self._entries.get(path)
+                if cached is not None and cached.stamp == stamp:
+                    self.hits += 1
+                    return cached
+                # 他のスレッドが読み込み中なら、そのファイルだけ完了を待って確認し直す
+                loading = self._loading.get(path)
+                if loading is None:
+                    loading = self._loading[path] = threading.Event()
+                    break
+            loading.wait()
+
+        try:
+            for _ in range(self.MAX_LOAD_ATTEMPTS):
+                data_file = self._load(path, stamp, st, pack, name, lazy)
+                try:
+                    st_after = os.stat(path)
+                except OSError:
+                    st_after = None
+                consistent = st_after is not None and self._stamp(st_after) == stamp
+                if consistent or st_after is None:
+                    break
+                # 読み込み中に書き換えられたので、新しい版を読み直す
+                st, stamp = st_after, self._stamp(st_after)
+                with self._lock:
+                    self.retries += 1
+            if not consistent:
+                # 内容がどの版か確定しないので、展開結果のキャッシュで他の版と同じキーにならないようにする
+                data_file.stamp = object()
+            with self._lock:
+                if data_file.source == 'pack':
+                    self.pack_loads += 1
+                elif data_file.source == 'lazy':
+                    self.lazy_loads += 1
+                if path in self._entries:
+                    self.reparses += 1
+                else:
+                    self.misses += 1
+                if consistent and self._generation == generation:
+                    self._entries[path] = data_file
+                    self._missing.discard(path)
+        finally:
+            with self._lock:
+                del self._loading[path]
+            loading.set()
+        return data_file
+
+    @staticmethod
+    def _load(path, stamp, st, pack, name, lazy):
+        record = pack.files.get(name) if pack is not None else None
+        if record is not None and record.matches(st):
+            try:
+                return DataFile.from_pack(path, stamp, pack, record)
+            except (ValueError, IndexError, struct.error) as e:
+                # 壊れたパック（datapack.DataPackError）はYAMLで代用する
+                warn_once(('pack', pack.path, pack.stamp, name), "Ignoring data pack entry %s: %s", name, e)
+        index = lazyyaml.index_file(path) if lazy else None
+        if index is not None:
+            return DataFile.from_lazy_index(path, stamp, index)
+        return DataFile.from_yaml(path, stamp, parse_yaml_file(path) or {})
+
+    def is_cached(self, path):
+        """pathが（検証の有無にかかわらず）キャッシュに入っているか"""
+        path = os.path.abspath(path)
+        with self._lock:
+            return path in self._entries or path in self._missing
+
+    def invalidate(self, path=None):
+        """指定パス（省略時はすべて）のキャッシュを破棄する"""
+        with self._lock:
+            self._generation += 1
+            if path is None:
+                self._entries.clear()
+                self._missing.clear()
+            else:
+                path = os.path.abspath(path)
+                self._entries.pop(path, None)
+                self._missing.discard(path)
+
+    def invalidate_tree(self, path):
+        """pathとその配下のキャッシュを破棄する（ファイル監視から呼ばれる）"""
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        with self._lock:
+            self._generation += 1
+            stale = [p for p in self._entries if p == path or p.startswith(prefix)]
+            for p in stale:
+                del self._entries[p]
+            self._missing = {p for p in self._missing if p != path and not p.startswith(prefix)}
+            self.invalidations += len(stale)
+
+    def stats(self):
+        """ヒット/ミス/再パースの回数とキャッシュ件数を返す"""
+        with self._lock:
+            total = self.hits + self.misses + self.reparses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reparses': self.reparses,
+                'pack_loads': self.pack_loads,
+                'lazy_loads': self.lazy_loads,
+                'invalidations': self.invalidations,
+                'retries': self.retries,
+                'files': len(self._entries),
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+# プロセス内のすべてのExpansionEngineで共有する
+yaml_cache = YamlCache()
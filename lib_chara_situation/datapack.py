@@ -0,0 +1,461 @@
+"""
+data/ 以下のYAMLファイルを1つのバイナリパックにまとめる
+
+パックの構造（数値はすべてリトルエンディアン）:
+    ヘッダー      : MAGIC, version(u16), reserved(u16), ファイル数(u32),
+                    文字列テーブルの位置(u64), ファイル表の位置(u64)
+    値            : 型タグ(u8) + 型ごとのデータ（文字列は文字列テーブルのID）
+    キー表        : ファイルごとに (キーの値, エントリの位置(u64)) の並び
+    文字列テーブル: 文字列数(u32), 各文字列の位置(u64 x 文字列数), (長さ(u32) + UTF-8) の並び
+    ファイル表    : ファイルごとに 名前ID(u32), mtime_ns(i64), size(u64), flags(u8),
+                    キー数(u32), キー表の位置(u64)
+
+読み込み側はmmapしたパックから必要なエントリのバイト列だけをデコードする。
+開くときにヘッダー・文字列テーブル・ファイル表・キー表の範囲を検証し、壊れたパックは使わずにYAMLを読む。
+Windowsではmmap中のファイルを置き換えられない（パックを作り直せない）ため、パック全体をメモリに読み込む。
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from .datafile import _entry_weight
+from .log import logger, warn_once
+
+MAGIC = b'CSPK'
+VERSION = 2  # 2: FLAG_HAS_WEIGHTは有効なweightを持つエントリがある場合だけ立てる
+PACK_FILENAME = '.chara_situation.pack'
+
+# ファイル表のflags
+FLAG_HAS_WEIGHT = 1
+
+# 値の型タグ
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _BIGINT = range(9)
+
+_HEADER = struct.Struct('<4sHHIQQ')
+_U8 = struct.Struct('<B')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_FILE_RECORD = struct.Struct('<IqQBIQ')
+# キー表の1件の最小サイズ（型タグ + エントリの位置）
+_MIN_KEY_SIZE = _U8.size + _U64.size
+
+# パックを置き換える際に、他のプロセスが読み込み中で失敗した場合の再試行（Windows）
+_REPLACE_ATTEMPTS = 20
+_REPLACE_RETRY_DELAY = 0.05
+
+
+class DataPackError(ValueError):
+    """パックが壊れている、または形式が異なる"""
+
+
+def pack_path_for(data_dir):
+    """data_dirに対応するパックファイルのパス"""
+    return os.path.join(data_dir, PACK_FILENAME)
+
+
+# ---------------------------------------------------------------------------
+# 書き込み
+# ---------------------------------------------------------------------------
+
+class _Writer:
+    def __init__(self):
+        self.buf = bytearray()
+        self.strings = {}
+
+    def string_id(self, text):
+        sid = self.strings.get(text)
+        if sid is None:
+            sid = self.strings[text] = len(self.strings)
+        return sid
+
+    def write_value(self, value):
+        buf = self.buf
+        if value is None:
+            buf += _U8.pack(_NONE)
+        elif value is True:
+            buf += _U8.pack(_TRUE)
+        elif value is False:
+            buf += _U8.pack(_FALSE)
+        elif isinstance(value, int):
+            if -(1 << 63) <= value < (1 << 63):
+                buf += _U8.pack(_INT) + _I64.pack(value)
+            else:
+                buf += _U8.pack(_BIGINT) + _U32.pack(self.string_id(str(value)))
+        elif isinstance(value, float):
+            buf += _U8.pack(_FLOAT) + _F64.pack(value)
+        elif isinstance(value, str):
+            buf += _U8.pack(_STR) + _U32.pack(self.string_id(value))
+        elif isinstance(value, (list, tuple)):
+            buf += _U8.pack(_LIST) + _U32.pack(len(value))
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, dict):
+            buf += _U8.pack(_DICT) + _U32.pack(len(value))
+            for key, item in value.items():
+                self.write_value(key)
+                self.write_value(item)
+        else:
+            # 日付など上記以外の型は文字列として保存する
+            buf += _U8.pack(_STR) + _U32.pack(self.string_id(str(value)))
+
+
+def find_yaml_files(data_dir):
+    """data_dir以下のYAMLファイルを (拡張子なしの相対名, パス) で返す"""
+    found = []
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.yaml'):
+                path = os.path.join(root, name)
+                relname = os.path.relpath(path, data_dir)[:-len('.yaml')].replace(os.sep, '/')
+                found.append((relname, path))
+    return found
+
+
+def compile_pack(data_dir, output=None, load=None):
+    """data_dir以下のYAMLファイルをすべてパックに変換し、ファイル数を返す
+
+    loadはファイルパスを受け取ってパース結果を返す関数（省略時はyamlio.parse_file）。
+    書き込みは一時ファイル経由で行い、完成してから置き換える。
+    """
+    if load is None:
+        from .yamlio import parse_file as load
+
+    output = output or pack_path_for(data_dir)
+    writer = _Writer()
+    writer.buf += b'\0' * _HEADER.size
+    records = []
+
+    for relname, path in find_yaml_files(data_dir):
+        st = os.stat(path)
+        data = load(path) or {}
+        if not isinstance(data, dict):
+            data = {}
+
+        entry_offsets = []
+        has_weight = False
+        for key, value in data.items():
+            entry_offsets.append(len(writer.buf))
+            writer.write_value(value)
+            if _entry_weight(value) is not None:
+                has_weight = True
+
+        keys_offset = len(writer.buf)
+        for key, offset in zip(data.keys(), entry_offsets):
+            writer.write_value(key)
+            writer.buf += _U64.pack(offset)
+
+        records.append((writer.string_id(relname), st.st_mtime_ns, st.st_size,
+                        FLAG_HAS_WEIGHT if has_weight else 0, len(entry_offsets), keys_offset))
+
+    # 文字列テーブル
+    strings = [None] * len(writer.strings)
+    for text, sid in writer.strings.items():
+        strings[sid] = text
+    strings_offset = len(writer.buf)
+    writer.buf += _U32.pack(len(strings))
+    table_pos = len(writer.buf)
+    writer.buf += b'\0' * (_U64.size * len(strings))
+    for sid, text in enumerate(strings):
+        _U64.pack_into(writer.buf, table_pos + sid * _U64.size, len(writer.buf))
+        encoded = text.encode('utf-8', 'surrogatepass')
+        writer.buf += _U32.pack(len(encoded)) + encoded
+
+    # ファイル表
+    files_offset = len(writer.buf)
+    for record in records:
+        writer.buf += _FILE_RECORD.pack(*record)
+
+    _HEADER.pack_into(writer.buf, 0, MAGIC, VERSION, 0, len(records), strings_offset, files_offset)
+
+    tmp_path = f"{output}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(writer.buf)
+    for attempt in range(_REPLACE_ATTEMPTS):
+        try:
+            os.replace(tmp_path, output)
+            break
+        except PermissionError:
+            # Windowsでは他のプロセスが古いパックを読み込んでいる間は置き換えられないので少し待つ
+            if attempt == _REPLACE_ATTEMPTS - 1:
+                os.remove(tmp_path)
+                raise
+            time.sleep(_REPLACE_RETRY_DELAY)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    return len(records)
+
+
+# ---------------------------------------------------------------------------
+# 読み込み
+# ---------------------------------------------------------------------------
+
+class PackedFileRecord:
+    """パック内の1ファイルの情報"""
+    __slots__ = ('name', 'mtime_ns', 'size', 'flags', 'count', 'keys_offset')
+
+    def __init__(self, name, mtime_ns, size, flags, count, keys_offset):
+        self.name = name
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.flags = flags
+        self.count = count
+        self.keys_offset = keys_offset
+
+    @property
+    def has_weight(self):
+        return bool(self.flags & FLAG_HAS_WEIGHT)
+
+    def matches(self, st):
+        """元のYAMLファイルがパック作成時から変更されていないか"""
+        return st.st_mtime_ns == self.mtime_ns and st.st_size == self.size
+
+
+class DataPack:
+    """mmapしたパックファイル（値は要求されたときにだけデコードする）"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if st.st_size < _HEADER.size:
+                raise DataPackError(f"{path} is too small to be a data pack")
+            if os.name == 'nt':
+                # mmapしたままだとcompile_packのos.replaceがPermissionErrorになる
+                self._mm = f.read()
+            else:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, nfiles, strings_offset, files_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise DataPackError(f"{path} is not a version {VERSION} data pack")
+
+        self._strings_offset = strings_offset
+        self._strings = {}
+        self._nstrings = self._check_index(nfiles, strings_offset, files_offset)
+
+        self.files = {}
+        pos = files_offset
+        for _ in range(nfiles):
+            name_id, mtime_ns, size, flags, count, keys_offset = _FILE_RECORD.unpack_from(self._mm, pos)
+            pos += _FILE_RECORD.size
+            if not _HEADER.size <= keys_offset <= strings_offset - count * _MIN_KEY_SIZE:
+                raise DataPackError(f"key table of file {len(self.files)} out of range")
+            name = self._string(name_id)
+            self.files[name] = PackedFileRecord(name, mtime_ns, size, flags, count, keys_offset)
+
+    def _check_index(self, nfiles, strings_offset, files_offset):
+        """文字列テーブルとファイル表がパックの範囲内にあるか確認して、文字列数を返す
+
+        値・キー表・文字列テーブル・ファイル表はこの順に並び、ファイル表がファイルの末尾で終わる。
+        """
+        size = len(self._mm)
+        if files_offset + nfiles * _FILE_RECORD.size != size:
+            raise DataPackError(f"file table does not end at the end of the pack ({size} bytes)")
+        if not _HEADER.size <= strings_offset <= files_offset - _U32.size:
+            raise DataPackError(f"string table offset {strings_offset} out of range")
+        (nstrings,) = _U32.unpack_from(self._mm, strings_offset)
+        data_start = strings_offset + _U32.size + nstrings * _U64.size
+        if data_start > files_offset:
+            raise DataPackError(f"string table with {nstrings} strings overruns the file table")
+        pos = strings_offset + _U32.size
+        for sid in range(nstrings):
+            (start,) = _U64.unpack_from(self._mm, pos + sid * _U64.size)
+            if not data_start <= start <= files_offset - _U32.size:
+                raise DataPackError(f"string {sid} out of range")
+            (length,) = _U32.unpack_from(self._mm, start)
+            if start + _U32.size + length > files_offset:
+                raise DataPackError(f"string {sid} overruns the string table")
+        return nstrings
+
+    def _string(self, sid):
+        text = self._strings.get(sid)
+        if text is None:
+            if sid >= self._nstrings:
+                raise DataPackError(f"string id {sid} out of range")
+            (pos,) = _U64.unpack_from(self._mm, self._strings_offset + _U32.size + sid * _U64.size)
+            (length,) = _U32.unpack_from(self._mm, pos)
+            start = pos + _U32.size
+            text = self._mm[start:start + length].decode('utf-8', 'surrogatepass')
+            self._strings[sid] = text
+        return text
+
+    def _read(self, pos):
+        """posの値をデコードして (値, 次の位置) を返す"""
+        mm = self._mm
+        tag = mm[pos]
+        pos += 1
+        if tag == _STR:
+            return self._string(_U32.unpack_from(mm, pos)[0]), pos + _U32.size
+        if tag == _DICT:
+            (n,) = _U32.unpack_from(mm, pos)
+            pos += _U32.size
+            value = {}
+            for _ in range(n):
+                key, pos = self._read(pos)
+                value[key], pos = self._read(pos)
+            return value, pos
+        if tag == _LIST:
+            (n,) = _U32.unpack_from(mm, pos)
+            pos += _U32.size
+            value = []
+            for _ in range(n):
+                item, pos = self._read(pos)
+                value.append(item)
+            return value, pos
+        if tag == _NONE:
+            return None, pos
+        if tag == _TRUE:
+            return True, pos
+        if tag == _FALSE:
+            return False, pos
+        if tag == _INT:
+            return _I64.unpack_from(mm, pos)[0], pos + _I64.size
+        if tag == _FLOAT:
+            return _F64.unpack_from(mm, pos)[0], pos + _F64.size
+        if tag == _BIGINT:
+            return int(self._string(_U32.unpack_from(mm, pos)[0])), pos + _U32.size
+        raise DataPackError(f"unknown value tag {tag} at {pos - 1}")
+
+    def read_value(self, offset):
+        """エントリの値をデコードする"""
+        return self._read(offset)[0]
+
+    def read_keys(self, record):
+        """ファイルのキー一覧とエントリの位置を返す"""
+        keys = []
+        offsets = []
+        pos = record.keys_offset
+        for _ in range(record.count):
+            key, pos = self._read(pos)
+            (offset,) = _U64.unpack_from(self._mm, pos)
+            if not _HEADER.size <= offset < record.keys_offset:
+                raise DataPackError(f"entry offset {offset} of {record.name} out of range")
+            keys.append(key)
+            offsets.append(offset)
+            pos += _U64.size
+        return tuple(keys), tuple(offsets)
+
+
+class DataPackRegistry:
+    """data_dirごとのパックを管理する（パックが更新されたら開き直す）"""
+
+    # 自動コンパイルを再実行するまでの最短間隔（秒）
+    COMPILE_INTERVAL = 5.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._packs = {}  # data_dir -> DataPack（パックがない場合はNone）
+        self._open_locks = {}  # data_dir -> パックを開く間だけ取るロック（同時に開くのは1スレッドだけ）
+        self._generation = 0
+        self._compiling = set()
+        self._last_compile = {}
+
+    def get(self, data_dir, trusted=False):
+        """data_dirのパックを返す（存在しない・読めない場合はNone）
+
+        trustedを指定すると、一度確認したdata_dirはstatせずに前回の結果を返す
+        （パックの変更はファイル監視からinvalidateで反映する）。
+        """
+        with self._lock:
+            generation = self._generation
+            if trusted and data_dir in self._packs:
+                return self._packs[data_dir]
+
+        path = pack_path_for(data_dir)
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                if self._generation == generation:
+                    self._packs[data_dir] = None
+            return None
+
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        with self._lock:
+            pack = self._packs.get(data_dir)
+            if pack is not None and pack.stamp == stamp:
+                return pack
+            open_lock = self._open_locks.setdefault(data_dir, threading.Lock())
+
+        with open_lock:
+            # 待っている間に他のスレッドが同じ版を開いていればそれを使う
+            with self._lock:
+                pack = self._packs.get(data_dir)
+                if pack is not None and pack.stamp == stamp:
+                    return pack
+
+            try:
+                pack = DataPack(path)
+            except (OSError, ValueError, DataPackError, struct.error) as e:
+                warn_once(('pack', path, stamp), "Ignoring data pack %s: %s", path, e)
+                pack = None
+
+            with self._lock:
+                if self._generation == generation:
+                    self._packs[data_dir] = pack
+        return pack
+
+    def invalidate(self, data_dir=None):
+        """data_dir（省略時はすべて）のパックを次回のgetで確認し直す"""
+        with self._lock:
+            self._generation += 1
+            if data_dir is None:
+                self._packs.clear()
+            else:
+                self._packs.pop(data_dir, None)
+
+    def is_stale(self, data_dir):
+        """パックが存在しないか、どれかのYAMLファイルがパックと異なるか"""
+        pack = self.get(data_dir)
+        if pack is None:
+            return True
+        found = find_yaml_files(data_dir)
+        if len(found) != len(pack.files):
+            return True
+        for relname, path in found:
+            record = pack.files.get(relname)
+            try:
+                if record is None or not record.matches(os.stat(path)):
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def compile_in_background(self, data_dir, load=None, force=False):
+        """バックグラウンドでパックを作り直す（実行中・直後の場合は何もしない）"""
+        with self._lock:
+            if data_dir in self._compiling:
+                return False
+            if not force and time.monotonic() - self._last_compile.get(data_dir, -1e9) < self.COMPILE_INTERVAL:
+                return False
+            self._compiling.add(data_dir)
+            self._last_compile[data_dir] = time.monotonic()
+
+        def run():
+            try:
+                if self.is_stale(data_dir):
+                    started = time.perf_counter()
+                    count = compile_pack(data_dir, load=load)
+                    elapsed = time.perf_counter() - started
+                    logger.info("Compiled %d files into %s (%.2fs)", count, pack_path_for(data_dir), elapsed)
+            except Exception as e:
+                logger.warning("Failed to compile data pack for %s: %s", data_dir, e)
+            finally:
+                with self._lock:
+                    self._compiling.discard(data_dir)
+
+        thread = threading.Thread(target=run, name="chara-situation-pack", daemon=True)
+        thread.start()
+        return True
+
+
+# すべてのCharaSituationScriptインスタンスで共有する
+registry = DataPackRegistry()
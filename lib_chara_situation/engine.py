@@ -0,0 +1,630 @@
+"""
+プロンプト展開エンジン（@filename:key タグをdata/のYAMLファイルの内容に置き換える）
+
+WebUIには依存しないため、WebUIの外のツールにも組み込める:
+
+    from lib_chara_situation.engine import ExpansionEngine
+    engine = ExpansionEngine("path/to/data", watch_mode="off", prewarm="off")
+    engine.expand_prompt("@characters:random, @situations:beach", seed=1)
+
+PyYAML・スレッドプール・ファイル監視などは必要になったときにimportする。
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from . import datapack
+from .datafile import MergedRules, _field_set, parse_yaml_file, render_fields, situation_text, yaml_cache
+from .log import logger, warn_once
+from .metrics import stage_metrics
+from .results import result_cache
+from .template import template_cache
+
+# 段階ごとの計測結果にキャッシュのヒット率を含める
+stage_metrics.add_source('yaml_cache', yaml_cache.stats)
+stage_metrics.add_source('template_cache', template_cache.stats)
+stage_metrics.add_source('result_cache', result_cache.stats)
+
+# 既定のデータディレクトリ（拡張機能の data/）
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# 展開後のプロンプトの整理用（改行と行末のカンマは保持）
+#
+# 連続カンマを1つに・各行の先頭のカンマを削除・連続スペースを1つに、の3つの整理を
+# この順に re.sub した場合と同じ結果を、1回の走査で得る。分岐ごとの末尾の空グループ（lastindex）で置き換える文字列を選ぶ
+# （各分岐を文字で始めることで、reが候補の位置（改行・カンマ・スペース・タブ）だけを調べる）。
+_CLEANUP = re.compile(
+    r'\n[ \t]*,(?:[ \t]*,+)?[ \t]*()'  # 行頭のカンマ（直後の連続カンマも含む）-> 改行だけ残す
+    r'|,[ \t]*,+()'  # 連続カンマ -> 1つに
+    r'| [ \t]+()'  # 連続スペース -> 1つに
+    r'|\t[ \t]*()'  # タブを含むスペース -> 1つのスペースに
+)
+_CLEANUP_REPLACEMENTS = (None, '\n', ',', ' ', ' ')
+# 1行目の先頭のカンマ（_CLEANUPの1つ目の分岐の改行がないもの）
+_LEADING_COMMA = re.compile(r'[ \t]*,(?:[ \t]*,+)?[ \t]*')
+
+
+def _cleanup_replacement(match):
+    return _CLEANUP_REPLACEMENTS[match.lastindex]
+
+
+def _cleanup(result):
+    """連続カンマやスペースを整理する（改行と行末のカンマは保持）"""
+    leading = _LEADING_COMMA.match(result)
+    if leading:
+        result = result[leading.end():]
+    return _CLEANUP.sub(_cleanup_replacement, result)
+
+
+# 複数ファイルを並列に読み込むためのスレッドプール（最初に必要になったときに作る）
+_load_executor = None
+_load_executor_lock = threading.Lock()
+
+
+def _get_load_executor():
+    global _load_executor
+    with _load_executor_lock:
+        if _load_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            workers = int(os.environ.get("CHARA_SITUATION_LOAD_WORKERS", "8"))
+            _load_executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="chara-situation-load")
+        return _load_executor
+
+
+# data_dirごとのファイル監視とプリウォーム済みのdata_dir（同じdata_dirのエンジンで共有する）
+_watchers = {}
+_prewarmed = set()
+_watchers_lock = threading.Lock()
+
+
+def watch_data_dir(data_dir, backend=None, interval=1.0):
+    """data_dirの監視を開始し、変更されたファイルのキャッシュだけを破棄させる
+
+    監視を開始できなかった場合はNoneを返す（その場合は毎回statで確認する）。
+    """
+    from . import watcher
+
+    data_dir = os.path.abspath(data_dir)
+    pack_path = datapack.pack_path_for(data_dir)
+
+    def on_change(path):
+        yaml_cache.invalidate_tree(path)
+        if path == pack_path or pack_path.startswith(os.path.join(path, '')):
+            datapack.registry.invalidate(data_dir)
+
+    with _watchers_lock:
+        data_watcher = _watchers.get(data_dir)
+        if data_watcher is not None and data_watcher.active:
+            return data_watcher
+        if not os.path.isdir(data_dir):
+            return None
+
+        data_watcher = watcher.DataDirWatcher(data_dir, on_change, interval=interval, backend=backend)
+        if not data_watcher.start():
+            return None
+        # 監視開始前に読み込んだ内容は検証されていないので破棄する
+        yaml_cache.invalidate_tree(data_dir)
+        datapack.registry.invalidate(data_dir)
+        _watchers[data_dir] = data_watcher
+        logger.info("Watching %s (%s)", data_dir, data_watcher.backend)
+        return data_watcher
+
+
+class _TagItem:
+    """プロンプト中の1つのタグ（keyがNoneの場合はrandom、sourceは読み込んだDataFile）"""
+    __slots__ = ('full_tag', 'filename', 'key', 'entry', 'source', 'sampler', 'rule')
+
+    def __init__(self, full_tag, filename, key, entry, source, sampler=None):
+        self.full_tag = full_tag
+        self.filename = filename
+        self.key = key
+        self.entry = entry
+        self.source = source
+        self.sampler = sampler
+        self.rule = entry.rule if entry is not None else None
+
+
+class _ExpansionPlan:
+    """1つのプロンプトについてseedに依存しない部分を事前に解決したもの
+
+    itemsはテンプレートのスロットと同じ並びで、解決できなかったタグはNone。
+    """
+
+    def __init__(self, template, items, fixed_rules):
+        self.template = template
+        self.prompt = template.prompt
+        self.items = items
+        self.fixed_rules = fixed_rules
+        self.random_items = tuple(item for item in items if item is not None and item.key is None)
+        self.has_random = bool(self.random_items)
+        self.fixed_result = None  # randomを含まない場合の展開結果
+        # 展開結果のキャッシュのキー（参照するファイルの版を含めて、ファイルが変わったら別のキーにする）
+        versions = dict.fromkeys((item.source.path, item.source.stamp) for item in items if item is not None)
+        self.cache_key = (self.prompt, tuple(versions))
+
+
+class ExpansionEngine:
+    """data_dirのYAMLファイルを使ってプロンプトを展開する（WebUIに依存しない）
+
+    引数を省略した設定は環境変数（CHARA_SITUATION_PACK / _LAZY / _WATCH / _PREWARM）から読む。
+    pack_mode: off / on / auto、watch_mode: on / poll / off、prewarm: on / off / ワーカー数
+
+    複数のスレッドから同時に展開してよい。expand_batchは参照するファイルをキャッシュから1回ずつ取得し、
+    そのDataFile（変更されないスナップショット）だけを使って展開するため、展開中にファイルが
+    置き換えられても、1つのファイルの古い版と新しい版が混ざった結果にはならない。
+    """
+
+    def __init__(self, data_dir=None, pack_mode=None, lazy_load=None, watch_mode=None, prewarm=None):
+        self.data_dir = data_dir or DEFAULT_DATA_DIR
+
+        # データパックの利用方法 (off: 使わない / on: あれば使う / auto: 古ければバックグラウンドで作り直す)
+        self.pack_mode = (pack_mode or os.environ.get("CHARA_SITUATION_PACK", "on")).lower()
+        if self.pack_mode == "auto":
+            datapack.registry.compile_in_background(self.data_dir, load=parse_yaml_file)
+
+        # 大きなYAMLファイルをキー単位で遅延読み込みする
+        if lazy_load is None:
+            lazy_load = os.environ.get("CHARA_SITUATION_LAZY", "off").lower() in ("1", "on", "true")
+        self.lazy_load = lazy_load
+
+        # 展開結果をコンソールに表示する（大量に展開するツールから使う場合はFalseにする）
+        self.log_expansions = True
+
+        # 段階ごとの所要時間を計測する（_INTERVAL秒ごとにコンソールへ表示し、_FILEにJSONで保存する）
+        if os.environ.get("CHARA_SITUATION_METRICS", "off").lower() in ("1", "on", "true"):
+            self.enable_metrics(float(os.environ.get("CHARA_SITUATION_METRICS_INTERVAL", "60")),
+                                os.environ.get("CHARA_SITUATION_METRICS_FILE"))
+
+        # data_dirを監視して、変更のないファイルはstatせずにキャッシュを使う
+        # (on: inotify、使えなければポーリング / poll: ポーリングのみ / off: 毎回statで確認)
+        self.watch_mode = (watch_mode or os.environ.get("CHARA_SITUATION_WATCH", "on")).lower()
+        self.watcher = None
+        if self.watch_mode in ("on", "poll"):
+            self.start_watching()
+
+        # 起動時にdata_dir以下のファイルをバックグラウンドで読み込んでおく（ワーカー数、0で無効）
+        self.prewarm_thread = None
+        self._prewarm_cancel = threading.Event()
+        if prewarm is None:
+            prewarm = os.environ.get("CHARA_SITUATION_PREWARM", "on")
+        prewarm = str(prewarm).lower()
+        if prewarm in ("on", "1", "true"):
+            self.prewarm()
+        elif prewarm.isdigit() and int(prewarm) > 0:
+            self.prewarm(int(prewarm))
+
+    def load_yaml(self, filename):
+        """指定されたYAMLファイルをそのまま読み込む（展開処理ではキャッシュされたload_data_fileを使う）"""
+        yaml_path = os.path.join(self.data_dir, f"{filename}.yaml")
+
+        if os.path.exists(yaml_path):
+            return parse_yaml_file(yaml_path) or {}
+        else:
+            logger.warning("%s.yaml not found at %s", filename, yaml_path)
+            return {}
+
+    def load_data_file(self, filename, data_dir=None):
+        """指定されたYAMLファイルを索引付きのDataFileとして読み込む（見つからない場合はNone）"""
+        data_dir = data_dir or self.data_dir
+        yaml_path = os.path.join(data_dir, f"{filename}.yaml")
+
+        trusted = self.is_watching(data_dir)
+        pack = datapack.registry.get(data_dir, trusted) if self.pack_mode != "off" else None
+        data_file = yaml_cache.get(yaml_path, pack, filename, lazy=self.lazy_load, trusted=trusted)
+        if data_file is None:
+            warn_once(('missing', yaml_path), "%s.yaml not found at %s", filename, yaml_path)
+        elif self.pack_mode == "auto" and not data_file.packed:
+            # パックより新しいYAMLを読んだのでパックを作り直す
+            datapack.registry.compile_in_background(data_dir, load=parse_yaml_file)
+        return data_file
+
+    def start_watching(self):
+        """data_dirの監視を開始する（開始できた場合はTrue）"""
+        backend = "poll" if self.watch_mode == "poll" else None
+        self.watcher = watch_data_dir(self.data_dir, backend=backend)
+        return self.watcher is not None
+
+    def is_watching(self, data_dir=None):
+        """data_dir（省略時は現在のdata_dir）が監視されていて、statを省略できるか"""
+        data_watcher = self.watcher
+        return (data_watcher is not None and data_watcher.active
+                and data_watcher.root == os.path.abspath(data_dir or self.data_dir))
+
+    def prewarm(self, workers=None):
+        """data_dir以下のすべてのYAMLファイルをバックグラウンドでキャッシュに読み込む
+
+        展開処理が読み込み中のファイルを要求した場合は、そのファイルの完了だけを待つ。
+        同じdata_dirのプリウォームが既に実行中・完了済みの場合は何もせずNoneを返す。
+        短時間で終了するプロセスでは、終了前にstop_prewarmで中止するか、返したスレッドをjoinする。
+        """
+        data_dir = os.path.abspath(self.data_dir)
+        with _watchers_lock:
+            if data_dir in _prewarmed:
+                return None
+            _prewarmed.add(data_dir)
+
+        files = [relname for relname, _ in datapack.find_yaml_files(data_dir)]
+        workers = workers or min(4, os.cpu_count() or 1)
+        cancel = self._prewarm_cancel = threading.Event()
+        # スレッドを開始する前にimportしておく（インタープリターの終了中にスレッドからimportしない）
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        def run():
+            started = time.perf_counter()
+            # 進捗はおよそ10%ごとに表示する（ファイルが少ない場合は完了時のみ）
+            step = max(10, len(files) // 10)
+            done = 0
+            try:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chara-situation-prewarm") as executor:
+                    futures = []
+                    for relname in files:
+                        if cancel.is_set():
+                            break
+                        futures.append(executor.submit(self.load_data_file, relname, data_dir))
+                    for future in as_completed(futures):
+                        if cancel.is_set():
+                            for pending in futures:
+                                pending.cancel()
+                            break
+                        try:
+                            future.result()
+                        except Exception as e:
+                            logger.warning("Pre-warm failed: %s", e)
+                        done += 1
+                        if done % step == 0 and done < len(files):
+                            logger.info("Pre-warm: %d/%d files (%.2fs)", done, len(files),
+                                        time.perf_counter() - started)
+            except RuntimeError:
+                # インタープリターの終了中はスレッドプールに追加できないので、そのまま終える
+                cancel.set()
+            if cancel.is_set():
+                # 中止した場合は、次のプリウォームで読み込み直せるようにする
+                with _watchers_lock:
+                    _prewarmed.discard(data_dir)
+                logger.debug("Pre-warm stopped after %d/%d files", done, len(files))
+                return
+            logger.info("Pre-warmed %d files in %.2fs", len(files), time.perf_counter() - started)
+
+        thread = self.prewarm_thread = threading.Thread(target=run, name="chara-situation-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_prewarm(self, timeout=None):
+        """実行中のプリウォームを中止して終了を待つ（timeout秒以内に終了した場合・実行中でない場合はTrue）
+
+        読み込み中のファイルは完了を待ち、まだ始まっていないファイルは読み込まない。
+        """
+        thread = self.prewarm_thread
+        if thread is None:
+            return True
+        self._prewarm_cancel.set()
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def compile_data_pack(self):
+        """data_dir以下のYAMLファイルをデータパックに変換する"""
+        return datapack.compile_pack(self.data_dir, load=parse_yaml_file)
+
+    def cache_stats(self):
+        """YAMLキャッシュの統計を返す"""
+        return yaml_cache.stats()
+
+    def template_cache_stats(self):
+        """プロンプトテンプレートキャッシュの統計を返す"""
+        return template_cache.stats()
+
+    def result_cache_stats(self):
+        """展開結果キャッシュの統計を返す"""
+        return result_cache.stats()
+
+    def enable_metrics(self, interval=None, path=None):
+        """段階ごとの所要時間の計測を開始する（intervalを指定するとその間隔で表示する）"""
+        stage_metrics.enabled = True
+        if interval:
+            stage_metrics.start_dumping(interval, path)
+
+    def disable_metrics(self):
+        """計測を停止する（集計済みの結果は残る）"""
+        stage_metrics.enabled = False
+
+    def stage_stats(self):
+        """段階ごとの所要時間の分布とキャッシュのヒット率を返す"""
+        return stage_metrics.snapshot()
+
+    def reset_stage_stats(self):
+        stage_metrics.reset()
+
+    def invalidate_cache(self, filename=None):
+        """YAMLキャッシュを破棄する（filename省略時はすべて）"""
+        if filename is None:
+            yaml_cache.invalidate()
+            result_cache.clear()
+        else:
+            yaml_cache.invalidate(os.path.join(self.data_dir, f"{filename}.yaml"))
+
+    def expand_prompt(self, prompt, seed):
+        """1つのプロンプトを展開する"""
+        return self.expand_batch([prompt], [seed])[0]
+
+    def expand_batch(self, prompts, seeds):
+        """
+        複数のプロンプトをまとめて展開する
+        タグの解析・YAMLの読み込み・固定キーのシチュエーション収集はプロンプトごとに1回だけ行い、
+        seedごとにはrandomキーの選択と展開のみを行う
+        """
+        files = {}  # このバッチで読み込んだファイル (filename -> DataFile)
+        merged_rules = {}  # このバッチでまとめたルール (SituationRuleのタプル -> MergedRules)
+        templates = {}  # プロンプトごとのテンプレート (prompt -> PromptTemplate)
+        plans = {}  # プロンプトごとの展開計画 (prompt -> _ExpansionPlan)
+        results = []
+
+        # 段階ごとの計測（無効の場合はNoneで、時刻を取らない）
+        timings = [] if stage_metrics.enabled else None
+        if timings is not None:
+            batch_started = started = time.perf_counter_ns()
+
+        # @filename:key の形式はコンパイル済みテンプレートのスロットとして取得する
+        for prompt in prompts:
+            if prompt not in templates:
+                templates[prompt] = template_cache.get(prompt)
+
+        if timings is not None:
+            now = time.perf_counter_ns()
+            timings.append(('template', now - started))
+            started = now
+
+        # まだキャッシュにないファイルが複数あれば並列に読み込んでおく
+        self._load_files_concurrently(templates.values(), files)
+
+        if timings is not None:
+            timings.append(('load', time.perf_counter_ns() - started))
+
+        for prompt, seed in zip(prompts, seeds):
+            if prompt not in plans:
+                plans[prompt] = self._prepare_expansion(templates[prompt], files, timings)
+            plan = plans[prompt]
+
+            if plan is None:
+                results.append(prompt)
+            else:
+                results.append(self._expand_plan(plan, seed, merged_rules, timings))
+
+        if timings is not None:
+            timings.append(('batch', time.perf_counter_ns() - batch_started))
+            stage_metrics.record(timings)
+
+        return results
+
+    def iter_expansions(self, prompt, seeds, mode="compat", chunk_size=4096):
+        """promptをseedsの順に展開して (seed, 展開後のプロンプト) を返すジェネレーター
+
+        seedsはchunk_size件ずつ取り出すため、無限のイテラブルでもよい（stream.iter_expansions）。
+        """
+        from .stream import iter_expansions
+        return iter_expansions(self, prompt, seeds, mode, chunk_size)
+
+    def _load_files_concurrently(self, templates, files):
+        """テンプレートが参照するファイルのうち、キャッシュにないものを並列に読み込んでfilesに追加する
+
+        同じファイルの同時読み込みはYamlCacheが1回にまとめる。結果はタグの出現順にfilesへ入れるため、
+        展開結果（seedによるrandomの選択順を含む）は逐次読み込みと変わらない。
+        """
+        filenames = dict.fromkeys(slot[1] for template in templates for slot in template.slots)
+        cold = [filename for filename in filenames
+                if filename not in files
+                and not yaml_cache.is_cached(os.path.join(self.data_dir, f"{filename}.yaml"))]
+        if len(cold) < 2:
+            return
+
+        data_dir = self.data_dir
+        results = _get_load_executor().map(lambda filename: self.load_data_file(filename, data_dir), cold)
+        for filename, data_file in zip(cold, results):
+            files[filename] = data_file
+
+    def _prepare_expansion(self, template, files, timings=None):
+        """seedに依存しない処理（ファイル読み込み・固定キーの解決）を行う"""
+        if not template.slots:
+            return None
+
+        # すべてのタグを解析して、データを読み込む
+        items = []
+        for full_tag, filename, key, conditions in template.slots:
+            # YAMLファイルを読み込む（バッチ内では1ファイル1回）
+            if filename not in files:
+                if timings is not None:
+                    started = time.perf_counter_ns()
+                files[filename] = self.load_data_file(filename)
+                if timings is not None:
+                    timings.append(('load', time.perf_counter_ns() - started))
+            source = files[filename]
+
+            if source is None or not source.entries:
+                warn_once(('empty', self.data_dir, filename, source and source.stamp),
+                          "File not found or empty: %s.yaml", filename)
+                items.append(None)
+                continue
+
+            # random キーはseedごとに選択する（重み・絞り込み条件はファイルの索引から事前に解決）
+            if key == "random":
+                sampler = source.filtered_sampler(conditions)
+                if not sampler.keys:
+                    warn_once(('no_keys', source.path, source.stamp, full_tag),
+                              "No keys available in %s.yaml for random selection: %s", filename, full_tag)
+                    items.append(None)
+                    continue
+                items.append(_TagItem(full_tag, filename, None, None, source, sampler))
+                continue
+
+            # キーが存在するか確認
+            if key not in source.entries:
+                # 同じファイルの版では1回だけ警告する（バッチのたびに同じ警告を出さない）
+                warn_once(('key', source.path, source.stamp, key), "Key '%s' not found in %s.yaml", key, filename)
+                items.append(None)
+                continue
+
+            items.append(_TagItem(full_tag, filename, key, source.entries[key], source))
+
+        # 固定キーのシチュエーション定義はここで1回だけ収集する
+        fixed_rules = tuple(item.rule for item in items
+                            if item is not None and item.key is not None and item.rule.mode is not None)
+
+        return _ExpansionPlan(template, items, fixed_rules)
+
+    def _expand_plan(self, plan, seed, merged_rules, timings=None):
+        """展開計画にseedを適用してプロンプトを展開する（timingsには段階ごとの所要時間を追加する）"""
+        if not plan.has_random and plan.fixed_result is not None:
+            result, expanded_tags = plan.fixed_result
+            if expanded_tags and self.log_expansions and logger.isEnabledFor(logging.INFO):
+                logger.info("%s => %s", ' + '.join(expanded_tags), result)
+            return result
+
+        started = time.perf_counter_ns() if timings is not None else None
+
+        # random キーの処理（タグの出現順に選択する）
+        chosen = ()
+        if plan.has_random:
+            # seedを使って決定的な乱数生成器を作成
+            rng = random.Random(seed)
+            # 事前に作った索引から選ぶ（重みも条件もなければrandom.Random(seed).choiceと同じ選択結果）
+            chosen = tuple(item.sampler.draw(rng) for item in plan.random_items)
+
+        return self._expand_chosen(plan, chosen, merged_rules, timings, started)
+
+    def _expand_chosen(self, plan, chosen, merged_rules, timings=None, started=None):
+        """randomタグのキー（chosen、タグの出現順）を決めた展開計画を展開する"""
+        if timings is not None and started is None:
+            started = time.perf_counter_ns()
+
+        # 同じキーの組み合わせ・同じ版のファイルなら以前の展開結果を使う
+        if result_cache.maxsize > 0:
+            cache_key = (plan.cache_key, chosen)
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                result, expanded_tags = cached
+                if timings is not None:
+                    timings.append(('resolve_random', time.perf_counter_ns() - started))
+                if not plan.has_random:
+                    plan.fixed_result = cached
+                if expanded_tags and self.log_expansions and logger.isEnabledFor(logging.INFO):
+                    logger.info("%s => %s", ' + '.join(expanded_tags), result)
+                return result
+        else:
+            cache_key = None
+
+        resolved = []
+        rule_key = plan.fixed_rules
+        if plan.has_random:
+            random_rules = []
+            keys = iter(chosen)
+            for item in plan.items:
+                if item is not None and item.key is None:
+                    key = next(keys)
+                    item = _TagItem(item.full_tag, item.filename, key, item.source.entries[key], item.source)
+                    if item.rule.mode is not None:
+                        random_rules.append(item.rule)
+                resolved.append(item)
+            rule_key = rule_key + tuple(random_rules)
+        else:
+            resolved = plan.items
+
+        if timings is not None:
+            now = time.perf_counter_ns()
+            timings.append(('resolve_random', now - started))
+            started = now
+
+        # 同じ組み合わせのルールはバッチ内で1回だけまとめる
+        rules = merged_rules.get(rule_key)
+        if rules is None:
+            rules = merged_rules[rule_key] = MergedRules(rule_key)
+            if rules.duplicates:
+                warn_once(('duplicate', rule_key), "Fields specified by more than one situation: %s",
+                          ", ".join(sorted(rules.duplicates)))
+
+        if timings is not None:
+            now = time.perf_counter_ns()
+            timings.append(('collect_rules', now - started))
+            started = now
+
+        # includeとexcludeの混在チェック（複数のシチュエーション間）
+        if rules.conflict:
+            warn_once(('conflict', rule_key), "Cannot mix 'include' and 'exclude' across multiple situations",
+                      level=logging.ERROR)
+            # エラー時はタグを展開せずに元のプロンプトを返す
+            return plan.prompt
+
+        result, expanded_tags = self._render(plan.template, resolved, rules)
+
+        if timings is not None:
+            now = time.perf_counter_ns()
+            timings.append(('expand', now - started))
+            started = now
+
+        result = _cleanup(result)
+
+        if timings is not None:
+            timings.append(('cleanup', time.perf_counter_ns() - started))
+
+        if not plan.has_random:
+            plan.fixed_result = (result, expanded_tags)
+        if cache_key is not None:
+            result_cache.put(cache_key, (result, expanded_tags))
+
+        if expanded_tags and self.log_expansions and logger.isEnabledFor(logging.INFO):
+            logger.info("%s => %s", ' + '.join(expanded_tags), result)
+
+        return result
+
+    def _render(self, template, items, rules):
+        """解決済みのタグを展開してテンプレートに埋め込む（整理前の文字列を返す）"""
+        texts = []
+        expanded_tags = []
+
+        for (full_tag, _, _, _), item in zip(template.slots, items):
+            # 解決できなかったタグはそのまま残す
+            if item is None:
+                texts.append(full_tag)
+                continue
+
+            entry = item.entry
+
+            if entry.text is not None:
+                # シチュエーション定義（または辞書でないエントリ）の場合は展開済みの文字列
+                expanded = entry.text
+            else:
+                # キャラクター定義の場合 - まとめたinclude/excludeルールを使用
+                expanded = rules.apply(entry)
+
+            expanded_tags.append(f"{item.filename}:{item.key}")
+            texts.append(expanded)
+
+        # タグの位置に展開された内容を埋め込む
+        return template.render(texts), expanded_tags
+
+    def expand_character_with_exclude(self, chara, excludes):
+        """キャラクター定義を展開（exclude方式）"""
+        if not isinstance(chara, dict):
+            return str(chara)
+
+        # キャラの各タグを処理（excludeに含まれないものを出力）
+        excludes = excludes if isinstance(excludes, frozenset) else _field_set(excludes)
+        return ", ".join(text for key, text in render_fields(chara) if key not in excludes)
+
+    def expand_character_with_include(self, chara, includes):
+        """キャラクター定義を展開（include方式）"""
+        if not isinstance(chara, dict):
+            return str(chara)
+
+        # キャラの各タグを処理（includeに含まれるもののみ出力）
+        includes = includes if isinstance(includes, frozenset) else _field_set(includes)
+        return ", ".join(text for key, text in render_fields(chara) if key in includes)
+
+    def expand_situation(self, situation):
+        """シチュエーション定義を展開"""
+        if not isinstance(situation, dict):
+            return str(situation)
+
+        return situation_text(situation)
@@ -0,0 +1,105 @@
+"""
+YAMLファイルのトップレベルキーの位置を索引し、必要なキーのブロックだけをパースする
+
+索引できるのは、トップレベルが単純なブロック形式のマッピングで、
+結果がファイル全体をパースした場合と必ず一致するファイルだけ。
+アンカー・エイリアス・複数ドキュメント・フロー形式・文字列でないキー・重複キー・
+weightという語（weightフィールドの可能性がある）などを含むファイルはNoneを返し、呼び出し側でファイル全体をパースする。
+"""
+
+import re
+
+from . import yamlio
+
+# 1列目から始まる行（コメント・空行を除く）
+_TOP_LEVEL_LINE = re.compile(rb'^(?![ \t\r\n#])[^\r\n]*', re.MULTILINE)
+# トップレベルのキー行: key: / 'key': / "key":
+_KEY_LINE = re.compile(rb'''^(?:(?P<plain>[^\s#'"&*!|>%@`{}\[\],?:-][^\r\n#]*?)|'(?P<single>[^'\r\n]*)'|"(?P<double>[^"\\\r\n]*)")[ \t]*:(?:[ \t]|$)''')
+# ファイル全体のパースと結果が変わりうる要素（アンカー・エイリアス・タグ・マージキー）
+_UNSAFE = re.compile(rb'(?:^|[\s\[{,:-])[&*!][^\s]|<<[ \t]*:')
+# 重み付きランダム選択はファイル全体の情報が必要なため対象外
+# （フロー形式・引用符付きのキーも見逃さないよう、weightという語がどこかにあれば全体をパースする）
+_WEIGHT_FIELD = re.compile(rb'weight')
+
+_resolver = None
+
+
+def _resolve_tag(text):
+    """プレーンなスカラーとして解釈したときのタグ（PyYAMLは最初に使うときにimportする）"""
+    global _resolver
+    import yaml
+    if _resolver is None:
+        _resolver = yaml.resolver.Resolver()
+    return _resolver.resolve(yaml.ScalarNode, text, (True, False))
+
+
+def _key_text(match):
+    """キー行からキーの文字列を取り出す（文字列にならないキーはNone）"""
+    if match.group('single') is not None:
+        return match.group('single').decode('utf-8')
+    if match.group('double') is not None:
+        return match.group('double').decode('utf-8')
+    text = match.group('plain').decode('utf-8')
+    # 数値・真偽値・nullなどとして解釈されるキーは対象外
+    if _resolve_tag(text) != 'tag:yaml.org,2002:str':
+        return None
+    return text
+
+
+class LazyYamlIndex:
+    """トップレベルキー -> バイト範囲 の索引"""
+    __slots__ = ('content', 'keys', 'spans')
+
+    def __init__(self, content, keys, spans):
+        self.content = content
+        self.keys = keys
+        self.spans = spans
+
+    def load(self, key):
+        """keyのブロックだけをパースして値を返す"""
+        start, end = self.spans[key]
+        return yamlio.parse_text(self.content[start:end])[key]
+
+
+def build_index(content):
+    """YAMLのバイト列から索引を作る（安全に索引できない場合はNone）"""
+    if content.startswith(b'\xef\xbb\xbf'):
+        return None
+    try:
+        content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    if _UNSAFE.search(content) or _WEIGHT_FIELD.search(content):
+        return None
+
+    keys = []
+    starts = []
+    seen = set()
+    for line in _TOP_LEVEL_LINE.finditer(content):
+        if not line.group(0):
+            continue
+        match = _KEY_LINE.match(line.group(0))
+        if match is None:
+            # '---' や '%YAML'、フロー形式など、トップレベルのキー行以外
+            return None
+        key = _key_text(match)
+        if key is None or key in seen:
+            return None
+        seen.add(key)
+        keys.append(key)
+        starts.append(line.start())
+
+    if not keys:
+        return None
+
+    spans = {}
+    ends = starts[1:] + [len(content)]
+    for key, start, end in zip(keys, starts, ends):
+        spans[key] = (start, end)
+    return LazyYamlIndex(content, tuple(keys), spans)
+
+
+def index_file(path):
+    """YAMLファイルの索引を作る（安全に索引できない場合はNone）"""
+    with open(path, 'rb') as f:
+        return build_index(f.read())
@@ -0,0 +1,239 @@
+"""
+コンソールへのログ出力（レベル付き・非同期・警告の重複抑制）
+
+ログは "chara_situation" ロガーに出力し、既定では専用スレッドが標準出力にまとめて書き込む。
+展開処理のスレッドはキューに入れるだけで、端末への書き込みを待たない。
+
+    CHARA_SITUATION_LOG_LEVEL: debug / info（既定）/ warning / error
+    CHARA_SITUATION_LOG_ASYNC: on（既定）/ off（呼び出したスレッドで書き込む）
+
+同じ原因の警告（存在しないキーなど）は warn_once でファイルの版ごとに1回だけ出力する。
+"""
+
+import atexit
+import contextlib
+import logging
+import os
+import queue
+import sys
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("chara_situation")
+
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+
+class _Formatter(logging.Formatter):
+    """既存の print と同じ "[CharaSituation] WARNING: ..." 形式"""
+
+    def format(self, record):
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        if record.levelno >= logging.WARNING:
+            return f"[CharaSituation] {record.levelname}: {message}"
+        return f"[CharaSituation] {message}"
+
+
+class StdoutHandler(logging.Handler):
+    """書き込み時点の sys.stdout に出力する（呼び出したスレッドで書き込む）"""
+
+    def emit(self, record):
+        try:
+            sys.stdout.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+class AsyncStdoutHandler(logging.Handler):
+    """レコードをキューに入れ、整形と書き込みは専用スレッドでまとめて行う
+
+    キューがmax_pending件を超えた場合（端末が詰まっているなど）は新しいレコードを捨て、
+    捨てた件数を後で出力する。
+    """
+
+    def __init__(self, max_pending=10000):
+        super().__init__()
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # fork したワーカープロセスには書き込みスレッドが引き継がれないので、プロセスごとに開始する
+        with self._start_lock:
+            if self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chara-situation-log", daemon=True)
+                self._thread.start()
+                self._thread_pid = os.getpid()
+
+    def emit(self, record):
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            return
+        # 引数は呼び出し時点の値で文字列にしておく（整形は書き込みスレッドで行う）
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        self._queue.put(record)
+        if self._thread_pid != os.getpid():
+            self._ensure_thread()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # 溜まっているレコードはまとめて1回で書き込む
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            waiters = []
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    try:
+                        lines.append(self.format(item))
+                    except Exception:
+                        self.handleError(item)
+            if self.dropped:
+                lines.append(f"[CharaSituation] WARNING: {self.dropped} log messages dropped")
+                self.dropped = 0
+            if lines:
+                try:
+                    sys.stdout.write("\n".join(lines) + "\n")
+                    sys.stdout.flush()
+                except Exception:
+                    pass
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def flush(self, timeout=5.0):
+        """キューに入っているレコードがすべて書き込まれるまで待つ"""
+        if self._thread_pid != os.getpid() or not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        if self._thread_pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(5.0)
+        super().close()
+
+
+class _SeenKeys:
+    """最近出力した警告のキー（maxsize件を超えたら古いものから忘れる）"""
+
+    def __init__(self, maxsize=4096):
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+        self.maxsize = maxsize
+        self.suppressed = 0
+
+    def first(self, key):
+        """keyが初めて（または忘れた後に）現れた場合はTrue"""
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.suppressed += 1
+                return False
+            self._keys[key] = None
+            if len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+_seen = _SeenKeys()
+_handler = None
+
+
+def warn_once(key, message, *args, level=logging.WARNING):
+    """keyごとに1回だけ出力する（keyにはファイルのパスとstampなど、原因を特定できる値を入れる）"""
+    if logger.isEnabledFor(level) and _seen.first(key):
+        logger.log(level, message, *args)
+
+
+def reset_warnings():
+    """warn_onceで出力済みの警告を忘れる"""
+    _seen.clear()
+
+
+def suppressed_warnings():
+    """warn_onceで抑制した警告の件数"""
+    return _seen.suppressed
+
+
+def flush():
+    """出力待ちのログをすべて書き込む"""
+    if _handler is not None:
+        _handler.flush()
+
+
+@contextlib.contextmanager
+def redirect_to_stderr():
+    """with文の中のログを、設定済みのハンドラーの代わりに標準エラー出力へ直接書く
+
+    終了後は元のハンドラー（レベル・同期/非同期の設定を含む）に戻す。sys.stdoutは変更しない。
+    """
+    flush()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(_Formatter())
+    previous = list(logger.handlers)
+    for h in previous:
+        logger.removeHandler(h)
+    logger.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        logger.removeHandler(handler)
+        for h in previous:
+            logger.addHandler(h)
+
+
+def configure(level=None, async_output=None):
+    """ログレベルと出力方法を設定する（省略した値は環境変数から読む）"""
+    global _handler
+    if level is None:
+        level = os.environ.get("CHARA_SITUATION_LOG_LEVEL", "info")
+    if isinstance(level, str):
+        level = LEVELS.get(level.lower(), logging.INFO)
+    if async_output is None:
+        async_output = os.environ.get("CHARA_SITUATION_LOG_ASYNC", "on").lower() not in ("0", "off", "false")
+
+    if _handler is not None:
+        logger.removeHandler(_handler)
+        _handler.close()
+    _handler = AsyncStdoutHandler() if async_output else StdoutHandler()
+    _handler.setFormatter(_Formatter())
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    # WebUIのルートロガーには流さない（これまでのprintと同じく1回だけ出力する）
+    logger.propagate = False
+    return _handler
+
+
+configure()
+atexit.register(lambda: _handler.close() if _handler is not None else None)
@@ -0,0 +1,169 @@
+"""
+展開処理の段階ごとの所要時間を集計する（無効の場合は計測しない）
+
+段階: template（タグの解析）/ load（YAMLの読み込み）/ resolve_random（randomキーの選択）/
+collect_rules（include・excludeのまとめ）/ expand（タグの置き換え）/ cleanup（カンマ・空白の整理）/
+batch（expand_batch全体）
+
+所要時間はナノ秒単位で、2のべき乗ごとに4分割したバケットのヒストグラムに入れる。
+"""
+
+import json
+import threading
+import time
+
+from .log import logger
+
+STAGES = ('template', 'load', 'resolve_random', 'collect_rules', 'expand', 'cleanup', 'batch')
+
+# 2のべき乗ごとのバケットの分割数（log2）
+_SUB_BITS = 2
+_SUB_BUCKETS = 1 << _SUB_BITS
+
+
+def _bucket(value):
+    """値が入るバケットの番号"""
+    if value < _SUB_BUCKETS:
+        return max(value, 0)
+    exponent = value.bit_length() - 1
+    return (exponent - _SUB_BITS + 1) * _SUB_BUCKETS + ((value >> (exponent - _SUB_BITS)) & (_SUB_BUCKETS - 1))
+
+
+def _bucket_upper(index):
+    """バケットに入る値の上限（この値未満）"""
+    if index < _SUB_BUCKETS:
+        return index + 1
+    exponent = index // _SUB_BUCKETS + _SUB_BITS - 1
+    sub = index % _SUB_BUCKETS
+    return (1 << exponent) + ((sub + 1) << (exponent - _SUB_BITS))
+
+
+class Histogram:
+    """1つの段階の所要時間の分布"""
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        index = _bucket(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, fraction):
+        """fractionの位置の値（バケットの上限で近似する。最大値は超えない）"""
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(_bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self):
+        """マイクロ秒単位の要約"""
+        return {
+            'count': self.count,
+            'total_ms': self.total / 1e6,
+            'mean_us': self.total / self.count / 1e3 if self.count else 0.0,
+            'min_us': (self.min or 0) / 1e3,
+            'p50_us': self.percentile(0.50) / 1e3,
+            'p90_us': self.percentile(0.90) / 1e3,
+            'p99_us': self.percentile(0.99) / 1e3,
+            'max_us': self.max / 1e3,
+        }
+
+
+class StageMetrics:
+    """段階ごとのヒストグラム（プロセス内で共有する）
+
+    展開処理は enabled の場合だけ時刻を取り、バッチごとに record でまとめて登録する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {stage: Histogram() for stage in STAGES}
+        self._sources = {}  # 名前 -> ヒット率などを返す関数（スナップショットに含める）
+        self._dumper = None
+        self.enabled = False
+
+    def add_source(self, name, stats):
+        """スナップショットに含める統計（キャッシュのヒット率など）を登録する"""
+        self._sources[name] = stats
+
+    def record(self, samples):
+        """(段階, ナノ秒) の並びを登録する"""
+        with self._lock:
+            histograms = self._histograms
+            for stage, value in samples:
+                histograms[stage].add(value)
+
+    def snapshot(self):
+        """段階ごとの要約と、登録された統計を返す"""
+        with self._lock:
+            stages = {stage: histogram.summary() for stage, histogram in self._histograms.items()}
+        result = {'enabled': self.enabled, 'stages': stages}
+        for name, stats in self._sources.items():
+            result[name] = stats()
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {stage: Histogram() for stage in STAGES}
+
+    def format(self, snapshot=None):
+        """コンソール表示用の表"""
+        snapshot = snapshot or self.snapshot()
+        lines = [f"{'stage':<16} {'count':>8} {'total ms':>10} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'max us':>9}"]
+        for stage, s in snapshot['stages'].items():
+            if s['count']:
+                lines.append(f"{stage:<16} {s['count']:>8} {s['total_ms']:>10.1f} {s['mean_us']:>9.1f} "
+                             f"{s['p50_us']:>9.1f} {s['p99_us']:>9.1f} {s['max_us']:>9.1f}")
+        for name in self._sources:
+            hit_rate = snapshot[name].get('hit_rate')
+            if hit_rate is not None:
+                lines.append(f"{name} hit rate: {hit_rate:.1%}")
+        return "\n".join(lines)
+
+    def dump(self, path=None):
+        """集計結果をログに出力する（pathを指定するとJSONでも保存する）"""
+        snapshot = self.snapshot()
+        logger.info("Stage timings:\n%s", self.format(snapshot))
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2)
+        return snapshot
+
+    def start_dumping(self, interval, path=None):
+        """interval秒ごとにdumpするスレッドを開始する（既に動作中なら何もしない）"""
+        with self._lock:
+            if self._dumper is not None:
+                return
+            self._dumper = threading.Thread(target=self._dump_loop, args=(interval, path),
+                                            name="chara-situation-metrics", daemon=True)
+        self._dumper.start()
+
+    def _dump_loop(self, interval, path):
+        last_count = 0
+        while True:
+            time.sleep(interval)
+            count = self._histograms['batch'].count
+            # 前回から展開がなければ表示しない
+            if count != last_count:
+                last_count = count
+                self.dump(path)
+
+
+# すべてのExpansionEngineで共有する
+stage_metrics = StageMetrics()
@@ -0,0 +1,70 @@
+"""
+展開結果のキャッシュ
+
+キーは (プロンプト, 参照したファイルの (パス, stamp) の並び, randomで選ばれたキーの並び)。
+ファイルが変わればstampが変わるため、古い結果が使われることはない（古いものはLRUで追い出される）。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """展開結果のLRUキャッシュ（値は (展開後のプロンプト, 展開したタグの一覧)）"""
+
+    def __init__(self, maxsize=4096):
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """キャッシュされた結果を返す（なければNone）"""
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            if self.maxsize > 0:
+                self._results[key] = result
+                self._evict()
+
+    def resize(self, maxsize):
+        """最大件数を変更する（0でキャッシュ無効）"""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self._results) > max(self.maxsize, 0):
+            self._results.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def stats(self):
+        """ヒット率などの統計を返す"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._results),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+result_cache = ResultCache(int(os.environ.get("CHARA_SITUATION_RESULT_CACHE_SIZE", "4096")))
@@ -0,0 +1,371 @@
+"""
+展開サービス（WebUIの外の複数のツールから、1つのプロセスのキャッシュを共有して展開する）
+
+    python -m lib_chara_situation serve --port 8765
+    python -m lib_chara_situation serve --socket /tmp/chara-situation.sock
+
+localhostのHTTPまたはUnixソケット上のHTTPで、次のJSONのAPIを提供する（結果は expand_prompt と同じ）:
+
+    POST /expand        {"prompt": "...", "seed": 1}                 -> {"prompt": "..."}
+    POST /expand_batch  {"prompts": ["...", ...], "seeds": [1, ...]}  -> {"prompts": ["...", ...]}
+    GET  /stats                                                     -> 要求数・まとめた数・キャッシュの統計
+
+同時に届いた要求は batch_delay 秒待ってから1回の expand_batch にまとめて展開する（同じテンプレートの
+解析・読み込み・ルールのまとめは1回で済む）。展開中・待機中の要求と同じ (プロンプト, seed) の要求は
+新たに展開せず、その結果を共有する。展開は1つのスレッドで行うため、イベントループは止まらない。
+
+クライアントは ServiceClient（標準ライブラリのみ）。
+"""
+
+import asyncio
+import http.client
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from .log import logger
+
+# 1つの要求の本文の上限（バイト）
+MAX_BODY = 16 * 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """クライアントに返すエラー（status と メッセージ）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Coalescer:
+    """同時に届いた展開要求をまとめて engine.expand_batch で展開する
+
+    同じ (プロンプト, seed) の要求は、展開が終わるまで1つのFutureを共有する。
+    """
+
+    def __init__(self, engine, batch_delay=0.002, max_batch=1024):
+        self.engine = engine
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        # engineの展開は1つのスレッドでのみ行う
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chara-situation-service")
+        self._inflight = {}  # (プロンプト, seed) -> Future
+        self._pending = []  # まだ展開を始めていない (プロンプト, seed)
+        self._timer = None
+        self._tasks = set()
+        self.requests = 0
+        self.coalesced = 0
+        self.expanded = 0
+        self.batches = 0
+
+    async def expand(self, prompt, seed):
+        """1つのプロンプトを展開する（同時に届いた他の要求とまとめる）"""
+        self.requests += 1
+        key = (prompt, seed)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self._inflight[key] = loop.create_future()
+            self._pending.append(key)
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.batch_delay, self._flush)
+        # 1つの要求が取り消されても、同じFutureを待つ他の要求には影響しない
+        return await asyncio.shield(future)
+
+    async def expand_batch(self, prompts, seeds):
+        """複数のプロンプトを展開する（要求の中の重複も他の要求との重複もまとめる）"""
+        return list(await asyncio.gather(*(self.expand(prompt, seed) for prompt, seed in zip(prompts, seeds))))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        keys, self._pending = self._pending, []
+        if keys:
+            task = asyncio.get_running_loop().create_task(self._run(keys))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, keys):
+        loop = asyncio.get_running_loop()
+        prompts = [prompt for prompt, _ in keys]
+        seeds = [seed for _, seed in keys]
+        self.batches += 1
+        self.expanded += len(keys)
+        try:
+            results = await loop.run_in_executor(self._executor, self.engine.expand_batch, prompts, seeds)
+        except Exception:
+            # 失敗の原因になったプロンプトの要求だけを失敗させる（まとめられた他の要求は展開し直す）
+            logger.warning("Expansion failed for a batch of %d prompts, retrying each prompt separately", len(keys))
+            results = await loop.run_in_executor(self._executor, self._expand_each_prompt, keys)
+        for key, result in zip(keys, results):
+            future = self._inflight.pop(key)
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _expand_each_prompt(self, keys):
+        """keysをプロンプトごとに展開する（失敗したプロンプトの要求には結果の代わりに例外を返す）"""
+        groups = {}
+        for index, (prompt, seed) in enumerate(keys):
+            groups.setdefault(prompt, []).append((index, seed))
+        results = [None] * len(keys)
+        for prompt, group in groups.items():
+            try:
+                expanded = self.engine.expand_batch([prompt] * len(group), [seed for _, seed in group])
+            except Exception as e:
+                logger.exception("Expansion failed for %r", prompt)
+                expanded = [e] * len(group)
+            for (index, _), result in zip(group, expanded):
+                results[index] = result
+        return results
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'coalesced': self.coalesced,
+            'expanded': self.expanded,
+            'batches': self.batches,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def _parse_seed(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise RequestError(400, f"seed must be an integer: {value!r}")
+    return value
+
+
+def _parse_prompt(value):
+    if not isinstance(value, str):
+        raise RequestError(400, f"prompt must be a string: {value!r}")
+    return value
+
+
+class ExpansionService:
+    """ExpansionEngine をHTTP（TCPまたはUnixソケット）で提供する"""
+
+    def __init__(self, engine, batch_delay=0.002, max_batch=1024):
+        self.engine = engine
+        self.coalescer = Coalescer(engine, batch_delay, max_batch)
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8765, path=None):
+        """待ち受けを開始する（pathを指定するとUnixソケット、port=0で空いているポート）"""
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    @property
+    def address(self):
+        """待ち受けているアドレス（TCPなら (host, port)、Unixソケットならパス）"""
+        return self._server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await asyncio.get_running_loop().run_in_executor(None, self.coalescer.close)
+
+    async def handle(self, method, path, body):
+        """1つの要求を処理して (status, 応答のJSON) を返す"""
+        if path == "/stats":
+            if method != "GET":
+                raise RequestError(405, "use GET")
+            stats = self.coalescer.stats()
+            stats['yaml_cache'] = self.engine.cache_stats()
+            stats['template_cache'] = self.engine.template_cache_stats()
+            stats['result_cache'] = self.engine.result_cache_stats()
+            return 200, stats
+        if path not in ("/expand", "/expand_batch"):
+            raise RequestError(404, f"unknown path: {path}")
+        if method != "POST":
+            raise RequestError(405, "use POST")
+        try:
+            request = json.loads(body or b"null")
+        except ValueError as e:
+            raise RequestError(400, f"invalid JSON: {e}") from None
+        if not isinstance(request, dict):
+            raise RequestError(400, "request body must be a JSON object")
+
+        if path == "/expand":
+            prompt = _parse_prompt(request.get("prompt"))
+            seed = _parse_seed(request.get("seed", 0))
+            return 200, {"prompt": await self.coalescer.expand(prompt, seed)}
+
+        prompts = request.get("prompts")
+        if not isinstance(prompts, list):
+            raise RequestError(400, "prompts must be a list")
+        prompts = [_parse_prompt(prompt) for prompt in prompts]
+        seeds = request.get("seeds", [0] * len(prompts))
+        if not isinstance(seeds, list) or len(seeds) != len(prompts):
+            raise RequestError(400, "seeds must be a list with one seed per prompt")
+        seeds = [_parse_seed(seed) for seed in seeds]
+        return 200, {"prompts": await self.coalescer.expand_batch(prompts, seeds)}
+
+    async def _handle_connection(self, reader, writer):
+        """1つの接続の要求を順に処理する（keep-alive）"""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # 要求行がStreamReaderの上限より長い（残りは読まずに接続を閉じる）
+                    self._write_response(writer, 400, {"error": "request line too long"}, False)
+                    await writer.drain()
+                    return
+                if not request_line:
+                    return
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                self._write_response(writer, 431, {"error": "request header too long"}, False)
+                return False
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        parts = request_line.decode("latin-1").split()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        try:
+            if len(parts) != 3:
+                raise RequestError(400, "malformed request line")
+            method, path, version = parts
+            if version == "HTTP/1.0":
+                keep_alive = headers.get("connection", "").lower() == "keep-alive"
+            try:
+                length = int(headers.get("content-length", "0") or 0)
+            except ValueError:
+                keep_alive = False
+                raise RequestError(400, "invalid Content-Length") from None
+            if length > MAX_BODY:
+                keep_alive = False
+                raise RequestError(413, f"request body is larger than {MAX_BODY} bytes")
+            body = await reader.readexactly(length) if length > 0 else b""
+            status, response = await self.handle(method, path.split("?", 1)[0], body)
+        except RequestError as e:
+            status, response = e.status, {"error": str(e)}
+        except Exception as e:
+            logger.exception("Request failed")
+            status, response = 500, {"error": str(e)}
+
+        self._write_response(writer, status, response, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    def _write_response(writer, status, response, keep_alive):
+        payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + payload
+        )
+
+
+def run(engine, host="127.0.0.1", port=8765, path=None, batch_delay=0.002, max_batch=1024, ready=None):
+    """サービスを起動して、中断されるまで待ち受ける（readyは待ち受け開始後にアドレスを渡して呼ばれる）"""
+
+    async def main():
+        service = ExpansionService(engine, batch_delay, max_batch)
+        await service.start(host, port, path)
+        if ready is not None:
+            ready(service.address)
+        else:
+            logger.info("Serving on %s", service.address)
+        try:
+            await service.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+class ServiceClient:
+    """展開サービスのクライアント（1つの接続を使い回す。スレッドごとに作る）
+
+        client = ServiceClient(port=8765)          # または ServiceClient(path="/tmp/chara-situation.sock")
+        client.expand("@characters:random", seed=1)
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, path=None, timeout=30.0):
+        if path is not None:
+            self._connection = _UnixHTTPConnection(path, timeout)
+        else:
+            self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        self._connection.request(method, path, body, headers)
+        response = self._connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RequestError(response.status, result.get("error", response.reason))
+        return result
+
+    def expand(self, prompt, seed=0):
+        """expand_prompt(prompt, seed) と同じ結果を返す"""
+        return self._request("POST", "/expand", {"prompt": prompt, "seed": seed})["prompt"]
+
+    def expand_batch(self, prompts, seeds):
+        """expand_batch(prompts, seeds) と同じ結果を返す"""
+        return self._request("POST", "/expand_batch", {"prompts": list(prompts), "seeds": list(seeds)})["prompts"]
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,100 @@
+"""
+展開結果を1つずつ返すジェネレーターと、ファイル・パイプへの書き出し
+
+    for seed, prompt in iter_expansions(engine, template, itertools.count()):
+        ...
+    write_records(iter_expansions(engine, template, range(10_000_000)), sys.stdout, "csv")
+
+seedはchunk_size件ずつ取り出して展開し、書き出しも batch_size 件ずつまとめて行う。
+書き込みが詰まれば（パイプの読み手が遅いなど）次のseedは取り出されないため、
+seedの数によらずメモリ使用量は一定になる。
+"""
+
+import csv
+import io
+import itertools
+import json
+import re
+
+from . import vectorized
+
+FORMATS = ('jsonl', 'csv', 'text')
+CSV_HEADER = ('template', 'seed', 'prompt')
+
+# textの1行1プロンプトの形式: バックスラッシュ・改行・CRを \\ \n \r と書く（unescape_textで元に戻る）
+_TEXT_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r'})
+_TEXT_UNESCAPE = re.compile(r'\\([\\nr])')
+_TEXT_UNESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r'}
+
+
+def escape_text(prompt):
+    """プロンプトをtext形式の1行にする"""
+    return prompt.translate(_TEXT_ESCAPES)
+
+
+def unescape_text(line):
+    """text形式の1行（行末の改行は除く）を元のプロンプトに戻す"""
+    return _TEXT_UNESCAPE.sub(lambda match: _TEXT_UNESCAPES[match.group(1)], line)
+
+
+def iter_expansions(engine, template, seeds, mode="compat", chunk_size=4096):
+    """templateをseedsの順に展開して (seed, プロンプト) を返すジェネレーター
+
+    seedsは任意のイテラブル（無限でもよい）。modeは vectorized.expand_seeds と同じ。
+    """
+    seeds = iter(seeds)
+    while True:
+        chunk = list(itertools.islice(seeds, chunk_size))
+        if not chunk:
+            return
+        yield from zip(chunk, vectorized.expand_seeds(engine, template, chunk, mode))
+
+
+def format_records(records, fmt="jsonl", template_index=0, id_field="seed"):
+    """(seed, プロンプト) の並びを1つの文字列に整形する（行末はすべて改行）
+
+    jsonl: {"template": 番号, "seed": seed, "prompt": プロンプト}
+    csv  : template,seed,prompt（ヘッダーは含まない）
+    text : 1行1プロンプト（\\ \\n \\r をエスケープする。unescape_textで元に戻る。メタデータも必要ならjsonl）
+    id_fieldはseedの列の名前（組み合わせの列挙では "combination"）。
+    """
+    if fmt == "jsonl":
+        return "".join(
+            json.dumps({"template": template_index, id_field: seed, "prompt": prompt}, ensure_ascii=False) + "\n"
+            for seed, prompt in records
+        )
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(
+            (template_index, seed, prompt) for seed, prompt in records
+        )
+        return buffer.getvalue()
+    if fmt == "text":
+        return "".join(prompt.translate(_TEXT_ESCAPES) + "\n" for _, prompt in records)
+    raise ValueError(f"unknown format: {fmt!r} (expected one of {', '.join(FORMATS)})")
+
+
+def format_header(fmt, id_field="seed"):
+    """出力の先頭に書く文字列（csvのヘッダー行、それ以外は空）"""
+    if fmt == "csv":
+        return ",".join(CSV_HEADER).replace("seed", id_field) + "\n"
+    return ""
+
+
+def write_records(records, output, fmt="jsonl", template_index=0, batch_size=1024, header=True):
+    """(seed, プロンプト) の並びを batch_size 件ずつ整形して output に書き込み、件数を返す
+
+    recordsはジェネレーターでよい（書き込みが終わるまで次のbatch_size件は取り出さない）。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt!r} (expected one of {', '.join(FORMATS)})")
+    if header:
+        output.write(format_header(fmt))
+    records = iter(records)
+    count = 0
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return count
+        output.write(format_records(batch, fmt, template_index))
+        count += len(batch)
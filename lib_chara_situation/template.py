@@ -0,0 +1,131 @@
+"""
+プロンプト中の @filename:key タグの解析と、解析済みテンプレートのキャッシュ
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# @filename:key の形式
+# filenameはサブディレクトリをサポートするため、パス区切り文字(/)を含む
+# randomには [field=value, ...] で絞り込み条件を付けられる（条件として解釈できない [...] はそのまま残す）
+TAG_PATTERN = re.compile(r'@([\w/]+):(?:(random)\[([^\]\n]*)\]|(\w+))')
+
+
+def _parse_conditions(spec):
+    """'tag=touhou, hair=black hair' を (('tag', 'touhou'), ('hair', 'black hair')) に変換する
+
+    書式が正しくない場合は空のタプルを返す（呼び出し側は [...] を条件ではなく文字列として扱う）。
+    """
+    conditions = []
+    for part in spec.split(','):
+        field, sep, value = part.partition('=')
+        field = field.strip()
+        value = value.strip()
+        if not sep or not field or not value:
+            return ()
+        conditions.append((field, value))
+    return tuple(conditions)
+
+
+class PromptTemplate:
+    """プロンプトをリテラル部分とタグのスロットに分解したもの
+
+    literals[i] と literals[i + 1] の間に slots[i] が入る。
+    slotsの各要素は (full_tag, filename, key, conditions)。
+    conditionsは絞り込み条件 ((field, value), ...) で、条件がなければNone。
+    """
+    __slots__ = ('prompt', 'literals', 'slots')
+
+    def __init__(self, prompt):
+        self.prompt = prompt
+        literals = []
+        slots = []
+        pos = 0
+        for match in TAG_PATTERN.finditer(prompt):
+            literals.append(prompt[pos:match.start()])
+            pos = match.end()
+            if match.group(2):
+                conditions = _parse_conditions(match.group(3))
+                if conditions:
+                    slots.append((match.group(0), match.group(1), match.group(2), conditions))
+                else:
+                    # 条件として解釈できない [...]（[a:b:0.5] などのWebUIの構文）は絞り込みなしのrandomの後に残す
+                    pos = match.start(3) - 1
+                    slots.append((prompt[match.start():pos], match.group(1), match.group(2), None))
+            else:
+                slots.append((match.group(0), match.group(1), match.group(4), None))
+        literals.append(prompt[pos:])
+        self.literals = tuple(literals)
+        self.slots = tuple(slots)
+
+    def render(self, texts):
+        """スロットごとの文字列を埋め込んだプロンプトを返す"""
+        literals = self.literals
+        parts = [literals[0]]
+        for i, text in enumerate(texts):
+            parts.append(text)
+            parts.append(literals[i + 1])
+        return "".join(parts)
+
+
+class TemplateCache:
+    """プロンプト文字列 -> PromptTemplate のLRUキャッシュ"""
+
+    def __init__(self, maxsize=256):
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prompt):
+        """コンパイル済みのテンプレートを返す（なければコンパイルして登録）"""
+        with self._lock:
+            template = self._templates.get(prompt)
+            if template is not None:
+                self._templates.move_to_end(prompt)
+                self.hits += 1
+                return template
+
+        template = PromptTemplate(prompt)
+
+        with self._lock:
+            self.misses += 1
+            if self.maxsize > 0:
+                self._templates[prompt] = template
+                self._evict()
+        return template
+
+    def resize(self, maxsize):
+        """最大件数を変更する（0でキャッシュ無効）"""
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self._templates) > max(self.maxsize, 0):
+            self._templates.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def stats(self):
+        """ヒット率などの統計を返す"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._templates),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+template_cache = TemplateCache(int(os.environ.get("CHARA_SITUATION_TEMPLATE_CACHE_SIZE", "256")))
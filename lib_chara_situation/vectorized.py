@@ -0,0 +1,187 @@
+"""
+1つのテンプレートを大量のseedで展開する（データセット生成用）
+
+randomタグのキーをseedごとにまとめて選び、同じキーの組み合わせになったseedを1つにまとめて、
+組み合わせごとに1回だけ展開する（ルールのまとめ・置き換え・整理はseedごとには行わない）。
+
+    mode="compat": random.Random(seed) による選択をそのまま再現する（expand_prompt と同じ結果）
+    mode="hash"  : seedとタグの位置から splitmix64 で選択する。NumPyがあれば配列演算でまとめて計算し、
+                   なければ同じ計算をPythonで行う（どちらも同じ結果）。expand_prompt とは異なる選択になるが、
+                   seedごとに決まり、seedの並びやチャンクの分け方には依存しない
+"""
+
+import random
+
+from .template import template_cache
+
+MODES = ('compat', 'hash')
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15  # seedの増分
+_SLOT = 0xD1B54A32D192ED03  # タグの位置ごとの増分
+
+_numpy = None
+
+
+def _get_numpy():
+    """NumPyを返す（インストールされていなければFalse）"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+def _mix(x):
+    """splitmix64の出力関数"""
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+    return x ^ (x >> 31)
+
+
+def hash_index(sampler, seed, slot):
+    """hashモードで seed の slot 番目のrandomタグが選ぶキーの番号"""
+    x = _mix(((seed & _MASK) * _GOLDEN + (slot + 1) * _SLOT) & _MASK)
+    n = len(sampler.keys)
+    i = ((x >> 32) * n) >> 32
+    if sampler.prob is not None and (x & 0xFFFFFFFF) / 4294967296.0 >= sampler.prob[i]:
+        i = sampler.alias[i]
+    return i
+
+
+def _hash_indices_numpy(np, sampler, seeds, slot):
+    """hash_index と同じ計算をseedの配列に対して行う"""
+    u64 = np.uint64
+    x = seeds * u64(_GOLDEN) + u64(((slot + 1) * _SLOT) & _MASK)
+    x = (x ^ (x >> u64(30))) * u64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> u64(27))) * u64(0x94D049BB133111EB)
+    x = x ^ (x >> u64(31))
+    indices = ((x >> u64(32)) * u64(len(sampler.keys))) >> u64(32)
+    if sampler.prob is not None:
+        coin = (x & u64(0xFFFFFFFF)).astype(np.float64) / 4294967296.0
+        prob = np.asarray(sampler.prob, dtype=np.float64)
+        alias = np.asarray(sampler.alias, dtype=np.uint64)
+        indices = np.where(coin < prob[indices], indices, alias[indices])
+    return indices
+
+
+def _compat_choices(samplers, seeds):
+    """seedごとのキーの組み合わせ（expand_promptと同じ選択）"""
+    # random.Random(seed) と seed(seed) し直した Random は同じ状態になる
+    rng = random.Random()
+    reseed = rng.seed
+    if len(samplers) == 1:
+        draw = samplers[0].draw
+        choices = []
+        for seed in seeds:
+            reseed(seed)
+            choices.append((draw(rng),))
+        return choices
+    choices = []
+    for seed in seeds:
+        reseed(seed)
+        choices.append(tuple(sampler.draw(rng) for sampler in samplers))
+    return choices
+
+
+def _seed_array(np, seeds):
+    """seedsを hash_index と同じく下位64ビットのuint64配列にする"""
+    try:
+        # int64に収まるseed（負のseedを含む）は、そのままuint64にすると seed & _MASK と同じ値になる
+        return np.asarray(seeds, dtype=np.int64).astype(np.uint64)
+    except OverflowError:
+        return np.fromiter((seed & _MASK for seed in seeds), dtype=np.uint64, count=len(seeds))
+
+
+def _group_hash(samplers, seeds):
+    """hashモードの選択を同じ組み合わせごとにまとめる
+
+    (組み合わせごとのキーのタプルのリスト, seedごとの組み合わせの番号) を返す。
+    """
+    np = _get_numpy()
+    if np:
+        seed_array = _seed_array(np, seeds)
+        columns = [_hash_indices_numpy(np, sampler, seed_array, slot) for slot, sampler in enumerate(samplers)]
+        sizes = [len(sampler.keys) for sampler in samplers]
+        combinations = 1
+        for size in sizes:
+            combinations *= size
+        if combinations < 1 << 63:
+            # 番号の組を1つの整数（タグごとの桁）にしてから重複を除く（行単位のuniqueより速い）
+            codes = np.zeros(len(seeds), dtype=np.uint64)
+            for column, size in zip(columns, sizes):
+                codes = codes * np.uint64(size) + column
+            unique, inverse = np.unique(codes, return_inverse=True)
+            rows = []
+            for code in unique.tolist():
+                row = []
+                for size in reversed(sizes):
+                    code, index = divmod(code, size)
+                    row.append(index)
+                rows.append(row[::-1])
+        else:
+            unique, inverse = np.unique(np.stack(columns, axis=1), axis=0, return_inverse=True)
+            rows = unique.tolist()
+        combos = [tuple(sampler.keys[i] for sampler, i in zip(samplers, row)) for row in rows]
+        return combos, inverse.reshape(-1)
+
+    numbers = {}
+    combos = []
+    inverse = []
+    for seed in seeds:
+        row = tuple(hash_index(sampler, seed, slot) for slot, sampler in enumerate(samplers))
+        number = numbers.get(row)
+        if number is None:
+            number = numbers[row] = len(combos)
+            combos.append(tuple(sampler.keys[i] for sampler, i in zip(samplers, row)))
+        inverse.append(number)
+    return combos, inverse
+
+
+def expand_seeds(engine, prompt, seeds, mode="compat"):
+    """promptを seeds のそれぞれで展開したリストを返す（順序はseedsと同じ）
+
+    engineはExpansionEngine。seedsはintのシーケンスまたはNumPyの整数の配列。
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown mode: {mode!r} (expected one of {', '.join(MODES)})")
+    if hasattr(seeds, 'dtype'):
+        # NumPyの配列はhashモードでは配列のまま使う
+        if mode != "hash" or not _get_numpy():
+            seeds = seeds.tolist()
+    elif not isinstance(seeds, (list, tuple, range)):
+        seeds = list(seeds)
+    if len(seeds) == 0:
+        return []
+
+    plan = engine._prepare_expansion(template_cache.get(prompt), {})
+    if plan is None:
+        return [prompt] * len(seeds)
+
+    merged_rules = {}
+    if not plan.has_random:
+        return [engine._expand_chosen(plan, (), merged_rules)] * len(seeds)
+
+    samplers = [item.sampler for item in plan.random_items]
+    if mode == "compat":
+        # 組み合わせごとに1回だけ展開する
+        rendered = {}
+        results = []
+        for chosen in _compat_choices(samplers, seeds):
+            result = rendered.get(chosen)
+            if result is None:
+                result = rendered[chosen] = engine._expand_chosen(plan, chosen, merged_rules)
+            results.append(result)
+        return results
+
+    combos, inverse = _group_hash(samplers, seeds)
+    rendered = [engine._expand_chosen(plan, chosen, merged_rules) for chosen in combos]
+    np = _get_numpy()
+    if np:
+        results = np.empty(len(rendered), dtype=object)
+        results[:] = rendered
+        return results[inverse].tolist()
+    return [rendered[number] for number in inverse]
@@ -0,0 +1,310 @@
+"""
+data/ 以下のファイルの変更を監視する
+
+Linuxではinotify（ctypes経由）でサブディレクトリも含めて監視し、使えない環境では
+一定間隔でファイルの (mtime_ns, size, inode) を比較するポーリングに切り替える。
+シンボリックリンクのディレクトリはたどり、シンボリックリンクのファイルはリンク先のディレクトリも監視して、
+リンク先の変更をリンクのパスの変更として通知する。
+開始時にwatchを張れないディレクトリがあれば（watch数の上限など）ポーリングに切り替え、
+監視中に張れなくなった場合は監視を停止する（呼び出し側は毎回statで確認する）。
+変更を検出したら on_change(path) を監視スレッドから呼ぶ。pathがディレクトリの場合は
+その配下すべてが変わった可能性があることを表す（イベントの取りこぼし時はrootが渡される）。
+"""
+
+import ctypes
+import ctypes.util
+import os
+from errno import ENOENT, ENOTDIR
+import select
+import struct
+import threading
+
+from .log import logger
+
+# inotifyのイベントマスク（<sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+# 監視スレッドが停止要求を確認する間隔（秒）
+_WAKEUP_INTERVAL = 0.5
+
+
+def _walk(top):
+    """os.walk(top, followlinks=True) と同様に (ディレクトリ, ファイル名のリスト) を返す
+
+    シンボリックリンクが祖先のディレクトリを指す（循環する）場合はたどらない。
+    """
+    stack = [(top, (os.path.realpath(top),))]
+    while stack:
+        dirpath, ancestors = stack.pop()
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            continue
+        dirs, files = [], []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else files).append(entry.name)
+        yield dirpath, files
+        for name in reversed(dirs):
+            path = os.path.join(dirpath, name)
+            real = os.path.realpath(path)
+            if real not in ancestors:
+                stack.append((path, ancestors + (real,)))
+
+
+def _load_libc():
+    """inotifyが使えればlibcを返す（Linux以外やシンボルがない場合はNone）"""
+    if not hasattr(select, 'select') or not os.path.isdir('/proc/self'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class _InotifyBackend:
+    """inotifyでディレクトリごとにwatchを張る"""
+
+    name = 'inotify'
+
+    def __init__(self, root, libc):
+        self.root = root
+        self._libc = libc
+        # wd -> ディレクトリのパスのリスト（シンボリックリンクで同じディレクトリを複数のパスから参照する場合がある）
+        self._dirs = {}
+        # wd -> {リンク先のファイル名: リンクのパスの集合}（data_dirの外を指すファイルのリンクも含む）
+        self._links = {}
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        self._fd = fd
+
+    def _add_watch(self, dirpath):
+        """dirpathにwatchを張ってwdを返す（同じ実体のディレクトリには同じwdが返る）"""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dirpath), _WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            if errno in (ENOENT, ENOTDIR) and dirpath != self.root:
+                # 作成直後に削除されたディレクトリなど
+                return None
+            # watch数の上限（ENOSPC）や権限がない場合など、監視できない部分が残るので監視をやめる
+            raise OSError(errno, f"inotify_add_watch {dirpath}: {os.strerror(errno)}")
+        return wd
+
+    def _add_tree(self, top):
+        """topとその配下のディレクトリ（リンク先を含む）と、配下のファイルのリンク先にwatchを張る"""
+        for dirpath, files in _walk(top):
+            wd = self._add_watch(dirpath)
+            if wd is None:
+                continue
+            paths = self._dirs.setdefault(wd, [])
+            if dirpath not in paths:
+                paths.append(dirpath)
+            for name in files:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    self._add_link(path)
+
+    def _add_link(self, path):
+        """シンボリックリンクのファイルのリンク先のディレクトリを監視し、変更をpathの変更として通知させる"""
+        directory, name = os.path.split(os.path.realpath(path))
+        wd = self._add_watch(directory)
+        if wd is not None:
+            self._links.setdefault(wd, {}).setdefault(name, set()).add(path)
+
+    def start(self):
+        self._add_tree(self.root)
+
+    def wait(self, stop):
+        """イベントを待ち、変更されたパスのリストを返す"""
+        readable, _, _ = select.select([self._fd], [], [], _WAKEUP_INTERVAL)
+        if not readable or stop.is_set():
+            return []
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            wd, mask, _, length = _EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # イベントを取りこぼしたので全体を変更扱いにする
+                changed.append(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                self._links.pop(wd, None)
+                continue
+            directories = self._dirs.get(wd, ())
+            links = self._links.get(wd, {})
+            if not name:
+                # 監視中のディレクトリ自身が削除・移動された
+                changed.extend(directories)
+                for paths in links.values():
+                    changed.extend(paths)
+                continue
+
+            name = os.fsdecode(name)
+            changed.extend(links.get(name, ()))
+            for directory in directories:
+                path = os.path.join(directory, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新しいディレクトリ（とそのリンク）は中身を変更扱いにする前にwatchを張る
+                    if mask & IN_ISDIR or os.path.isdir(path):
+                        self._add_tree(path)
+                    elif os.path.islink(path):
+                        self._add_link(path)
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingBackend:
+    """interval秒ごとにファイルの状態を比較する"""
+
+    name = 'poll'
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self._snapshot = {}
+
+    def _scan(self):
+        snapshot = {}
+        for dirpath, files in _walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return snapshot
+
+    def start(self):
+        self._snapshot = self._scan()
+
+    def wait(self, stop):
+        if stop.wait(self.interval):
+            return []
+        snapshot = self._scan()
+        previous = self._snapshot
+        self._snapshot = snapshot
+        changed = [path for path, stamp in snapshot.items() if previous.get(path) != stamp]
+        changed.extend(path for path in previous if path not in snapshot)
+        return changed
+
+    def close(self):
+        pass
+
+
+class DataDirWatcher:
+    """rootの変更を監視スレッドで検出し、on_change(path) を呼ぶ
+
+    backendは 'inotify' / 'poll'（省略時はinotifyを試し、使えなければpoll）。
+    """
+
+    def __init__(self, root, on_change, interval=1.0, backend=None):
+        self.root = os.path.abspath(root)
+        self.on_change = on_change
+        self.interval = interval
+        self.requested_backend = backend
+        self.backend = None
+        self.ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _create_backend(self):
+        if self.requested_backend in (None, 'inotify'):
+            libc = _load_libc()
+            if libc is not None:
+                try:
+                    backend = _InotifyBackend(self.root, libc)
+                    try:
+                        backend.start()
+                    except OSError:
+                        backend.close()
+                        raise
+                    return backend
+                except OSError as e:
+                    if self.requested_backend == 'inotify':
+                        raise
+                    logger.warning("inotify unavailable (%s), falling back to polling", e)
+            elif self.requested_backend == 'inotify':
+                raise OSError("inotify is not available on this platform")
+        backend = _PollingBackend(self.root, self.interval)
+        backend.start()
+        return backend
+
+    def start(self):
+        """監視スレッドを開始し、監視の準備ができるまで待つ（開始できた場合はTrue）"""
+        if self._thread is not None:
+            return self.active
+        self._thread = threading.Thread(target=self._run, name="chara-situation-watch", daemon=True)
+        self._thread.start()
+        self.ready.wait()
+        return self.active
+
+    def _run(self):
+        try:
+            backend = self._create_backend()
+        except OSError as e:
+            logger.warning("Cannot watch %s: %s", self.root, e)
+            self._stop.set()
+            self.ready.set()
+            return
+
+        self.backend = backend.name
+        self.ready.set()
+        try:
+            while not self._stop.is_set():
+                changed = backend.wait(self._stop)
+                for path in dict.fromkeys(changed):
+                    self.on_change(path)
+        except Exception as e:
+            logger.warning("Stopped watching %s: %s", self.root, e)
+        finally:
+            self._stop.set()
+            backend.close()
+
+    @property
+    def active(self):
+        """監視が動作中か（Falseの場合、呼び出し側は自分でファイルを確認する）"""
+        return self.ready.is_set() and not self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,44 @@
+"""
+YAMLの読み込み（libyamlのCローダーが使える場合はそちらを使う）
+
+PyYAMLのimportは最初にパースするとき（またはSafeLoader/BACKENDを参照したとき）まで遅らせる。
+"""
+
+_loader = None
+_backend = None
+
+
+def _load_backend():
+    global _loader, _backend
+    if _loader is None:
+        try:
+            from yaml import CSafeLoader as loader
+            backend = "libyaml"
+        except ImportError:
+            from yaml import SafeLoader as loader
+            backend = "pure-python"
+        _loader, _backend = loader, backend
+    return _loader
+
+
+def __getattr__(name):
+    # SafeLoader: 利用できる最速のSafeLoader / BACKEND: "libyaml" または "pure-python"
+    if name == "SafeLoader":
+        return _load_backend()
+    if name == "BACKEND":
+        _load_backend()
+        return _backend
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def parse_file(path, loader=None):
+    """YAMLファイルをパースする（loader省略時は利用できる最速のSafeLoader）"""
+    import yaml
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=loader or _load_backend())
+
+
+def parse_text(text, loader=None):
+    """YAML文字列をパースする"""
+    import yaml
+    return yaml.load(text, Loader=loader or _load_backend())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for batch-level prompt expansion
+"""
+
+import os
+import sys
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+# Background pre-warm loads would be counted in the cache stats below
+os.environ['CHARA_SITUATION_PREWARM'] = 'off'
+
+from chara_situation import CharaSituationScript, yaml_cache
+
+class MockProcessing:
+    """Minimal stand-in for StableDiffusionProcessing"""
+    def __init__(self, prompts, seeds):
+        self.prompts = list(prompts)
+        self.all_prompts = list(prompts)
+        self.all_seeds = list(seeds)
+
+def test_batch_expansion():
+    """Test that batch expansion matches per-prompt expansion"""
+
+    script = CharaSituationScript()
+
+    print("=" * 80)
+    print("Testing Batch Expansion")
+    print("=" * 80)
+
+    # Test 1: Same random prompt with different seeds
+    print("\nTest 1: Identical random prompts, different seeds")
+    prompt = '@characters:random @situations:random masterpiece, best quality'
+    seeds = list(range(1000, 1016))
+    p = MockProcessing([prompt] * len(seeds), seeds)
+
+    before = yaml_cache.stats()
+    script.before_process_batch(p)
+    after = yaml_cache.stats()
+
+    expected = [script.expand_prompt(prompt, seed) for seed in seeds]
+
+    if p.prompts == expected:
+        print("  [PASS] Batch output matches expand_prompt for every seed")
+    else:
+        print("  [FAIL] Batch output differs from expand_prompt")
+
+    if p.all_prompts == expected:
+        print("  [PASS] all_prompts updated")
+    else:
+        print("  [FAIL] all_prompts not updated")
+
+    loads = (after['hits'] + after['misses'] + after['reparses']) - (before['hits'] + before['misses'] + before['reparses'])
+    print(f"  File loads for {len(seeds)} prompts: {loads}")
+    if loads == 2:
+        print("  [PASS] Each referenced file loaded once per batch")
+    else:
+        print("  [FAIL] Files loaded more than once per batch")
+
+    print("-" * 80)
+
+    # Test 2: Mixed prompts in one batch
+    print("\nTest 2: Different prompts in one batch")
+    prompts = [
+        '@characters:reimu @situations:beach masterpiece',
+        '@characters:marisa @situations:random masterpiece',
+        'no tags here',
+        '@characters:reimu @situations:beach masterpiece',
+    ]
+    seeds = [1, 2, 3, 4]
+    p = MockProcessing(prompts, seeds)
+    script.before_process_batch(p)
+    expected = [script.expand_prompt(pr, seed) for pr, seed in zip(prompts, seeds)]
+
+    for pr, out in zip(prompts, p.prompts):
+        print(f"Input:  {pr}")
+        print(f"Output: {out}")
+
+    if p.prompts == expected:
+        print("  [PASS] Mixed batch matches expand_prompt")
+    else:
+        print("  [FAIL] Mixed batch differs from expand_prompt")
+
+    if p.prompts[2] == 'no tags here':
+        print("  [PASS] Prompt without tags left unchanged")
+    else:
+        print("  [FAIL] Prompt without tags was modified")
+
+    print("-" * 80)
+
+    # Test 3: Fewer seeds than prompts falls back to the first seed
+    print("\nTest 3: Missing seeds fall back to the first seed")
+    p = MockProcessing([prompt, prompt], [777])
+    script.before_process_batch(p)
+    if p.prompts == [script.expand_prompt(prompt, 777)] * 2:
+        print("  [PASS] First seed reused")
+    else:
+        print("  [FAIL] Seed fallback broken")
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Batch Expansion Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_batch_expansion()
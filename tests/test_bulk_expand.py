@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the offline bulk expansion CLI
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import shutil
+from contextlib import redirect_stderr
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+sys.path.insert(0, project_dir)
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import bulk, log
+from lib_chara_situation.__main__ import main
+
+TEMPLATES = [
+    "@characters:random, @situations:random",
+    "masterpiece, @characters:reimu\n@situations:random[tag=outdoor], @effects:random",
+    "no tags here",
+]
+
+def test_bulk_expand():
+    """Test that bulk expansion matches expand_prompt"""
+
+    print("=" * 80)
+    print("Testing Bulk Expansion")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        data_dir = os.path.join(temp_dir, 'data')
+        os.makedirs(data_dir)
+        with open(os.path.join(data_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n  weight: 3\n")
+            f.write("sanae:\n  base: 1girl, sanae\n  hair: green hair\n")
+        with open(os.path.join(data_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach, ocean\n  exclude: [hat]\n  tag: outdoor\n")
+            f.write("bedroom:\n  prompt: bedroom\n  include: [base]\n")
+            f.write("forest:\n  prompt: 森, forest\n  tag: outdoor\n")
+        with open(os.path.join(data_dir, 'effects.yaml'), 'w', encoding='utf-8') as f:
+            f.write("rain: rain, wet\nsnow: snow\n")
+
+        script = CharaSituationScript()
+        script.data_dir = data_dir
+        seeds = range(5, 5 + 250)
+        expected = "".join(
+            json.dumps({"template": index, "seed": seed, "prompt": script.expand_prompt(template, seed)},
+                       ensure_ascii=False) + "\n"
+            for index, template in enumerate(TEMPLATES) for seed in seeds
+        )
+
+        # Test 1: In-process expansion
+        print("\nTest 1: Single process")
+        output = io.StringIO()
+        count = bulk.expand_to_jsonl(TEMPLATES, output, data_dir, seed_start=5, count=250, jobs=1, chunk_size=64)
+        if count == 750 and output.getvalue() == expected:
+            print("  [PASS] Output identical to expand_prompt")
+        else:
+            print("  [FAIL] Output differs from expand_prompt")
+
+        # 呼び出し元のログの設定（同期出力）とsys.stdoutはそのまま残る
+        handler = log.configure(async_output=False)
+        real_stdout = sys.stdout
+        errors = io.StringIO()
+        try:
+            with redirect_stderr(errors):
+                bulk.expand_to_jsonl(["@characters:missing_key"], io.StringIO(), data_dir, count=3, jobs=1)
+            kept = log.logger.handlers == [handler] and sys.stdout is real_stdout
+        finally:
+            log.configure()
+        if kept and "missing_key" in errors.getvalue():
+            print("  [PASS] Warnings go to stderr, caller's log settings restored")
+        else:
+            print("  [FAIL] Log settings or stdout changed by in-process expansion")
+
+        print("-" * 80)
+
+        # Test 2: Process pool through the CLI
+        print("\nTest 2: CLI with 2 worker processes")
+        templates_file = os.path.join(temp_dir, 'templates.txt')
+        with open(templates_file, 'w', encoding='utf-8') as f:
+            f.write(TEMPLATES[0] + "\n\n" + TEMPLATES[2] + "\n")
+        output_file = os.path.join(temp_dir, 'out.jsonl')
+        status = main(["expand", "--data-dir", data_dir, "--template", TEMPLATES[1],
+                       "--templates-file", templates_file, "--seed-start", "5", "--count", "250",
+                       "--jobs", "2", "--chunk-size", "50", "--output", output_file])
+        with open(output_file, 'rb') as f:
+            actual = f.read()
+
+        reordered = [TEMPLATES[1], TEMPLATES[0], TEMPLATES[2]]
+        expected_cli = "".join(
+            json.dumps({"template": index, "seed": seed, "prompt": script.expand_prompt(template, seed)},
+                       ensure_ascii=False) + "\n"
+            for index, template in enumerate(reordered) for seed in seeds
+        ).encode('utf-8')
+        if status == 0 and actual == expected_cli:
+            print("  [PASS] Byte-identical output from worker processes")
+        else:
+            print("  [FAIL] Worker output differs from expand_prompt")
+
+        if main(["expand", "--data-dir", os.path.join(temp_dir, 'missing'), "--template", "x"]) == 2:
+            print("  [PASS] Missing data directory reported")
+        else:
+            print("  [FAIL] Missing data directory not reported")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Bulk Expansion Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_bulk_expand()
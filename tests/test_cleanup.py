@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the single-pass prompt cleanup (property test against the three-pass version)
+"""
+
+import itertools
+import os
+import random
+import re
+import sys
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation.engine import _cleanup
+
+# 3回のre.subによる整理（比較用）
+REPEATED_COMMAS = re.compile(r',[ \t]*,+')
+LEADING_COMMA = re.compile(r'^[ \t]*,[ \t]*', re.MULTILINE)
+REPEATED_SPACES = re.compile(r'[ \t]+')
+
+
+def three_pass_cleanup(result):
+    result = REPEATED_COMMAS.sub(',', result)
+    result = LEADING_COMMA.sub('', result)
+    result = REPEATED_SPACES.sub(' ', result)
+    return result
+
+
+def test_cleanup():
+    """Test that the single-pass cleanup matches the three regex passes"""
+
+    print("=" * 80)
+    print("Testing Prompt Cleanup")
+    print("=" * 80)
+
+    # Test 1: Newline and trailing-comma cases
+    print("\nTest 1: Known cases")
+    cases = [
+        "1girl, hakurei reimu, black hair\nmasterpiece, best quality",
+        "1girl, hakurei reimu,\nmasterpiece, best quality",
+        "masterpiece,\n1girl, hakurei reimu,\nbest quality",
+        "masterpiece, 1girl, , , hakurei reimu,, best quality",
+        ", , leading,\n , next line\n\t,\ttabs\t\there ,",
+        "  ,  ,, spaced  out  ,  ",
+        "",
+    ]
+    failures = [case for case in cases if _cleanup(case) != three_pass_cleanup(case)]
+    for case in cases:
+        print(f"  {case!r} => {_cleanup(case)!r}")
+    if not failures:
+        print("  [PASS] Known cases match")
+    else:
+        print(f"  [FAIL] Mismatch: {failures}")
+
+    print("-" * 80)
+
+    # Test 2: Every short string over the characters that matter
+    print("\nTest 2: Exhaustive short strings")
+    alphabet = ", \t\nab"
+    count = 0
+    failures = []
+    for length in range(7):
+        for chars in itertools.product(alphabet, repeat=length):
+            text = ''.join(chars)
+            count += 1
+            if _cleanup(text) != three_pass_cleanup(text):
+                failures.append(text)
+    print(f"Checked {count} strings")
+    if not failures:
+        print("  [PASS] All short strings match")
+    else:
+        print(f"  [FAIL] {len(failures)} mismatches, e.g. {failures[0]!r}")
+
+    print("-" * 80)
+
+    # Test 3: Random long strings (commas, whitespace and newlines weighted up)
+    print("\nTest 3: Random strings")
+    rng = random.Random(20240601)
+    alphabet = ",,,   \t\n\r" + "abc" + "ï"
+    failures = []
+    for _ in range(20000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 200)))
+        if _cleanup(text) != three_pass_cleanup(text):
+            failures.append(text)
+    if not failures:
+        print("  [PASS] 20000 random strings match")
+    else:
+        print(f"  [FAIL] {len(failures)} mismatches, e.g. {failures[0]!r}")
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Prompt Cleanup Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_cleanup()
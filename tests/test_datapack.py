@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the compiled binary data pack
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import datapack
+
+def test_datapack():
+    """Test that a compiled pack produces the same expansions as the YAML files"""
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        os.makedirs(os.path.join(temp_dir, 'characters'))
+        with open(os.path.join(temp_dir, 'characters', 'touhou.yaml'), 'w', encoding='utf-8') as f:
+            f.write("""reimu:
+  base: 1girl
+  hair: [black hair, hair tubes]
+  count: 3
+  ratio: 0.5
+  flag: true
+marisa:
+  base: 1girl
+  hair: blonde hair
+  weight: 2
+plain: 日本語のプロンプト
+nothing:
+12: number key
+""")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("""beach:
+  prompt: [bikini, beach]
+  exclude: [hair]
+""")
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+
+        print("=" * 80)
+        print("Testing Binary Data Pack")
+        print("=" * 80)
+
+        prompts = [
+            "@characters/touhou:reimu @situations:beach",
+            "@characters/touhou:marisa, @characters/touhou:plain, @characters/touhou:nothing",
+            "@characters/touhou:random @situations:random",
+        ]
+        expected = [script.expand_prompt(prompt, seed) for prompt in prompts for seed in range(20)]
+
+        # Test 1: Compile the pack
+        print("\nTest 1: Compile")
+        count = script.compile_data_pack()
+        pack_path = datapack.pack_path_for(temp_dir)
+        print(f"Compiled {count} files ({os.path.getsize(pack_path)} bytes)")
+        if count == 2 and os.path.exists(pack_path):
+            print("  [PASS] Pack written")
+        else:
+            print("  [FAIL] Pack not written")
+
+        pack = datapack.DataPack(pack_path)
+        keys, offsets = pack.read_keys(pack.files['characters/touhou'])
+        if keys == ('reimu', 'marisa', 'plain', 'nothing', 12) and pack.read_value(offsets[0])['ratio'] == 0.5:
+            print("  [PASS] Keys and values round-trip")
+        else:
+            print(f"  [FAIL] Unexpected keys {keys}")
+
+        print("-" * 80)
+
+        # Test 2: Expansions from the pack match the YAML source
+        print("\nTest 2: Expansion from the pack")
+        yaml_cache.invalidate()
+        before = yaml_cache.stats()
+        actual = [script.expand_prompt(prompt, seed) for prompt in prompts for seed in range(20)]
+        after = yaml_cache.stats()
+
+        if after['pack_loads'] - before['pack_loads'] == 2:
+            print("  [PASS] Files loaded from the pack")
+        else:
+            print("  [FAIL] Pack not used")
+
+        if actual == expected:
+            print("  [PASS] Output identical to YAML source")
+        else:
+            print("  [FAIL] Output differs from YAML source")
+
+        print("-" * 80)
+
+        # Test 3: Only accessed entries are decoded
+        print("\nTest 3: Lazy entry decoding")
+        yaml_cache.invalidate()
+        script.expand_prompt("@characters/touhou:plain", 1)
+        data_file = script.load_data_file('characters/touhou')
+        decoded = len(data_file.entries._entries)
+        print(f"Decoded entries: {decoded} of {len(data_file.entries)}")
+        if data_file.packed and decoded == 1:
+            print("  [PASS] Only the requested entry decoded")
+        else:
+            print("  [FAIL] Unrequested entries decoded")
+
+        print("-" * 80)
+
+        # Test 4: Files edited after compiling fall back to YAML
+        print("\nTest 4: Fallback to newer YAML")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("""beach:
+  prompt: [swimsuit, seaside]
+  exclude: [hair]
+""")
+        result4 = script.expand_prompt("@characters/touhou:reimu @situations:beach", 1)
+        print(f"Output: {result4}")
+        if 'swimsuit' in result4 and not script.load_data_file('situations').packed:
+            print("  [PASS] Edited file read from YAML")
+        else:
+            print("  [FAIL] Stale pack data used")
+
+        print("-" * 80)
+
+        # Test 5: Truncated or corrupt packs are rejected on open and YAML is used instead
+        print("\nTest 5: Corrupt packs")
+        script.compile_data_pack()
+        with open(pack_path, 'rb') as f:
+            good = f.read()
+        corrupt = {
+            'truncated': good[:-7],
+            'bad string table': good[:12] + (len(good) - 8).to_bytes(8, 'little') + good[20:],
+        }
+        for label, data in corrupt.items():
+            with open(pack_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(pack_path + '.tmp', pack_path)
+            try:
+                datapack.DataPack(pack_path)
+                rejected = False
+            except datapack.DataPackError as e:
+                rejected = True
+                print(f"{label}: {e}")
+            yaml_cache.invalidate()
+            datapack.registry.invalidate()
+            result5 = script.expand_prompt("@characters/touhou:reimu @situations:beach", 1)
+            if rejected and result5 == result4 and not script.load_data_file('situations').packed:
+                print(f"  [PASS] {label.capitalize()} pack rejected, YAML used")
+            else:
+                print(f"  [FAIL] {label.capitalize()} pack used: {result5}")
+
+        # Recompiling replaces a pack that the registry has open
+        script.compile_data_pack()
+        datapack.registry.get(temp_dir)
+        count = script.compile_data_pack()
+        if count == 2 and datapack.registry.get(temp_dir) is not None:
+            print("  [PASS] Open pack replaced by a recompile")
+        else:
+            print("  [FAIL] Recompile did not replace the pack")
+
+        print("-" * 80)
+
+        print("\n" + "=" * 80)
+        print("Data Pack Test Complete")
+        print("=" * 80)
+
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test_datapack()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the WebUI-independent expansion engine
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+
+# Add project directory to path (no modules.scripts mock: the engine must not need it)
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+
+def test_engine():
+    """Test importing and using the engine without the WebUI"""
+
+    print("=" * 80)
+    print("Testing Expansion Engine")
+    print("=" * 80)
+
+    # Test 1: Import does not pull in the WebUI or heavy modules
+    print("\nTest 1: Import without the WebUI")
+    code = ("import sys, time; started = time.perf_counter(); "
+            "import lib_chara_situation.engine; "
+            "print(round((time.perf_counter() - started) * 1000, 1)); "
+            "print(sorted(m for m in ('modules', 'yaml', 'concurrent.futures', 'ctypes') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=project_dir, capture_output=True, text=True, check=True)
+    elapsed, loaded = output.stdout.splitlines()
+    print(f"Import time: {elapsed} ms")
+    if loaded == "[]":
+        print("  [PASS] No WebUI, PyYAML, thread pool or ctypes import at load time")
+    else:
+        print(f"  [FAIL] Imported at load time: {loaded}")
+
+    print("-" * 80)
+
+    # Test 2: Expansion through the engine
+    print("\nTest 2: Expansion")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [hat, hair]\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+
+        result = engine.expand_prompt("@characters:reimu, @situations:beach", 0)
+        if result == "1girl, reimu, beach":
+            print("  [PASS] Fixed keys expanded")
+        else:
+            print(f"  [FAIL] Unexpected result: {result}")
+
+        results = engine.expand_batch(["@characters:random"] * 20, list(range(20)))
+        if set(results) == {"1girl, reimu, black hair", "1girl, marisa, witch hat"}:
+            print("  [PASS] Random keys expanded")
+        else:
+            print(f"  [FAIL] Unexpected results: {set(results)}")
+
+        if engine.watcher is None:
+            print("  [PASS] Watcher disabled by argument")
+        else:
+            print("  [FAIL] Watcher started")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Expansion Engine Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_engine()
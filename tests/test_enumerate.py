@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the enumerate-all-combinations mode
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import shutil
+from contextlib import redirect_stderr
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation.combinations import Enumeration, parse_shard
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.__main__ import main
+
+def test_enumerate():
+    """Test enumeration counts, include/exclude semantics, deduplication and sharding"""
+
+    print("=" * 80)
+    print("Testing Enumeration")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hat: red bow\n  tag: touhou\n")
+            f.write("reimu_alt:\n  base: 1girl, reimu\n  hat: white bow\n  tag: touhou\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n  weight: 3\n  tag: touhou\n")
+            f.write("ghost:\n  base: ghost\n  weight: 0\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [hat]\n")
+            f.write("room:\n  prompt: room\n  include: [base]\n")
+            f.write("shrine:\n  prompt: shrine\n")
+        with open(os.path.join(temp_dir, 'effects.yaml'), 'w', encoding='utf-8') as f:
+            f.write("rain: rain\nsnow: snow\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        template = "@characters:random, @situations:random, @effects:random"
+
+        # Test 1: Every combination is visited once and covers every random outcome
+        print("\nTest 1: Full product")
+        enumeration = Enumeration(engine, template, dedupe=False)
+        results = list(enumeration)
+        sampled = {engine.expand_prompt(template, seed) for seed in range(3000)}
+        print(f"total: {enumeration.total}, visited: {enumeration.visited}")
+        if enumeration.total == 3 * 3 * 2 and [number for number, _ in results] == list(range(18)) \
+                and sampled <= {prompt for _, prompt in results}:
+            print("  [PASS] 18 combinations (weight-0 key skipped), every sampled prompt enumerated")
+        else:
+            print("  [FAIL] Unexpected combinations")
+
+        if not any('ghost' in prompt for _, prompt in results) \
+                and engine.expand_prompt("@characters:reimu, @situations:beach", 0) in \
+                {prompt.replace(", rain", "").replace(", snow", "") for _, prompt in results}:
+            print("  [PASS] Same include/exclude output as expand_prompt")
+        else:
+            print("  [FAIL] Rendering differs from expand_prompt")
+
+        print("-" * 80)
+
+        # Test 2: Identical outputs are deduplicated
+        print("\nTest 2: Deduplication")
+        enumeration = Enumeration(engine, template)
+        unique = list(enumeration)
+        prompts = [prompt for _, prompt in unique]
+        print(f"written: {len(unique)}, duplicates: {enumeration.duplicates}")
+        # beachではhatが除かれるため reimu と reimu_alt が同じになる（roomも同様）
+        if len(prompts) == len(set(prompts)) == 14 and enumeration.duplicates == 4:
+            print("  [PASS] Duplicate renders skipped")
+        else:
+            print("  [FAIL] Deduplication incorrect")
+
+        print("-" * 80)
+
+        # Test 3: Shards split the space deterministically
+        print("\nTest 3: Sharding")
+        shards = [list(Enumeration(engine, template, shard=(i, 4), dedupe=False)) for i in range(4)]
+        merged = sorted(record for shard in shards for record in shard)
+        sizes = [len(Enumeration(engine, template, shard=(i, 4))) for i in range(4)]
+        if merged == results and sizes == [len(shard) for shard in shards] and parse_shard("2/4") == (2, 4):
+            print(f"  [PASS] Shards {sizes} are disjoint and cover the product")
+        else:
+            print("  [FAIL] Shards overlap or miss combinations")
+
+        print("-" * 80)
+
+        # Test 4: CLI reports throughput
+        print("\nTest 4: CLI")
+        output = io.StringIO()
+        errors = io.StringIO()
+        path = os.path.join(temp_dir, 'all.jsonl')
+        with redirect_stderr(errors):
+            status = main(["enumerate", "--data-dir", temp_dir, "--template", template,
+                           "--template", "@characters:random[tag=touhou]", "--output", path])
+            bad = main(["enumerate", "--data-dir", temp_dir, "--template", template, "--shard", "4/4"])
+        with open(path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        print(errors.getvalue().strip())
+        if status == 0 and bad == 2 and len(records) == 14 + 3 and "/s)" in errors.getvalue() \
+                and records[0] == {"template": 0, "combination": 0, "prompt": prompts[0]}:
+            print("  [PASS] CLI wrote every unique combination and reported throughput")
+        else:
+            print("  [FAIL] CLI output incorrect")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Enumeration Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_enumerate()
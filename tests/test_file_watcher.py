@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for filesystem-watcher driven cache invalidation
+"""
+
+import builtins
+import ctypes
+import errno
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import time
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+# Background pre-warm would stat/open files while the hot path is being checked
+os.environ['CHARA_SITUATION_PREWARM'] = 'off'
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import watcher
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def wait_for(script, prompt, expected, timeout=3.0):
+    """監視スレッドが変更を反映するまで待つ"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if script.expand_prompt(prompt, 0) == expected:
+            return True
+        time.sleep(0.02)
+    return False
+
+def check_backend(mode):
+    temp_dir = tempfile.mkdtemp()
+    external_dir = tempfile.mkdtemp()
+    try:
+        write(os.path.join(temp_dir, 'characters', 'touhou.yaml'), "reimu:\n  base: 1girl, reimu\n")
+        write(os.path.join(temp_dir, 'sits.yaml'), "beach:\n  prompt: beach\n")
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+        script.watch_mode = mode
+        if not script.start_watching():
+            print("  [FAIL] Watcher did not start")
+            return
+        print(f"Backend: {script.watcher.backend}")
+
+        prompt = "@characters/touhou:reimu, @sits:beach, @sits:missing @extra:x"
+        script.expand_prompt(prompt, 0)
+
+        # Test: no stat/open on the hot path
+        # 監視スレッド（pollのスキャンなど）の呼び出しは数えない
+        calls = []
+        real_stat, real_open = os.stat, builtins.open
+
+        def record(args):
+            if threading.current_thread() is threading.main_thread():
+                calls.append(args)
+
+        os.stat = lambda *a, **k: (record(a), real_stat(*a, **k))[1]
+        builtins.open = lambda *a, **k: (record(a), real_open(*a, **k))[1]
+        try:
+            for seed in range(20):
+                script.expand_prompt(prompt, seed)
+        finally:
+            os.stat, builtins.open = real_stat, real_open
+        if not calls:
+            print("  [PASS] No stat/open calls for cached files")
+        else:
+            print(f"  [FAIL] {len(calls)} stat/open calls on the hot path")
+
+        # Test: edit in a subdirectory
+        write(os.path.join(temp_dir, 'characters', 'touhou.yaml'), "reimu:\n  base: 1girl, hakurei reimu\n")
+        if wait_for(script, "@characters/touhou:reimu", "1girl, hakurei reimu"):
+            print("  [PASS] Edit in subdirectory picked up")
+        else:
+            print("  [FAIL] Edit in subdirectory not picked up")
+
+        # Test: file created after a miss
+        write(os.path.join(temp_dir, 'extra.yaml'), "x: added\n")
+        if wait_for(script, "@extra:x", "added"):
+            print("  [PASS] New file picked up")
+        else:
+            print("  [FAIL] New file not picked up")
+
+        # Test: new subdirectory
+        write(os.path.join(temp_dir, 'new', 'deep', 'file.yaml'), "k: deep\n")
+        if wait_for(script, "@new/deep/file:k", "deep"):
+            print("  [PASS] New subdirectory picked up")
+        else:
+            print("  [FAIL] New subdirectory not picked up")
+
+        # Test: deletion
+        os.remove(os.path.join(temp_dir, 'extra.yaml'))
+        if wait_for(script, "@extra:x", "@extra:x"):
+            print("  [PASS] Deleted file dropped")
+        else:
+            print("  [FAIL] Deleted file still cached")
+
+        # Test: edits behind symlinks (a linked subdirectory and a linked file outside data_dir)
+        if hasattr(os, 'symlink'):
+            outside = os.path.join(external_dir, 'shared')
+            write(os.path.join(outside, 'linked.yaml'), "k: v1\n")
+            write(os.path.join(external_dir, 'single.yaml'), "k: s1\n")
+            os.symlink(outside, os.path.join(temp_dir, 'linkdir'))
+            os.symlink(os.path.join(external_dir, 'single.yaml'), os.path.join(temp_dir, 'single.yaml'))
+            linked = "@linkdir/linked:k @single:k"
+            if wait_for(script, linked, "v1 s1"):
+                write(os.path.join(outside, 'linked.yaml'), "k: v2\n")
+                write(os.path.join(external_dir, 'single.yaml'), "k: s2\n")
+                if wait_for(script, linked, "v2 s2"):
+                    print("  [PASS] Edits behind symlinks picked up")
+                else:
+                    print(f"  [FAIL] Edits behind symlinks not picked up: {script.expand_prompt(linked, 0)}")
+            else:
+                print("  [FAIL] New symlinks not picked up")
+
+        # Test: unchanged file stays cached
+        before = yaml_cache.stats()
+        script.expand_prompt("@sits:beach", 0)
+        if yaml_cache.stats()['hits'] - before['hits'] == 1:
+            print("  [PASS] Unchanged file still cached")
+        else:
+            print("  [FAIL] Unchanged file was reloaded")
+
+        script.watcher.stop()
+        if not script.is_watching():
+            print("  [PASS] Falls back to stat when the watcher stops")
+        else:
+            print("  [FAIL] Still trusting the cache after stop")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+        shutil.rmtree(external_dir)
+
+class LimitedLibc:
+    """inotify_add_watchがsubという名前のディレクトリでENOSPC（watch数の上限）になるlibc"""
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.limited = True
+
+    def inotify_init1(self, flags):
+        return self.libc.inotify_init1(flags)
+
+    def inotify_add_watch(self, fd, path, mask):
+        if self.limited and os.path.basename(path) == b'sub':
+            ctypes.set_errno(errno.ENOSPC)
+            return -1
+        return self.libc.inotify_add_watch(fd, path, mask)
+
+def check_watch_limit():
+    libc = watcher._load_libc()
+    if libc is None:
+        print("  [SKIP] inotify is not available")
+        return
+    temp_dir = tempfile.mkdtemp()
+    real_load_libc = watcher._load_libc
+    limited = LimitedLibc(libc)
+    watcher._load_libc = lambda: limited
+    try:
+        write(os.path.join(temp_dir, 'sub', 'a.yaml'), "k: v\n")
+        data_watcher = watcher.DataDirWatcher(temp_dir, lambda path: None)
+        data_watcher.start()
+        if data_watcher.backend == 'poll' and data_watcher.active:
+            print("  [PASS] Falls back to polling when a subdirectory cannot be watched")
+        else:
+            print(f"  [FAIL] Backend {data_watcher.backend} with an unwatched subdirectory")
+        data_watcher.stop()
+
+        # A directory that cannot be watched after startup stops the watcher
+        shutil.rmtree(os.path.join(temp_dir, 'sub'))
+        limited.limited = False
+        data_watcher = watcher.DataDirWatcher(temp_dir, lambda path: None)
+        data_watcher.start()
+        limited.limited = True
+        write(os.path.join(temp_dir, 'sub', 'b.yaml'), "k: v\n")
+        deadline = time.monotonic() + 3.0
+        while data_watcher.active and time.monotonic() < deadline:
+            time.sleep(0.02)
+        if data_watcher.backend == 'inotify' and not data_watcher.active:
+            print("  [PASS] Watcher stops when a new subdirectory cannot be watched")
+        else:
+            print("  [FAIL] Watcher still trusted with an unwatched subdirectory")
+        data_watcher.stop()
+    finally:
+        watcher._load_libc = real_load_libc
+        shutil.rmtree(temp_dir)
+
+def test_file_watcher():
+    """Test watcher-driven invalidation with both backends"""
+
+    print("=" * 80)
+    print("Testing File Watcher")
+    print("=" * 80)
+
+    print("\nTest 1: Default backend (inotify where available)")
+    check_backend("on")
+    print("-" * 80)
+
+    print("\nTest 2: Polling backend")
+    check_backend("poll")
+    print("-" * 80)
+
+    print("\nTest 3: inotify watch limit")
+    check_watch_limit()
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("File Watcher Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_file_watcher()
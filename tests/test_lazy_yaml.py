@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for lazy per-key YAML loading
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import lazyyaml, yamlio
+
+def test_lazy_yaml():
+    """Test the top-level key index and lazy expansion"""
+
+    print("=" * 80)
+    print("Testing Lazy Per-Key YAML Loading")
+    print("=" * 80)
+
+    # Test 1: Index matches a full parse
+    print("\nTest 1: Index of simple files")
+    content = b"""# comment
+reimu:
+  base: 1girl
+  hair:
+    - black hair
+    - hair tubes
+  note: |
+    multi
+    line
+
+'quoted key': value
+"double": [a, b]
+plain: just a string
+"""
+    index = lazyyaml.build_index(content)
+    full = yamlio.parse_text(content)
+    if index is not None and index.keys == tuple(full) and all(index.load(k) == full[k] for k in index.keys):
+        print("  [PASS] Per-key parse matches full parse")
+    else:
+        print("  [FAIL] Per-key parse differs from full parse")
+
+    print("-" * 80)
+
+    # Test 2: Files that cannot be indexed safely fall back
+    print("\nTest 2: Unsafe files are not indexed")
+    unsafe = {
+        'anchor/alias': b"a: &x {b: 1}\nc: *x\n",
+        'document marker': b"---\na: 1\n",
+        'flow mapping': b"{a: 1}\n",
+        'non-string key': b"a: 1\n12: x\n",
+        'duplicate key': b"a: 1\na: 2\n",
+        'weight field': b"a:\n  weight: 2\n",
+        'flow-style weight': b"a: {base: A, weight: 100}\nb: B\n",
+        'quoted weight': b"a:\n  \"weight\": 0\nb: B\n",
+    }
+    for name, text in unsafe.items():
+        if lazyyaml.build_index(text) is None:
+            print(f"  [PASS] {name}: falls back to full parse")
+        else:
+            print(f"  [FAIL] {name}: indexed")
+
+    print("-" * 80)
+
+    # Test 3: Lazy expansion parses only the requested block
+    print("\nTest 3: Lazy expansion")
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'big.yaml'), 'w', encoding='utf-8') as f:
+            for i in range(2000):
+                f.write(f"chara{i}:\n  base: tag{i}\n  hair: [h{i}, long hair]\n")
+        with open(os.path.join(temp_dir, 'sits.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [hair]\n")
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+        prompts = ["@big:chara1234 @sits:beach", "@big:random, @big:chara7", "@big:missing"]
+        expected = [script.expand_prompt(prompt, seed) for prompt in prompts for seed in range(10)]
+
+        yaml_cache.invalidate()
+        script.lazy_load = True
+        before = yaml_cache.stats()
+        actual = [script.expand_prompt(prompt, seed) for prompt in prompts for seed in range(10)]
+        after = yaml_cache.stats()
+
+        if after['lazy_loads'] - before['lazy_loads'] == 2:
+            print("  [PASS] Files indexed lazily")
+        else:
+            print("  [FAIL] Lazy index not used")
+
+        if actual == expected:
+            print("  [PASS] Output identical to full parse")
+        else:
+            print("  [FAIL] Output differs from full parse")
+
+        data_file = script.load_data_file('big')
+        decoded = len(data_file.entries._entries)
+        print(f"Parsed blocks: {decoded} of {len(data_file.entries)}")
+        if decoded <= 12:
+            print("  [PASS] Only requested blocks parsed")
+        else:
+            print("  [FAIL] Too many blocks parsed")
+
+        print("-" * 80)
+
+        # Test 4: Weighted draws are the same in lazy and eager mode
+        print("\nTest 4: Weights in lazy mode")
+        with open(os.path.join(temp_dir, 'weighted.yaml'), 'w', encoding='utf-8') as f:
+            f.write('a: {base: A, weight: 100}\nb:\n  base: B\n  "weight": 0\nc:\n  base: C\n')
+        prompts = ["@weighted:random"] * 1000
+        script.lazy_load = False
+        yaml_cache.invalidate()
+        eager = script.expand_batch(prompts, range(1000))
+        script.lazy_load = True
+        yaml_cache.invalidate()
+        lazy = script.expand_batch(prompts, range(1000))
+        counts = {value: lazy.count(value) for value in sorted(set(lazy))}
+        print(f"Lazy counts: {counts}")
+        if lazy == eager and 'B' not in counts and counts.get('A', 0) > 900:
+            print("  [PASS] Lazy mode draws with the same weights as a full parse")
+        else:
+            print("  [FAIL] Weights ignored in lazy mode")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Lazy YAML Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_lazy_yaml()
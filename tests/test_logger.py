@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the leveled, buffered logger and deduplicated warnings
+"""
+
+import io
+import os
+import sys
+import tempfile
+import shutil
+import time
+from contextlib import redirect_stdout
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation import log
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+
+
+class SlowStream(io.StringIO):
+    """書き込みのたびに待つ端末の代わり"""
+
+    def write(self, s):
+        time.sleep(0.02)
+        return super().write(s)
+
+
+def test_logger():
+    """Test levels, async output and once-per-file-version warnings"""
+
+    print("=" * 80)
+    print("Testing Logger")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        # Test 1: Logging never waits for a slow terminal
+        print("\nTest 1: Async output")
+        log.configure(level="info", async_output=True)
+        stream = SlowStream()
+        with redirect_stdout(stream):
+            started = time.perf_counter()
+            for i in range(50):
+                log.logger.info("message %d", i)
+            elapsed = time.perf_counter() - started
+            log.flush()
+        lines = stream.getvalue().splitlines()
+        print(f"50 messages queued in {elapsed * 1000:.1f}ms, {len(lines)} lines written")
+        if elapsed < 0.02 and lines == [f"[CharaSituation] message {i}" for i in range(50)]:
+            print("  [PASS] Messages queued without blocking and written in order")
+        else:
+            print("  [FAIL] Logging blocked or lost messages")
+
+        print("-" * 80)
+
+        # Test 2: Levels and the existing message format
+        print("\nTest 2: Levels")
+        log.configure(level="warning", async_output=False)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            log.logger.info("hidden")
+            log.logger.warning("shown %s", "here")
+            log.logger.error("failed")
+        print(output.getvalue().strip())
+        if output.getvalue() == "[CharaSituation] WARNING: shown here\n[CharaSituation] ERROR: failed\n":
+            print("  [PASS] Info suppressed, warnings keep the [CharaSituation] prefix")
+        else:
+            print("  [FAIL] Unexpected output")
+
+        print("-" * 80)
+
+        # Test 3: A missing key is reported once per file version
+        print("\nTest 3: Deduplicated warnings")
+        log.configure(level="info", async_output=False)
+        log.reset_warnings()
+        path = os.path.join(temp_dir, 'characters.yaml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n")
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            for seed in range(20):
+                engine.expand_batch(["@characters:sanae"], [seed])
+        first = output.getvalue().count("Key 'sanae' not found")
+
+        # ファイルが変わったら（別の版になったら）もう一度警告する
+        time.sleep(0.01)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\nmarisa:\n  base: 1girl, marisa\n")
+        with redirect_stdout(output):
+            for seed in range(20):
+                engine.expand_batch(["@characters:sanae"], [seed])
+        total = output.getvalue().count("Key 'sanae' not found")
+        print(f"Warnings: {first} before the edit, {total} in total")
+        if first == 1 and total == 2:
+            print("  [PASS] Warned once per file version")
+        else:
+            print("  [FAIL] Warnings not deduplicated")
+
+        print("-" * 80)
+
+        # Test 4: Expansion lines respect the level
+        print("\nTest 4: Expansion log")
+        engine.log_expansions = True
+        log.configure(level="warning", async_output=False)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = engine.expand_prompt("@characters:reimu", 1)
+        if result == "1girl, reimu" and output.getvalue() == "":
+            print("  [PASS] Expansion lines hidden at warning level")
+        else:
+            print("  [FAIL] Expansion lines printed at warning level")
+    finally:
+        log.configure()
+        log.reset_warnings()
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Logger Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_logger()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for parallel loading of the files referenced by a prompt
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import time
+from collections import Counter
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import datafile
+
+PARSE_DELAY = 0.05
+
+def test_parallel_loading():
+    """Test that cold files in one expansion are loaded concurrently"""
+
+    print("=" * 80)
+    print("Testing Parallel File Loading")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    original_parse = datafile.parse_yaml_file
+    parsed = Counter()
+    lock = threading.Lock()
+
+    def slow_parse(path):
+        if path.startswith(temp_dir):
+            with lock:
+                parsed[path] += 1
+        time.sleep(PARSE_DELAY)
+        return original_parse(path)
+
+    names = ['characters/touhou', 'situations/outdoor', 'effects', 'poses',
+             'lighting', 'camera', 'outfits', 'styles']
+    try:
+        for name in names:
+            path = os.path.join(temp_dir, f"{name}.yaml")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                for i in range(20):
+                    f.write(f"k{i}: {name.replace('/', '_')}_{i}\n")
+
+        prompt = ", ".join(f"@{name}:random" for name in names) + ", @effects:k3, @missing:x"
+        seeds = list(range(20))
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+        script.pack_mode = "off"
+
+        yaml_cache.invalidate()
+        expected = [script.expand_prompt(prompt, seed) for seed in seeds]
+
+        datafile.parse_yaml_file = slow_parse
+
+        # Test 1: Cold files are parsed concurrently
+        print("\nTest 1: Cold loads of 8 files")
+        yaml_cache.invalidate()
+        started = time.perf_counter()
+        first = script.expand_prompt(prompt, seeds[0])
+        elapsed = time.perf_counter() - started
+        sequential = PARSE_DELAY * len(names)
+        print(f"Elapsed: {elapsed:.3f}s (sequential would be ~{sequential:.2f}s)")
+        if elapsed < sequential * 0.6:
+            print("  [PASS] Files loaded concurrently")
+        else:
+            print("  [FAIL] Files loaded one after another")
+
+        # Test 2: Deterministic results
+        print("\nTest 2: Results match sequential loading")
+        actual = [first] + [script.expand_prompt(prompt, seed) for seed in seeds[1:]]
+        if actual == expected:
+            print("  [PASS] Same results for every seed")
+        else:
+            print("  [FAIL] Results differ from sequential loading")
+
+        print("-" * 80)
+
+        # Test 3: No duplicate parses across concurrent expansions
+        print("\nTest 3: Concurrent expansions of cold files")
+        yaml_cache.invalidate()
+        parsed.clear()
+        outputs = [None] * 6
+
+        def worker(i):
+            outputs[i] = script.expand_batch([prompt] * 3, seeds[:3])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        if len(parsed) == len(names) and set(parsed.values()) == {1}:
+            print("  [PASS] Each file parsed exactly once")
+        else:
+            print(f"  [FAIL] Parse counts: {dict(parsed)}")
+        if all(output == expected[:3] for output in outputs):
+            print("  [PASS] All threads got identical results")
+        else:
+            print("  [FAIL] Threads got different results")
+    finally:
+        datafile.parse_yaml_file = original_parse
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Parallel File Loading Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_parallel_loading()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for background pre-warming of data files
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+import threading
+import time
+from collections import Counter
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, yaml_cache
+from lib_chara_situation import datafile
+from lib_chara_situation import engine as engine_module
+
+def test_prewarm():
+    """Test that pre-warm loads every file once and the hot path only waits for its file"""
+
+    print("=" * 80)
+    print("Testing Pre-warm")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    original_parse = datafile.parse_yaml_file
+    parsed = Counter()
+    lock = threading.Lock()
+
+    def slow_parse(path):
+        if path.startswith(temp_dir):
+            with lock:
+                parsed[path] += 1
+        time.sleep(0.02)
+        return original_parse(path)
+
+    try:
+        for i in range(40):
+            sub = 'characters' if i % 2 else 'situations'
+            os.makedirs(os.path.join(temp_dir, sub), exist_ok=True)
+            with open(os.path.join(temp_dir, sub, f'file{i}.yaml'), 'w', encoding='utf-8') as f:
+                f.write(f"key:\n  base: value{i}\n")
+
+        yaml_cache.invalidate()
+        datafile.parse_yaml_file = slow_parse
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+        script.pack_mode = "off"
+
+        # Test 1: The hot path does not wait for the whole warm-up
+        print("\nTest 1: Expansion during warm-up")
+        started = time.perf_counter()
+        thread = script.prewarm(workers=2)
+        result = script.expand_prompt("@situations/file38:key", 0)
+        first = time.perf_counter() - started
+        thread.join()
+        total = time.perf_counter() - started
+        print(f"First expansion: {first:.3f}s, warm-up: {total:.3f}s")
+
+        if result == "value38":
+            print("  [PASS] Expansion correct during warm-up")
+        else:
+            print(f"  [FAIL] Unexpected result: {result}")
+
+        if first < total:
+            print("  [PASS] Expansion did not wait for the whole warm-up")
+        else:
+            print("  [FAIL] Expansion waited for the whole warm-up")
+
+        print("-" * 80)
+
+        # Test 2: Every file is cached and parsed exactly once
+        print("\nTest 2: Cache contents after warm-up")
+        if len(parsed) == 40 and set(parsed.values()) == {1}:
+            print("  [PASS] Every file parsed exactly once")
+        else:
+            print(f"  [FAIL] Parse counts: {sorted(parsed.values())}")
+
+        before = yaml_cache.stats()
+        script.expand_prompt("@characters/file1:key @situations/file0:key", 0)
+        after = yaml_cache.stats()
+        if after['misses'] == before['misses'] and after['hits'] - before['hits'] == 2:
+            print("  [PASS] Expansion served from the warm cache")
+        else:
+            print("  [FAIL] Expansion loaded files again")
+
+        if script.prewarm() is None:
+            print("  [PASS] Second pre-warm of the same directory skipped")
+        else:
+            print("  [FAIL] Pre-warm started twice")
+
+        print("-" * 80)
+
+        # Test 3: Concurrent requests for one file share a single parse
+        print("\nTest 3: Concurrent loads of the same file")
+        yaml_cache.invalidate()
+        parsed.clear()
+        threads = [threading.Thread(target=script.load_data_file, args=("characters/file3",)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if sum(parsed.values()) == 1:
+            print("  [PASS] File parsed once for 8 concurrent requests")
+        else:
+            print(f"  [FAIL] File parsed {sum(parsed.values())} times")
+
+        print("-" * 80)
+
+        # Test 4: A running warm-up can be stopped before it loads every file
+        print("\nTest 4: Stop a running warm-up")
+        yaml_cache.invalidate()
+        parsed.clear()
+        engine_module._prewarmed.discard(os.path.abspath(temp_dir))
+        thread = script.prewarm(workers=1)
+        time.sleep(0.05)
+        stopped = script.stop_prewarm(timeout=5)
+        if stopped and not thread.is_alive() and sum(parsed.values()) < 40:
+            print(f"  [PASS] Warm-up stopped after {sum(parsed.values())} files")
+        else:
+            print(f"  [FAIL] Warm-up not stopped (alive={thread.is_alive()}, parsed={sum(parsed.values())})")
+
+        if script.prewarm(workers=2).join() is None and len(parsed) == 40:
+            print("  [PASS] Stopped warm-up can be started again")
+        else:
+            print(f"  [FAIL] Restarted warm-up parsed {len(parsed)} files")
+    finally:
+        datafile.parse_yaml_file = original_parse
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Pre-warm Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_prewarm()
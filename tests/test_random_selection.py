@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for pre-indexed random key selection
+"""
+
+import os
+import sys
+import random
+import tempfile
+import shutil
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript
+
+def test_random_selection():
+    """Test that indexed random selection keeps the seed -> key mapping"""
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        # Create a character file with many entries
+        lines = []
+        for i in range(500):
+            lines.append(f"chara{i}:\n  base: tag{i}\n")
+        with open(os.path.join(temp_dir, 'many.yaml'), 'w', encoding='utf-8') as f:
+            f.write("".join(lines))
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+
+        print("=" * 80)
+        print("Testing Indexed Random Selection")
+        print("=" * 80)
+
+        # Test 1: Same mapping as random.Random(seed).choice(list(keys))
+        print("\nTest 1: Seed to key mapping")
+        keys = [f"chara{i}" for i in range(500)]
+        mismatches = 0
+        for seed in range(200):
+            expected_key = random.Random(seed).choice(keys)
+            result = script.expand_prompt("@many:random", seed)
+            if result != f"tag{expected_key[5:]}":
+                mismatches += 1
+
+        if mismatches == 0:
+            print("  [PASS] All 200 seeds select the same key as before")
+        else:
+            print(f"  [FAIL] {mismatches} seeds selected a different key")
+
+        print("-" * 80)
+
+        # Test 2: Key tuple is built once per file version
+        print("\nTest 2: Key index reused between loads")
+        first = script.load_data_file('many')
+        second = script.load_data_file('many')
+
+        if first.keys is second.keys and isinstance(first.keys, tuple):
+            print("  [PASS] Key tuple shared between loads")
+        else:
+            print("  [FAIL] Key tuple rebuilt on each load")
+
+        print("-" * 80)
+
+        print("\n" + "=" * 80)
+        print("Random Selection Test Complete")
+        print("=" * 80)
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test_random_selection()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the memoised expansion results
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+import time
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.results import result_cache
+
+def test_result_cache():
+    """Test result cache hits, invalidation on file edits and size limits"""
+
+    print("=" * 80)
+    print("Testing Result Cache")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    maxsize = result_cache.maxsize
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n  outfit: miko\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hair: blonde hair\n  hat: witch hat\n")
+        situations = os.path.join(temp_dir, 'situations.yaml')
+        with open(situations, 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [outfit, hat]\n")
+            f.write("room:\n  prompt: room\n  include: [base]\n")
+            f.write("shrine:\n  prompt: shrine\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        prompt = "@characters:reimu, @situations:random, masterpiece"
+        seeds = list(range(200))
+
+        # Test 1: Repeated combinations are served from the cache
+        print("\nTest 1: Repeated combinations")
+        result_cache.resize(0)
+        expected = engine.expand_batch([prompt] * len(seeds), seeds)
+        result_cache.resize(maxsize)
+        result_cache.clear()
+        before = result_cache.stats()
+        first = engine.expand_batch([prompt] * len(seeds), seeds)
+        second = [engine.expand_prompt(prompt, seed) for seed in seeds]
+        after = result_cache.stats()
+        misses = after['misses'] - before['misses']
+        hits = after['hits'] - before['hits']
+        print(f"hits: {hits}, misses: {misses}")
+        if first == expected and second == expected:
+            print("  [PASS] Cached results match uncached expansion")
+        else:
+            print("  [FAIL] Cached results differ")
+        if misses == 3 and hits == 2 * len(seeds) - 3:
+            print("  [PASS] Each combination expanded once")
+        else:
+            print("  [FAIL] Combinations expanded more than once")
+
+        print("-" * 80)
+
+        # Test 2: Editing a file changes the key
+        print("\nTest 2: File edits")
+        time.sleep(0.01)
+        with open(situations, 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: sunny beach\n  exclude: [outfit, hat]\n")
+            f.write("room:\n  prompt: room\n  include: [base]\n")
+            f.write("shrine:\n  prompt: shrine\n")
+        results = engine.expand_batch([prompt] * len(seeds), seeds)
+        stale = [result for result in results if 'sunny' not in result and 'beach' in result]
+        if not stale and any('sunny beach' in result for result in results):
+            print("  [PASS] No stale results after the edit")
+        else:
+            print("  [FAIL] Stale results returned")
+
+        print("-" * 80)
+
+        # Test 3: Size limit and eviction stats
+        print("\nTest 3: Size limit")
+        result_cache.resize(2)
+        before = result_cache.stats()
+        engine.expand_batch(["@characters:random, @situations:random"] * 50, range(50))
+        stats = result_cache.stats()
+        print(f"stats: {stats}")
+        if stats['size'] <= 2 and stats['evictions'] > before['evictions']:
+            print("  [PASS] Cache bounded, evictions counted")
+        else:
+            print("  [FAIL] Cache not bounded")
+
+        result_cache.resize(0)
+        if result_cache.stats()['size'] == 0:
+            print("  [PASS] Size 0 disables the cache")
+        else:
+            print("  [FAIL] Cache still holds results")
+    finally:
+        result_cache.resize(maxsize)
+        result_cache.clear()
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Result Cache Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_result_cache()
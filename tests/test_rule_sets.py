@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for compiled include/exclude rule sets
+"""
+
+import os
+import sys
+import io
+import tempfile
+import shutil
+from contextlib import redirect_stdout
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, MergedRules
+from lib_chara_situation import log
+
+def test_rule_sets():
+    """Test merged frozenset rules and memoised character fields"""
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        with open(os.path.join(temp_dir, 'rchars.yaml'), 'w', encoding='utf-8') as f:
+            f.write("""reimu:
+  base: 1girl
+  hair: [black hair, hair tubes]
+  top: white blouse
+  shoes: brown boots
+""")
+        with open(os.path.join(temp_dir, 'rsits.yaml'), 'w', encoding='utf-8') as f:
+            f.write("""beach:
+  prompt: beach
+  exclude: [top, shoes]
+night:
+  prompt: night
+  exclude: [shoes]
+""")
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+
+        print("=" * 80)
+        print("Testing Compiled Rule Sets")
+        print("=" * 80)
+
+        # Test 1: Rules from stacked situations are merged
+        print("\nTest 1: Stacked situations")
+        sits = script.load_data_file('rsits')
+        rules = MergedRules((sits.entries['beach'].rule, sits.entries['night'].rule))
+        print(f"Excludes:   {sorted(rules.excludes)}")
+        print(f"Duplicates: {sorted(rules.duplicates)}")
+
+        if rules.excludes == frozenset(['top', 'shoes']) and not rules.has_include:
+            print("  [PASS] Excludes merged into one frozenset")
+        else:
+            print("  [FAIL] Excludes not merged")
+
+        if rules.duplicates == frozenset(['shoes']):
+            print("  [PASS] Duplicate field detected")
+        else:
+            print("  [FAIL] Duplicate field not detected")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = script.expand_prompt("@rchars:reimu @rsits:beach @rsits:night", 1)
+            script.expand_prompt("@rchars:reimu @rsits:beach @rsits:night", 2)
+            log.flush()
+        print(f"Output: {result}")
+        if output.getvalue().count("more than one situation: shoes") == 1:
+            print("  [PASS] Duplicate field reported once")
+        else:
+            print("  [FAIL] Duplicate field not reported")
+
+        if result == "1girl, black hair, hair tubes beach night":
+            print("  [PASS] Merged rules applied")
+        else:
+            print("  [FAIL] Unexpected output")
+
+        print("-" * 80)
+
+        # Test 2: Fields are pre-rendered when the file is loaded
+        print("\nTest 2: Pre-rendered character fields")
+        chars = script.load_data_file('rchars')
+        entry = chars.entries['reimu']
+        print(f"Fields: {entry.fields}")
+        print(f"Texts:  {entry.texts}")
+        if entry.fields == ('base', 'hair', 'top', 'shoes') and entry.texts[1] == 'black hair, hair tubes':
+            print("  [PASS] List values joined at load time")
+        else:
+            print("  [FAIL] Unexpected pre-rendered fields")
+
+        if script.load_data_file('rchars').entries['reimu'] is entry:
+            print("  [PASS] Entry reused for unchanged file")
+        else:
+            print("  [FAIL] Entry rebuilt for unchanged file")
+
+        if sits.entries['beach'].text == 'beach':
+            print("  [PASS] Situation prompt pre-rendered")
+        else:
+            print("  [FAIL] Situation prompt not pre-rendered")
+
+        print("-" * 80)
+
+        # Test 3: Public helpers still accept plain lists
+        print("\nTest 3: List arguments")
+        chara = script.load_yaml('rchars')['reimu']
+        excluded = script.expand_character_with_exclude(chara, ['top', 'shoes'])
+        included = script.expand_character_with_include(chara, ['base'])
+        print(f"Exclude: {excluded}")
+        print(f"Include: {included}")
+        if excluded == "1girl, black hair, hair tubes" and included == "1girl":
+            print("  [PASS] List arguments handled")
+        else:
+            print("  [FAIL] List arguments not handled")
+
+        print("-" * 80)
+
+        print("\n" + "=" * 80)
+        print("Rule Set Test Complete")
+        print("=" * 80)
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test_rule_sets()
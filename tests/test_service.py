@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the asyncio expansion service (HTTP and Unix socket) and request coalescing
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import shutil
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.service import Coalescer, ExpansionService, RequestError, ServiceClient
+
+
+class CountingEngine:
+    """expand_batch の呼び出しを記録するエンジン"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.calls = []
+
+    def expand_batch(self, prompts, seeds):
+        self.calls.append(list(zip(prompts, seeds)))
+        return self.engine.expand_batch(prompts, seeds)
+
+
+class ServiceThread:
+    """別スレッドのイベントループでサービスを動かす"""
+
+    def __init__(self, engine, batch_delay=0.002, path=None):
+        self.service = ExpansionService(engine, batch_delay)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.service.start(port=0, path=path))
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait(10)
+
+    def client(self):
+        address = self.service.address
+        if isinstance(address, str):
+            return ServiceClient(path=address)
+        return ServiceClient(port=address[1])
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.service.close(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+        self.loop.close()
+
+
+def test_service():
+    """Test that the service matches expand_prompt and coalesces concurrent requests"""
+
+    print("=" * 80)
+    print("Testing Expansion Service")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            for i in range(20):
+                f.write(f"chara{i}:\n  base: 1girl, chara{i}\n  outfit: outfit{i}\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [outfit]\n")
+            f.write("room:\n  prompt: room\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        reference = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        reference.log_expansions = False
+        template = "@characters:random, @situations:random"
+        expected = [reference.expand_prompt(template, seed) for seed in range(50)]
+
+        # Test 1: Concurrent requests for the same template share one expand_batch
+        print("\nTest 1: Coalescing")
+        counting = CountingEngine(engine)
+
+        async def burst():
+            coalescer = Coalescer(counting, batch_delay=0.01)
+            try:
+                singles = [coalescer.expand(template, seed % 10) for seed in range(100)]
+                batch = coalescer.expand_batch([template] * 20, list(range(20)))
+                *results, batch_results = await asyncio.gather(*singles, batch)
+                return results, batch_results, coalescer.stats()
+            finally:
+                coalescer.close()
+
+        results, batch_results, stats = asyncio.run(burst())
+        print(f"stats: {stats}, expand_batch calls: {[len(call) for call in counting.calls]}")
+        if results == [expected[seed % 10] for seed in range(100)] and batch_results == expected[:20] \
+                and len(counting.calls) == 1 and len(counting.calls[0]) == 20 and stats['coalesced'] == 100:
+            print("  [PASS] 120 requests expanded as 20 unique prompts in one batch")
+        else:
+            print("  [FAIL] Requests were not coalesced")
+
+        # A request for a broken file fails alone, not the requests coalesced with it
+        with open(os.path.join(temp_dir, 'broken.yaml'), 'w', encoding='utf-8') as f:
+            f.write("a: [unclosed\n")
+
+        async def mixed():
+            coalescer = Coalescer(engine, batch_delay=0.01)
+            try:
+                return await asyncio.gather(coalescer.expand(template, 1), coalescer.expand("@broken:a", 1),
+                                            coalescer.expand(template, 2), return_exceptions=True)
+            finally:
+                coalescer.close()
+
+        good1, bad, good2 = asyncio.run(mixed())
+        print(f"mixed batch: {type(bad).__name__}")
+        if good1 == expected[1] and good2 == expected[2] and isinstance(bad, Exception):
+            print("  [PASS] Only the request for the broken file failed")
+        else:
+            print(f"  [FAIL] Coalesced requests failed together: {good1!r}, {good2!r}")
+        os.remove(os.path.join(temp_dir, 'broken.yaml'))
+
+        print("-" * 80)
+
+        # Test 2: HTTP endpoint returns expand_prompt results to concurrent clients
+        print("\nTest 2: HTTP")
+        server = ServiceThread(engine, batch_delay=0.005)
+        try:
+            def call(seed):
+                with server.client() as client:
+                    return client.expand(template, seed)
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                responses = list(executor.map(call, range(50)))
+            with server.client() as client:
+                batch = client.expand_batch([template] * 50, range(50))
+                stats = client.stats()
+                errors = []
+                for method, payload in (("expand", {"prompt": template, "seed": "1"}),
+                                        ("expand_batch", {"prompts": [template], "seeds": []}),
+                                        ("missing", {})):
+                    try:
+                        client._request("POST", f"/{method}", payload)
+                    except RequestError as e:
+                        errors.append(e.status)
+                # エラーの後も同じ接続を使い続けられる
+                after_error = client.expand(template, 3)
+            print(f"batches: {stats['batches']} for {stats['requests']} requests, errors: {errors}")
+            if responses == expected and batch == expected and after_error == expected[3] \
+                    and errors == [400, 400, 404] and stats['batches'] < stats['requests'] \
+                    and 'result_cache' in stats:
+                print("  [PASS] HTTP results match expand_prompt, invalid requests rejected")
+            else:
+                print("  [FAIL] HTTP results differ")
+
+            # 上限を超える長さの要求行・ヘッダーにはエラーを返して接続を閉じる
+            statuses = []
+            for request in (b"GET /" + b"x" * 100000 + b" HTTP/1.1\r\n\r\n",
+                            b"GET /stats HTTP/1.1\r\nX-Long: " + b"x" * 100000 + b"\r\n\r\n"):
+                with socket.create_connection(("127.0.0.1", server.service.address[1]), timeout=10) as sock:
+                    sock.sendall(request)
+                    response = b""
+                    while True:
+                        chunk = sock.recv(65536)
+                        if not chunk:
+                            break
+                        response += chunk
+                statuses.append((response.split(b" ")[1:2], b"Connection: close" in response))
+            print(f"oversized requests: {statuses}")
+            if statuses == [([b"400"], True), ([b"431"], True)]:
+                print("  [PASS] Oversized request line and header rejected")
+            else:
+                print("  [FAIL] Oversized requests not answered")
+        finally:
+            server.stop()
+
+        print("-" * 80)
+
+        # Test 3: Unix socket endpoint
+        print("\nTest 3: Unix socket")
+        if not hasattr(asyncio, 'start_unix_server'):
+            print("  [SKIP] Unix sockets are not available")
+        else:
+            server = ServiceThread(engine, path=os.path.join(temp_dir, 'service.sock'))
+            try:
+                with server.client() as client:
+                    results = [client.expand(template, seed) for seed in range(10)]
+                if results == expected[:10]:
+                    print("  [PASS] Unix socket results match expand_prompt")
+                else:
+                    print("  [FAIL] Unix socket results differ")
+            finally:
+                server.stop()
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Expansion Service Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_service()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for per-stage timing instrumentation
+"""
+
+import io
+import json
+import os
+import sys
+import tempfile
+import shutil
+from contextlib import redirect_stdout
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation import log
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.metrics import Histogram, stage_metrics
+from lib_chara_situation.results import result_cache
+
+def test_stage_metrics():
+    """Test stage histograms, the stats API and the disabled path"""
+
+    print("=" * 80)
+    print("Testing Stage Metrics")
+    print("=" * 80)
+
+    # Test 1: Histogram percentiles
+    print("\nTest 1: Histogram percentiles")
+    histogram = Histogram()
+    for value in range(1, 10001):
+        histogram.add(value * 1000)
+    p50 = histogram.percentile(0.5)
+    p99 = histogram.percentile(0.99)
+    print(f"p50: {p50}, p99: {p99}")
+    if 5_000_000 <= p50 <= 5_000_000 * 1.25 and 9_900_000 <= p99 <= 10_000_000:
+        print("  [PASS] Percentiles within bucket resolution")
+    else:
+        print("  [FAIL] Percentiles out of range")
+
+    print("-" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach\n  exclude: [hat]\n")
+            f.write("room:\n  prompt: room\n  include: [base]\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        prompt = "@characters:random, @situations:random"
+
+        # Test 2: Disabled instrumentation records nothing
+        print("\nTest 2: Disabled")
+        engine.disable_metrics()
+        engine.reset_stage_stats()
+        engine.expand_batch([prompt] * 10, list(range(10)))
+        stages = engine.stage_stats()['stages']
+        if all(stage['count'] == 0 for stage in stages.values()):
+            print("  [PASS] Nothing recorded while disabled")
+        else:
+            print("  [FAIL] Recorded while disabled")
+
+        print("-" * 80)
+
+        # Test 3: Enabled instrumentation records every stage
+        print("\nTest 3: Enabled")
+        yaml_cache.invalidate()
+        # Cached results skip the later stages, so expand every prompt
+        maxsize = result_cache.maxsize
+        result_cache.resize(0)
+        engine.enable_metrics()
+        try:
+            expected = [engine.expand_prompt(prompt, seed) for seed in range(20)]
+            batched = engine.expand_batch([prompt] * 20, list(range(20)))
+        finally:
+            engine.disable_metrics()
+            result_cache.resize(maxsize)
+        stats = engine.stage_stats()
+        stages = stats['stages']
+        print(stage_metrics.format(stats))
+
+        if batched == expected:
+            print("  [PASS] Results unchanged by instrumentation")
+        else:
+            print("  [FAIL] Results changed by instrumentation")
+
+        counts = {name: stage['count'] for name, stage in stages.items()}
+        if counts['batch'] == 21 and counts['template'] == 21 and counts['cleanup'] == 40 \
+                and counts['resolve_random'] == 40 and counts['load'] >= 21:
+            print("  [PASS] Stage counts match expansions")
+        else:
+            print(f"  [FAIL] Unexpected counts: {counts}")
+
+        if all(stage['p50_us'] <= stage['p99_us'] <= stage['max_us'] for stage in stages.values() if stage['count']):
+            print("  [PASS] p50 <= p99 <= max")
+        else:
+            print("  [FAIL] Inconsistent percentiles")
+
+        if 0.0 < stats['yaml_cache']['hit_rate'] < 1.0 and 'hit_rate' in stats['template_cache']:
+            print("  [PASS] Cache hit rates included")
+        else:
+            print("  [FAIL] Cache hit rates missing")
+
+        print("-" * 80)
+
+        # Test 4: Dump to console and JSON
+        print("\nTest 4: Dump")
+        path = os.path.join(temp_dir, 'metrics.json')
+        output = io.StringIO()
+        with redirect_stdout(output):
+            stage_metrics.dump(path)
+            log.flush()
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if 'resolve_random' in output.getvalue() and saved['stages']['batch']['count'] == 21:
+            print("  [PASS] Dumped to console and JSON")
+        else:
+            print("  [FAIL] Dump incomplete")
+
+        # ログレベルがwarning以上なら表示しない
+        quiet = io.StringIO()
+        level = log.logger.level
+        with redirect_stdout(quiet):
+            log.configure(level="warning")
+            try:
+                stage_metrics.dump()
+                log.flush()
+            finally:
+                log.configure(level=level)
+        if quiet.getvalue() == "":
+            print("  [PASS] Dump follows the log level")
+        else:
+            print("  [FAIL] Dump ignored the log level")
+    finally:
+        stage_metrics.reset()
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Stage Metrics Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_stage_metrics()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the streaming expansion generator and writer stages
+"""
+
+import csv
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import shutil
+import tracemalloc
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation import stream
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.__main__ import main
+
+
+class NullSink:
+    """書き込まれた文字数だけを数える出力先"""
+
+    def __init__(self):
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+
+
+def test_streaming():
+    """Test laziness, bounded memory and the JSONL/CSV/text writers"""
+
+    print("=" * 80)
+    print("Testing Streaming Expansion")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write('beach:\n  prompt: "beach, \\"sunny\\""\n  exclude: [hat]\n')
+            f.write("room:\n  prompt: room\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        template = "@characters:random\n@situations:random, masterpiece"
+
+        # Test 1: Results match expand_prompt and an infinite seed source works
+        print("\nTest 1: Lazy generator")
+        pulled = []
+
+        def seeds():
+            for seed in itertools.count():
+                pulled.append(seed)
+                yield seed
+
+        results = list(itertools.islice(engine.iter_expansions(template, seeds(), chunk_size=100), 250))
+        expected = [(seed, engine.expand_prompt(template, seed)) for seed in range(250)]
+        print(f"Seeds pulled for 250 results: {len(pulled)}")
+        if results == expected and len(pulled) == 300:
+            print("  [PASS] Matches expand_prompt, seeds pulled one chunk at a time")
+        else:
+            print("  [FAIL] Generator not lazy or results differ")
+
+        print("-" * 80)
+
+        # Test 2: Memory stays flat regardless of the number of seeds
+        print("\nTest 2: Bounded memory")
+        peaks = []
+        for count in (5_000, 50_000):
+            sink = NullSink()
+            tracemalloc.start()
+            try:
+                written = stream.write_records(engine.iter_expansions(template, range(count), chunk_size=500),
+                                               sink, "jsonl")
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            peaks.append(peak)
+            print(f"{written} prompts, {sink.chars} chars written, peak {peak / 1024:.0f} KiB")
+        if peaks[1] < peaks[0] * 2 and peaks[1] < 4 * 1024 * 1024:
+            print("  [PASS] Peak memory independent of the seed count")
+        else:
+            print("  [FAIL] Memory grows with the seed count")
+
+        print("-" * 80)
+
+        # Test 3: Writer formats
+        print("\nTest 3: Formats")
+        records = list(engine.iter_expansions(template, range(50)))
+        output = io.StringIO()
+        stream.write_records(records, output, "jsonl", template_index=2)
+        jsonl_ok = [json.loads(line) for line in output.getvalue().splitlines()] == [
+            {"template": 2, "seed": seed, "prompt": prompt} for seed, prompt in records]
+
+        output = io.StringIO()
+        stream.write_records(iter(records), output, "csv", batch_size=7)
+        rows = list(csv.reader(io.StringIO(output.getvalue())))
+        csv_ok = rows[0] == list(stream.CSV_HEADER) and rows[1:] == [
+            ["0", str(seed), prompt] for seed, prompt in records]
+
+        # textはバックスラッシュ・改行・CRをエスケープし、元のプロンプトに戻せる
+        tricky = records + [(-1, "literal \\n, real\nnewline\r\nend\\")]
+        output = io.StringIO()
+        stream.write_records(tricky, output, "text")
+        lines = output.getvalue().split("\n")[:-1]
+        text_ok = len(lines) == len(tricky) and [stream.unescape_text(line) for line in lines] == [
+            prompt for _, prompt in tricky]
+
+        if jsonl_ok and csv_ok and text_ok:
+            print("  [PASS] JSONL, CSV (with quotes and newlines) and text round-trip")
+        else:
+            print(f"  [FAIL] jsonl={jsonl_ok} csv={csv_ok} text={text_ok}")
+
+        print("-" * 80)
+
+        # Test 4: CLI output formats
+        print("\nTest 4: CLI --format")
+        path = os.path.join(temp_dir, 'prompts.csv')
+        status = main(["expand", "--data-dir", temp_dir, "--template", template, "--count", "50",
+                       "--jobs", "1", "--format", "csv", "--output", path])
+        with open(path, encoding='utf-8', newline='') as f:
+            cli_rows = list(csv.reader(f))
+        if status == 0 and cli_rows == rows:
+            print("  [PASS] CLI writes the same CSV")
+        else:
+            print("  [FAIL] CLI CSV differs")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Streaming Expansion Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_streaming()
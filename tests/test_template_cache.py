@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the compiled prompt template cache
+"""
+
+import os
+import sys
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript, PromptTemplate, template_cache
+
+def test_template_cache():
+    """Test template compilation, cache hits and LRU eviction"""
+
+    script = CharaSituationScript()
+    original_size = template_cache.maxsize
+
+    print("=" * 80)
+    print("Testing Prompt Template Cache")
+    print("=" * 80)
+
+    try:
+        # Test 1: Template splits literals and tag slots
+        print("\nTest 1: Template compilation")
+        template = PromptTemplate("a, @characters:reimu, b\n@situations/sub:random c")
+        print(f"Literals: {template.literals}")
+        print(f"Slots:    {template.slots}")
+
+        if template.literals == ("a, ", ", b\n", " c") and template.slots == (
+                ("@characters:reimu", "characters", "reimu", None),
+                ("@situations/sub:random", "situations/sub", "random", None)):
+            print("  [PASS] Literals and slots extracted")
+        else:
+            print("  [FAIL] Unexpected template structure")
+
+        if template.render(["X", "Y"]) == "a, X, b\nY c":
+            print("  [PASS] Render joins segments")
+        else:
+            print("  [FAIL] Render output wrong")
+
+        print("-" * 80)
+
+        # Test 2: Repeated prompts hit the cache
+        print("\nTest 2: Repeated expansion hits the cache")
+        template_cache.resize(16)
+        prompt = "@characters:reimu @situations:beach template cache test"
+        before = template_cache.stats()
+        for seed in range(10):
+            script.expand_prompt(prompt, seed)
+        after = template_cache.stats()
+        print(f"Stats: {after}")
+
+        if after['misses'] - before['misses'] <= 1 and after['hits'] - before['hits'] >= 9:
+            print("  [PASS] Prompt compiled once")
+        else:
+            print("  [FAIL] Prompt compiled more than once")
+
+        print("-" * 80)
+
+        # Test 3: LRU eviction respects the configured size
+        print("\nTest 3: LRU eviction")
+        template_cache.resize(2)
+        for i in range(5):
+            script.expand_prompt(f"@characters:reimu eviction {i}", 1)
+        stats = template_cache.stats()
+        print(f"Stats: {stats}")
+
+        if stats['size'] <= 2 and stats['evictions'] >= 3:
+            print("  [PASS] Cache bounded by maxsize")
+        else:
+            print("  [FAIL] Cache grew past maxsize")
+
+        print("-" * 80)
+
+        # Test 4: Tags are substituted at their own position
+        print("\nTest 4: Positional substitution")
+        prompt4 = "@characters:reimux, @characters:reimu"
+        result4 = script.expand_prompt(prompt4, 1)
+        print(f"Input:  {prompt4}")
+        print(f"Output: {result4}")
+
+        if result4.startswith("@characters:reimux, 1girl"):
+            print("  [PASS] Unresolved tag left untouched, resolved tag expanded in place")
+        else:
+            print("  [FAIL] Substitution not positional")
+
+        print("-" * 80)
+
+    finally:
+        template_cache.resize(original_size)
+
+    print("\n" + "=" * 80)
+    print("Template Cache Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_template_cache()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stress test: expand_prompt from many threads while the data files are replaced on disk
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import shutil
+import threading
+import time
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation import datafile
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+from lib_chara_situation.results import result_cache
+
+READERS = 8
+DURATION = 1.0
+TEMPLATE = "@characters:random, @characters:random, @situations:random"
+
+CHARA_VERSION = re.compile(r'_v(\d+)\b')
+SITUATION_VERSION = re.compile(r'_w(\d+)\b')
+
+
+def write_atomic(path, text):
+    """エディタの保存と同じく、一時ファイルに書いてから置き換える"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def characters(version):
+    # 版ごとにキーの数も変える（キーの一覧と内容が別の版にならないことを確認する）
+    lines = []
+    for i in range(20 + version % 7):
+        lines.append(f"c{i}:\n  base: 1girl, c{i}_v{version}\n  hair: h{i}_v{version}\n  outfit: o{i}_v{version}\n")
+    return "".join(lines)
+
+
+def situations(version):
+    # 偶数の版はexclude、奇数の版はinclude（ルールと内容が別の版にならないことを確認する）
+    rule = "exclude: [outfit]" if version % 2 == 0 else "include: [base]"
+    return "".join(f"s{j}:\n  prompt: s{j}_w{version}, place_w{version}\n  {rule}\n" for j in range(3 + version % 4))
+
+
+def check(result):
+    """1つのファイルの2つの版が混ざっていないか確認する（問題があればその内容を返す）"""
+    chara_versions = set(CHARA_VERSION.findall(result))
+    situation_versions = set(SITUATION_VERSION.findall(result))
+    if len(chara_versions) != 1 or len(situation_versions) != 1:
+        return f"mixed versions: {result}"
+    situation_version = int(situation_versions.pop())
+    if situation_version % 2 == 0:
+        if re.search(r'\bo\d+_v', result) or len(re.findall(r'\bh\d+_v', result)) != 2:
+            return f"exclude rule not applied consistently: {result}"
+    elif re.search(r'\b[ho]\d+_v', result):
+        return f"include rule not applied consistently: {result}"
+    return None
+
+
+def run_stress(label, data_dir, **options):
+    """ファイルを置き換え続けながら複数のスレッドで展開する"""
+    write_atomic(os.path.join(data_dir, 'characters.yaml'), characters(0))
+    write_atomic(os.path.join(data_dir, 'situations.yaml'), situations(0))
+    engine = ExpansionEngine(data_dir, pack_mode="off", prewarm="off", **options)
+    engine.log_expansions = False
+
+    stop = threading.Event()
+    errors = []
+    counts = [0] * READERS
+    versions = [0]
+
+    def reader(index):
+        rng = random.Random(index)
+        try:
+            while not stop.is_set():
+                if index % 2 == 0:
+                    results = [engine.expand_prompt(TEMPLATE, rng.randrange(1 << 30))]
+                else:
+                    results = engine.expand_batch([TEMPLATE] * 8, [rng.randrange(64) for _ in range(8)])
+                for result in results:
+                    problem = check(result)
+                    if problem is not None:
+                        errors.append(problem)
+                counts[index] += len(results)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    def writer():
+        version = 0
+        while not stop.is_set():
+            version += 1
+            write_atomic(os.path.join(data_dir, 'characters.yaml'), characters(version))
+            write_atomic(os.path.join(data_dir, 'situations.yaml'), situations(version))
+            versions[0] = version
+            time.sleep(0.002)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(READERS)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(DURATION)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    # 書き換えが止まった後は最後の版が使われる（監視の場合は変更の通知を待つ）
+    final = str(versions[0])
+    deadline = time.monotonic() + 5
+    while True:
+        result = engine.expand_prompt(TEMPLATE, 1)
+        latest = CHARA_VERSION.findall(result) + SITUATION_VERSION.findall(result)
+        if set(latest) == {final} or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    total = sum(counts)
+    print(f"{label}: {total} expansions, {versions[0]} file versions, {len(errors)} problems, "
+          f"{yaml_cache.stats()['retries']} reloads after concurrent edits")
+    for problem in errors[:3]:
+        print(f"    {problem}")
+    if not errors and total > 0 and set(latest) == {final}:
+        print(f"  [PASS] No torn reads ({label}), final version visible")
+    else:
+        print(f"  [FAIL] Torn reads or stale data ({label})")
+
+
+def check_replaced_during_load(data_dir):
+    """読み込み中にファイルが置き換えられた場合、古いstampで新しい内容をキャッシュしない"""
+    path = os.path.join(data_dir, 'characters.yaml')
+    write_atomic(path, characters(1))
+    original_parse = datafile.parse_yaml_file
+    replaced = []
+
+    def parse_while_replacing(parse_path):
+        if not replaced:
+            # 1回目の読み込みの直前に次の版に置き換える
+            write_atomic(path, characters(2))
+            replaced.append(True)
+        return original_parse(parse_path)
+
+    datafile.parse_yaml_file = parse_while_replacing
+    try:
+        retries = yaml_cache.stats()['retries']
+        data_file = yaml_cache.get(path)
+    finally:
+        datafile.parse_yaml_file = original_parse
+
+    st = os.stat(path)
+    stamp_matches = data_file.stamp == (st.st_mtime_ns, st.st_size, st.st_ino)
+    content_matches = set(data_file.keys) == {f"c{i}" for i in range(20 + 2 % 7)}
+    print(f"stamp matches file: {stamp_matches}, content is version 2: {content_matches}, "
+          f"reloads: {yaml_cache.stats()['retries'] - retries}")
+    if stamp_matches and content_matches and yaml_cache.get(path) is data_file:
+        print("  [PASS] Reloaded the new version with its own stamp")
+    else:
+        print("  [FAIL] Cached content does not match its stamp")
+
+
+def test_thread_safety():
+    """Test that concurrent expansions never mix two versions of one file"""
+
+    print("=" * 80)
+    print("Testing Thread Safety")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    # スレッドの切り替えを頻繁にして、読み込みと書き換えが重なりやすくする
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        configs = [
+            ("stat", dict(watch_mode="off")),
+            ("lazy", dict(watch_mode="off", lazy_load=True)),
+            ("watch", dict(watch_mode="on")),
+        ]
+        for number, (label, options) in enumerate(configs, 1):
+            print(f"\nTest {number}: {READERS} readers while files are replaced ({label})")
+            data_dir = os.path.join(temp_dir, label)
+            os.makedirs(data_dir)
+            yaml_cache.invalidate()
+            result_cache.clear()
+            run_stress(label, data_dir, **options)
+            print("-" * 80)
+
+        print(f"\nTest {len(configs) + 1}: File replaced while it is being parsed")
+        data_dir = os.path.join(temp_dir, 'replace')
+        os.makedirs(data_dir)
+        check_replaced_during_load(data_dir)
+        print("-" * 80)
+    finally:
+        sys.setswitchinterval(switch_interval)
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("\n" + "=" * 80)
+    print("Thread Safety Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_thread_safety()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the vectorised bulk expansion (compat and hash modes)
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+# Add project directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, project_dir)
+
+from lib_chara_situation import vectorized
+from lib_chara_situation.engine import ExpansionEngine
+from lib_chara_situation.datafile import yaml_cache
+
+TEMPLATES = [
+    "@characters:random, @situations:random",
+    "2girls, @characters:random, @characters:random[tag=touhou]\n@situations:random, @effects:random",
+    "masterpiece, @characters:reimu, @situations:beach",
+    "@characters:random, @missing:random, @characters:nobody",
+    "no tags here",
+]
+
+def test_vectorized():
+    """Test that compat mode matches expand_prompt and hash mode is deterministic"""
+
+    print("=" * 80)
+    print("Testing Vectorised Expansion")
+    print("=" * 80)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(temp_dir, 'characters.yaml'), 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl, reimu\n  hair: black hair\n  tag: touhou\n")
+            f.write("marisa:\n  base: 1girl, marisa\n  hat: witch hat\n  weight: 3\n  tag: touhou\n")
+            f.write("sanae:\n  base: 1girl, sanae\n  hair: green hair\n  weight: 0.5\n")
+        with open(os.path.join(temp_dir, 'situations.yaml'), 'w', encoding='utf-8') as f:
+            f.write("beach:\n  prompt: beach, ocean\n  exclude: [hat]\n")
+            f.write("bedroom:\n  prompt: bedroom\n  include: [base]\n")
+            f.write("forest:\n  prompt: forest\n")
+        with open(os.path.join(temp_dir, 'effects.yaml'), 'w', encoding='utf-8') as f:
+            f.write("rain: rain, wet\nsnow: snow\nsunset: sunset\n")
+
+        engine = ExpansionEngine(temp_dir, pack_mode="off", watch_mode="off", prewarm="off")
+        engine.log_expansions = False
+        seeds = list(range(-50, 2000)) + [2**40 + 7, 2**63 - 1]
+
+        # Test 1: Compat mode reproduces expand_prompt exactly
+        print("\nTest 1: Compat mode")
+        mismatches = 0
+        for template in TEMPLATES:
+            expected = [engine.expand_prompt(template, seed) for seed in seeds]
+            if vectorized.expand_seeds(engine, template, seeds) != expected:
+                mismatches += 1
+                print(f"  mismatch: {template!r}")
+        if mismatches == 0:
+            print(f"  [PASS] {len(TEMPLATES)} templates x {len(seeds)} seeds identical to expand_prompt")
+        else:
+            print(f"  [FAIL] {mismatches} templates differ")
+
+        print("-" * 80)
+
+        # Test 2: Each combination is rendered once
+        print("\nTest 2: Grouping")
+        calls = []
+        expand_chosen = engine._expand_chosen
+
+        def counting(plan, chosen, *args, **kwargs):
+            calls.append(chosen)
+            return expand_chosen(plan, chosen, *args, **kwargs)
+
+        engine._expand_chosen = counting
+        try:
+            for mode in vectorized.MODES:
+                calls.clear()
+                results = vectorized.expand_seeds(engine, TEMPLATES[0], seeds, mode)
+                print(f"{mode}: {len(seeds)} seeds, {len(calls)} renders, {len(set(results))} distinct prompts")
+                if len(calls) == len(set(calls)) and len(calls) <= 9:
+                    print(f"  [PASS] {mode}: one render per combination")
+                else:
+                    print(f"  [FAIL] {mode}: combinations rendered more than once")
+        finally:
+            del engine._expand_chosen
+
+        print("-" * 80)
+
+        # Test 3: Hash mode is per-seed deterministic and respects filters and weights
+        print("\nTest 3: Hash mode")
+        template = TEMPLATES[1]
+        whole = vectorized.expand_seeds(engine, template, seeds, "hash")
+        split = (vectorized.expand_seeds(engine, template, seeds[:777], "hash")
+                 + vectorized.expand_seeds(engine, template, seeds[777:], "hash"))
+        single = [vectorized.expand_seeds(engine, template, [seed], "hash")[0] for seed in seeds[:200]]
+        if whole == split and whole[:200] == single:
+            print("  [PASS] Choices depend only on the seed")
+        else:
+            print("  [FAIL] Choices depend on the batch")
+
+        filtered_ok = all(prompt.split("\n")[0].count("reimu") + prompt.split("\n")[0].count("marisa") >= 1
+                          for prompt in whole)
+        marisa = sum('marisa' in prompt
+                     for prompt in vectorized.expand_seeds(engine, "@characters:random", range(20000), "hash"))
+        print(f"marisa share: {marisa / 20000:.3f} (weight 3 of 4.5)")
+        if filtered_ok and 0.63 < marisa / 20000 < 0.70:
+            print("  [PASS] Filters and weights applied")
+        else:
+            print("  [FAIL] Filters or weights ignored")
+
+        print("-" * 80)
+
+        # Test 4: NumPy and pure-Python hash paths agree
+        print("\nTest 4: NumPy path")
+        np = vectorized._get_numpy()
+        if not np:
+            print("  [SKIP] NumPy not installed")
+        else:
+            vectorized._numpy = False
+            try:
+                pure = [vectorized.expand_seeds(engine, t, seeds, "hash") for t in TEMPLATES]
+            finally:
+                vectorized._numpy = np
+            vectorised = [vectorized.expand_seeds(engine, t, np.array(seeds, dtype=np.int64), "hash")
+                          for t in TEMPLATES]
+            # seedは下位64ビットだけを使う（int64に収まらないseedも同じ結果になる）
+            large = [2**63, 2**64 - 1, 2**64 + 5, -1]
+            vectorized._numpy = False
+            try:
+                pure_large = [vectorized.expand_seeds(engine, t, large, "hash") for t in TEMPLATES]
+            finally:
+                vectorized._numpy = np
+            vectorised_large = [vectorized.expand_seeds(engine, t, large, "hash") for t in TEMPLATES]
+            if pure == vectorised and pure_large == vectorised_large:
+                print("  [PASS] NumPy and Python produce identical choices")
+            else:
+                print("  [FAIL] NumPy and Python differ")
+    finally:
+        yaml_cache.invalidate()
+        shutil.rmtree(temp_dir)
+
+    print("-" * 80)
+
+    print("\n" + "=" * 80)
+    print("Vectorised Expansion Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_vectorized()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for weighted and filtered random selection
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+from chara_situation import CharaSituationScript
+
+def test_weighted_random():
+    """Test weight: fields and random[field=value] filters"""
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        chars_content = """reimu:
+  base: reimu_base
+  tag: touhou, shrine
+  weight: 3
+marisa:
+  base: marisa_base
+  tag: [touhou, witch]
+  weight: 1
+miku:
+  base: miku_base
+  tag: vocaloid
+  weight: 0
+"""
+        with open(os.path.join(temp_dir, 'wchars.yaml'), 'w', encoding='utf-8') as f:
+            f.write(chars_content)
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+
+        print("=" * 80)
+        print("Testing Weighted and Filtered Random Selection")
+        print("=" * 80)
+
+        # Test 1: Weighted draws follow the weights
+        print("\nTest 1: Weighted random selection")
+        counts = {'reimu_base': 0, 'marisa_base': 0, 'miku_base': 0}
+        results = script.expand_batch(["@wchars:random"] * 4000, range(4000))
+        for result in results:
+            counts[result] += 1
+        print(f"Counts: {counts}")
+
+        if counts['miku_base'] == 0:
+            print("  [PASS] weight: 0 entry never selected")
+        else:
+            print("  [FAIL] weight: 0 entry selected")
+
+        ratio = counts['reimu_base'] / max(counts['marisa_base'], 1)
+        if 2.5 < ratio < 3.5:
+            print(f"  [PASS] reimu:marisa ratio {ratio:.2f} close to 3")
+        else:
+            print(f"  [FAIL] reimu:marisa ratio {ratio:.2f} not close to 3")
+
+        print("-" * 80)
+
+        # Test 2: Filtered draws only return matching entries
+        print("\nTest 2: Filtered random selection")
+        results = set(script.expand_batch(["@wchars:random[tag=witch]"] * 50, range(50)))
+        print(f"Results: {results}")
+        if results == {'marisa_base'}:
+            print("  [PASS] Only entries tagged 'witch' selected")
+        else:
+            print("  [FAIL] Filter not applied")
+
+        results = set(script.expand_batch(["@wchars:random[tag=touhou, base=reimu_base]"] * 50, range(50)))
+        if results == {'reimu_base'}:
+            print("  [PASS] Multiple conditions combined")
+        else:
+            print("  [FAIL] Multiple conditions not combined")
+
+        print("-" * 80)
+
+        # Test 3: Metadata fields are not written to the prompt
+        print("\nTest 3: Metadata fields not expanded")
+        result3 = script.expand_prompt("@wchars:reimu", 1)
+        print(f"Output: {result3}")
+        if result3 == 'reimu_base':
+            print("  [PASS] tag and weight fields omitted")
+        else:
+            print("  [FAIL] Metadata fields found in output")
+
+        print("-" * 80)
+
+        # Test 4: Unmatched filters leave the tag unexpanded
+        print("\nTest 4: Unmatched and non-filter brackets")
+        result4 = script.expand_prompt("@wchars:random[tag=none] x", 1)
+        print(f"Output: {result4}")
+        if result4 == "@wchars:random[tag=none] x":
+            print("  [PASS] Unmatched filter left unexpanded")
+        else:
+            print("  [FAIL] Unexpected expansion")
+
+        # Brackets that are not filters (e.g. prompt editing) stay after a plain random draw
+        plain = script.expand_prompt("@wchars:random", 1)
+        result5 = script.expand_prompt("@wchars:random[oops] x", 1)
+        result6 = script.expand_prompt("@wchars:random[a:b:0.5] x", 1)
+        print(f"Output: {result5}")
+        print(f"Output: {result6}")
+        if result5 == f"{plain}[oops] x" and result6 == f"{plain}[a:b:0.5] x":
+            print("  [PASS] Non-filter brackets kept after plain random")
+        else:
+            print("  [FAIL] Non-filter brackets not kept")
+
+        print("-" * 80)
+
+        # Test 5: Non-finite and non-numeric weights count as weight 1
+        print("\nTest 5: Invalid weights")
+        with open(os.path.join(temp_dir, 'nanw.yaml'), 'w', encoding='utf-8') as f:
+            f.write("a:\n  base: a\n  weight: .nan\nb:\n  base: b\n  weight: 1\nc:\n  base: c\n  weight: .inf\n")
+        with open(os.path.join(temp_dir, 'plain.yaml'), 'w', encoding='utf-8') as f:
+            f.write("a:\n  base: a\nb:\n  base: b\nc:\n  base: c\n")
+        with open(os.path.join(temp_dir, 'stray.yaml'), 'w', encoding='utf-8') as f:
+            f.write("a:\n  base: a\n  weight: heavy\nb:\n  base: b\nc:\n  base: c\n")
+
+        nan_file = script.load_data_file('nanw')
+        weights = [nan_file.entries[key].weight for key in nan_file.keys]
+        if weights == [None, 1.0, None]:
+            print("  [PASS] .nan and .inf weights ignored")
+        else:
+            print(f"  [FAIL] Weights: {weights}")
+
+        plain = script.expand_batch(["@plain:random"] * 200, range(200))
+        stray = script.expand_batch(["@stray:random"] * 200, range(200))
+        if not script.load_data_file('stray').weighted and stray == plain:
+            print("  [PASS] Non-numeric weight keeps the unweighted seed mapping")
+        else:
+            print("  [FAIL] Non-numeric weight changed the seed mapping")
+
+        print("-" * 80)
+
+        print("\n" + "=" * 80)
+        print("Weighted Random Test Complete")
+        print("=" * 80)
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test_weighted_random()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the libyaml / pure-Python YAML loader selection
+"""
+
+import os
+import sys
+import glob
+import yaml
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+import chara_situation
+from lib_chara_situation import yamlio
+
+def test_yaml_backend():
+    """Test that both YAML loaders produce identical data"""
+
+    print("=" * 80)
+    print("Testing YAML Loader Backend")
+    print("=" * 80)
+
+    print(f"\nActive backend: {yamlio.BACKEND}")
+    if hasattr(yaml, 'CSafeLoader'):
+        if yamlio.BACKEND == 'libyaml' and yamlio.SafeLoader is yaml.CSafeLoader:
+            print("  [PASS] CSafeLoader preferred when available")
+        else:
+            print("  [FAIL] CSafeLoader available but not used")
+    else:
+        print("  [SKIP] PyYAML built without libyaml")
+        return
+
+    # Array and string values as covered by test_array_values.py
+    documents = {
+        'array values': """alice:
+  base: 1girl
+  hair:
+    - blonde hair
+    - short hair
+    - blue ribbon
+  eye: blue eyes
+  outfit: [blue dress, white apron, hairband]
+casual:
+  prompt: outdoors, street, sunny
+  exclude:
+    - outfit
+""",
+        'scalars': """a:
+  num: 12
+  float: 0.5
+  bool: yes
+  null_value:
+  lora: <lora:test:0.8>, 1girl
+  quoted: "@characters:reimu"
+12: twelve
+日本語: 値
+""",
+    }
+    for path in sorted(glob.glob(os.path.join(project_dir, 'data', '**', '*.yaml'), recursive=True)):
+        with open(path, 'r', encoding='utf-8') as f:
+            documents[os.path.relpath(path, project_dir)] = f.read()
+
+    print("\nComparing SafeLoader and CSafeLoader:")
+    for name, text in documents.items():
+        python_data = yamlio.parse_text(text, yaml.SafeLoader)
+        c_data = yamlio.parse_text(text, yaml.CSafeLoader)
+        if python_data == c_data:
+            print(f"  [PASS] {name}: identical")
+        else:
+            print(f"  [FAIL] {name}: loaders disagree")
+
+    print("\n" + "=" * 80)
+    print("YAML Backend Test Complete")
+    print("=" * 80)
+
+if __name__ == '__main__':
+    test_yaml_backend()
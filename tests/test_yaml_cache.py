@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Test script for the stat-validated YAML cache
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+# Mock modules.scripts for standalone testing
+class MockScript:
+    pass
+
+class MockScripts:
+    AlwaysVisible = True
+    Script = MockScript
+
+sys.modules['modules'] = type(sys)('modules')
+sys.modules['modules.scripts'] = MockScripts()
+
+# Add scripts directory to path
+test_dir = os.path.dirname(os.path.abspath(__file__))
+project_dir = os.path.dirname(test_dir)
+sys.path.insert(0, os.path.join(project_dir, 'scripts'))
+
+# Background pre-warm loads would be counted in the cache stats below
+os.environ['CHARA_SITUATION_PREWARM'] = 'off'
+
+from chara_situation import CharaSituationScript, yaml_cache
+
+def test_yaml_cache():
+    """Test that unchanged files are served from the cache and edits are picked up"""
+
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        chars_path = os.path.join(temp_dir, 'cache_chars.yaml')
+        with open(chars_path, 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl\n  hair: black hair\n")
+
+        script = CharaSituationScript()
+        script.data_dir = temp_dir
+
+        print("=" * 80)
+        print("Testing YAML Cache")
+        print("=" * 80)
+
+        # Test 1: Repeated loads hit the cache
+        print("\nTest 1: Repeated loads of an unchanged file")
+        before = yaml_cache.stats()
+        for _ in range(5):
+            result1 = script.expand_prompt("@cache_chars:reimu @cache_chars:reimu", 12345)
+        after = yaml_cache.stats()
+        print(f"Output: {result1}")
+        print(f"Stats:  {after}")
+
+        if after['misses'] - before['misses'] == 1:
+            print("  [PASS] File parsed only once")
+        else:
+            print("  [FAIL] File parsed more than once")
+
+        if after['hits'] - before['hits'] == 4:
+            print("  [PASS] Subsequent expansions served from cache")
+        else:
+            print("  [FAIL] Unexpected cache hit count")
+
+        print("-" * 80)
+
+        # Test 2: Edits are picked up immediately
+        print("\nTest 2: Edited file is re-parsed")
+        with open(chars_path, 'w', encoding='utf-8') as f:
+            f.write("reimu:\n  base: 1girl\n  hair: white hair, long hair\n")
+
+        result2 = script.expand_prompt("@cache_chars:reimu", 12345)
+        print(f"Output: {result2}")
+
+        if 'white hair' in result2 and 'black hair' not in result2:
+            print("  [PASS] Edit reflected without restart")
+        else:
+            print("  [FAIL] Stale data returned after edit")
+
+        if yaml_cache.stats()['reparses'] - after['reparses'] == 1:
+            print("  [PASS] Re-parse counted")
+        else:
+            print("  [FAIL] Re-parse not counted")
+
+        print("-" * 80)
+
+        # Test 3: Explicit invalidation
+        print("\nTest 3: Explicit invalidation")
+        script.invalidate_cache('cache_chars')
+        before = yaml_cache.stats()
+        script.expand_prompt("@cache_chars:reimu", 12345)
+        after = yaml_cache.stats()
+
+        if after['misses'] - before['misses'] == 1:
+            print("  [PASS] Invalidated file loaded again")
+        else:
+            print("  [FAIL] Invalidated file still cached")
+
+        print("-" * 80)
+
+        print("\n" + "=" * 80)
+        print("YAML Cache Test Complete")
+        print("=" * 80)
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == '__main__':
+    test_yaml_cache()